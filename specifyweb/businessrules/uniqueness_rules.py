@@ -10,6 +10,7 @@ from specifyweb.specify import models
 from specifyweb.specify.datamodel import datamodel
 from specifyweb.middleware.general import serialize_django_obj
 from specifyweb.specify.scoping import in_same_scope
+from specifyweb.specify.batch_cache import batch_memoize
 from .orm_signal_handler import orm_signal_handler
 from .exceptions import BusinessRuleException
 from .models import UniquenessRule
@@ -29,25 +30,21 @@ logger = logging.getLogger(__name__)
 @orm_signal_handler('pre_save', None, dispatch_uid=UNIQUENESS_DISPATCH_UID)
 def check_unique(model, instance):
     model_name = instance.__class__.__name__
-    rules = UniquenessRule.objects.filter(modelName=model_name)
-    applied_migrations = MigrationRecorder(
-        connections['default']).applied_migrations()
-
-    for migration in applied_migrations:
-        app, migration_name = migration
-        if app == 'businessrules' and migration_name == '0001_initial':
-            break
-    else:
+    if not batch_memoize('uniqueness_rules_migrated', uniqueness_rules_migrated):
         return
 
-    for rule in rules:
-        if not rule_is_global(tuple(field.fieldPath for field in rule.fields.filter(isScope=True))) and not in_same_scope(rule, instance):
+    rules = batch_memoize(('uniqueness_rules', model_name), lambda: [
+        (rule, list(rule.fields.filter(isScope=True)), list(rule.fields.filter(isScope=False)))
+        for rule in UniquenessRule.objects.filter(modelName=model_name)
+    ])
+
+    for rule, _scope, rule_fields in rules:
+        if not rule_is_global(tuple(field.fieldPath for field in _scope)) and not in_same_scope(rule, instance):
             continue
 
         field_names = [
-            field.fieldPath.lower() for field in rule.fields.filter(isScope=False)]
+            field.fieldPath.lower() for field in rule_fields]
 
-        _scope = rule.fields.filter(isScope=True)
         scope = None if len(_scope) == 0 else _scope[0]
 
         all_fields = [*field_names]
@@ -109,6 +106,14 @@ def check_unique(model, instance):
             raise get_exception(conflicts, matchable, field_map)
 
 
+def uniqueness_rules_migrated() -> bool:
+    applied_migrations = MigrationRecorder(
+        connections['default']).applied_migrations()
+
+    return any(app == 'businessrules' and migration_name == '0001_initial'
+               for app, migration_name in applied_migrations)
+
+
 def field_path_with_value(instance, model_name: str, field_path: str, default):
     object_or_field = reduce(lambda obj, field: getattr(
         obj, field, default), field_path.split('__'), instance)
@@ -7,12 +7,18 @@ database or the filesystem with database resources taking precedence over the fi
 import errno
 import logging
 import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from xml.etree import ElementTree
 from xml.sax.saxutils import quoteattr
 
 from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import signals
 
-from specifyweb.specify.models import Spappresourcedir, Spappresourcedata
+from specifyweb.specify.models import Spappresource, Spappresourcedir, Spappresourcedata
 
 logger = logging.getLogger(__name__)
 
@@ -49,10 +55,137 @@ FORM_RESOURCE_EXCLUDED_LST = [
     "backstop/preferences.views.xml",
 ]
 
+class CachedResolution(NamedTuple):
+    # The app resources version when the resource was resolved.
+    version: Tuple
+    # The modification times of the files read while resolving.
+    files: Tuple[Tuple[str, Optional[float]], ...]
+    # The level the resource was found at or None.
+    level: Optional[str]
+    result: Optional[Tuple]
+
+_resolutions: Dict[Tuple, CachedResolution] = {}
+_resolutions_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0}
+
+def app_resource_cache_stats() -> Dict[str, int]:
+    "Return the hit and miss counts of the app resource resolution cache."
+    with _resolutions_lock:
+        return dict(_cache_stats, size=len(_resolutions))
+
+def clear_app_resource_cache() -> None:
+    global _database_version
+    with _resolutions_lock:
+        _resolutions.clear()
+    with _database_version_lock:
+        _database_version = None
+
+GENERATION_KEY = 'app-resources-generation'
+
+_database_version: Optional[Tuple[float, Tuple]] = None
+_database_version_lock = threading.Lock()
+
+def version_seconds() -> float:
+    return getattr(settings, 'APP_RESOURCE_VERSION_SECONDS', 10)
+
+def generation_cache():
+    return caches[getattr(settings, 'APP_RESOURCE_CACHE_ALIAS', 'default')]
+
+def bump_generation() -> None:
+    cache = generation_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+def app_resources_written(sender, **kwargs) -> None:
+    """Bump the app resources generation now and again when the current
+    transaction commits, so resolutions made concurrently with the
+    write are not kept either.
+    """
+    if kwargs.get('raw', False):
+        return
+    bump_generation()
+    transaction.on_commit(bump_generation)
+
+for resource_model in (Spappresource, Spappresourcedata, Spappresourcedir):
+    signals.post_save.connect(app_resources_written, sender=resource_model, dispatch_uid='app-resources-save-' + resource_model.__name__)
+    signals.post_delete.connect(app_resources_written, sender=resource_model, dispatch_uid='app-resources-delete-' + resource_model.__name__)
+
+def database_version() -> Tuple:
+    """Return the latest modification times and counts of the app
+    resources, their data and the resource directories, read from the
+    database at most once every APP_RESOURCE_VERSION_SECONDS.
+    """
+    global _database_version
+    now = time.monotonic()
+    with _database_version_lock:
+        if _database_version is not None and now - _database_version[0] < version_seconds():
+            return _database_version[1]
+
+    cursor = connection.cursor()
+    cursor.execute("""
+    select
+      (select max(timestampmodified) from spappresource),
+      (select count(*) from spappresource),
+      (select max(timestampmodified) from spappresourcedata),
+      (select count(*) from spappresourcedata),
+      (select max(timestampmodified) from spappresourcedir),
+      (select count(*) from spappresourcedir)
+    """)
+    version = tuple(cursor.fetchone())
+    with _database_version_lock:
+        _database_version = (now, version)
+    return version
+
+def app_resources_version() -> Tuple:
+    """Return a value that changes whenever an app resource, its data
+    or a resource directory is saved or deleted.
+
+    Saves and deletes made through Specify 7 bump a generation kept in
+    the APP_RESOURCE_CACHE_ALIAS Django cache, which every process sees
+    immediately when that cache is shared. Writes made otherwise, e.g.
+    by Specify 6, are picked up from the database modification times
+    within APP_RESOURCE_VERSION_SECONDS.
+    """
+    return (generation_cache().get(GENERATION_KEY, None), database_version())
+
+def file_mtime(pathname: str) -> Optional[float]:
+    try:
+        return os.stat(pathname).st_mtime
+    except OSError:
+        return None
+
 # get_app_resource is the main interface provided by this module
 def get_app_resource(collection, user, resource_name):
     """Fetch the named app resource in the context of the given user and collection.
     Returns the resource data and mimetype as a pair.
+
+    Resolutions are cached per process until the app resources in the
+    database or the files that were read change.
+    """
+    key = (collection and collection.id, user and user.id, get_usertype(user), resource_name)
+    version = app_resources_version()
+    with _resolutions_lock:
+        cached = _resolutions.get(key, None)
+    if cached is not None and cached.version == version \
+       and all(file_mtime(pathname) == mtime for pathname, mtime in cached.files):
+        with _resolutions_lock:
+            _cache_stats['hits'] += 1
+        return cached.result
+
+    files: List[str] = []
+    level, result = resolve_app_resource(collection, user, resource_name, files)
+    with _resolutions_lock:
+        _cache_stats['misses'] += 1
+        _resolutions[key] = CachedResolution(
+            version, tuple((pathname, file_mtime(pathname)) for pathname in files), level, result)
+    return result
+
+def resolve_app_resource(collection, user, resource_name, files: Optional[List[str]]=None):
+    """Find the named app resource by traversing the hierarchy.
+    Returns the level it was found at and the resource data, mimetype
+    and id. The names of the files read are appended to 'files'.
     """
     logger.info('looking for app resource %r for user %s in %s',
                 resource_name, user and user.name, collection and collection.collectionname)
@@ -60,30 +193,32 @@ def get_app_resource(collection, user, resource_name):
     for level in DIR_LEVELS:
         # First look in the database.
         from_db = get_app_resource_from_db(collection, user, level, resource_name)
-        if from_db is not None: return from_db
+        if from_db is not None: return level, from_db
 
         # If resource was not found, look on the filesystem.
-        from_fs = load_resource_at_level(collection, user, level, resource_name)
-        if from_fs is not None: return from_fs
+        from_fs = load_resource_at_level(collection, user, level, resource_name, files)
+        if from_fs is not None: return level, from_fs
         # Continue to next higher level of hierarchy.
 
     # resource was not found
-    return None
+    return None, None
 
 def get_usertype(user):
     return user and user.usertype and user.usertype.replace(' ', '').lower()
 
-def load_resource_at_level(collection, user, level, resource_name):
+def load_resource_at_level(collection, user, level, resource_name, files: Optional[List[str]]=None):
     """Try to load a resource from the filesystem at a given
     level of the resource hierarchy.
     Returns the resource data and mimetype as a pair.
+    The names of the files read are appended to 'files' if given.
     """
     logger.info('looking in FS at level: %s', level)
     path = get_path_for_level(collection, user, level)
     if path is None: return None
+    if files is not None: files.append(os.path.join(path, 'app_resources.xml'))
     registry = load_registry(path)
     if registry is None: return None
-    return load_resource(path, registry, resource_name)
+    return load_resource(path, registry, resource_name, files)
 
 def get_path_for_level(collection, user, level):
     """Build the filesystem path for a given resource level."""
@@ -113,7 +248,7 @@ def load_registry(path, registry_filename='app_resources.xml'):
         if e.errno == errno.ENOENT: return None
         else: raise
 
-def load_resource(path, registry, resource_name):
+def load_resource(path, registry, resource_name, files: Optional[List[str]]=None):
     """Try to load the named resource using the given directory
     and registry.
     Returns the resource data and mimetype as a pair.
@@ -121,6 +256,7 @@ def load_resource(path, registry, resource_name):
     resource = registry.find('file[@name=%s]' % quoteattr(resource_name))
     if resource is None: return None
     pathname = os.path.join(path, resource.attrib['file'])
+    if files is not None: files.append(pathname)
     try:
         return open(pathname).read(), resource.attrib['mimetype'], None
     except IOError as e:
@@ -5,7 +5,8 @@ from jsonschema import validate  # type: ignore
 from jsonschema.exceptions import ValidationError  # type: ignore
 
 from specifyweb.specify.api_tests import ApiTests
-from . import viewsets
+from specifyweb.specify.models import Spappresource, Spappresourcedir
+from . import app_resource, viewsets
 
 
 class ViewTests(ApiTests):
@@ -19,6 +20,35 @@ class ViewTests(ApiTests):
     def test_get_view(self):
         viewsets.get_view(self.collection, self.specifyuser, "CollectionObject")
 
+class AppResourceCacheTests(ApiTests):
+    def test_resolution_cached_until_changed(self):
+        app_resource.clear_app_resource_cache()
+        before = app_resource.app_resource_cache_stats()
+        first = app_resource.get_app_resource(self.collection, self.specifyuser, 'DataObjFormatters')
+        self.assertEqual(app_resource.get_app_resource(self.collection, self.specifyuser, 'DataObjFormatters'), first)
+        stats = app_resource.app_resource_cache_stats()
+        self.assertEqual(stats['misses'], before['misses'] + 1)
+        self.assertEqual(stats['hits'], before['hits'] + 1)
+
+        directory = Spappresourcedir.objects.create(
+            collection=self.collection, discipline=self.discipline, ispersonal=False)
+        resource = Spappresource.objects.create(
+            spappresourcedir=directory, level=0, name='DataObjFormatters',
+            mimetype='text/xml', specifyuser=self.specifyuser)
+        resource.spappresourcedatas.create(data='<formatters/>')
+
+        data, mimetype, resource_id = app_resource.get_app_resource(self.collection, self.specifyuser, 'DataObjFormatters')
+        self.assertEqual((data, resource_id), ('<formatters/>', resource.id))
+
+        with self.assertNumQueries(0):
+            app_resource.get_app_resource(self.collection, self.specifyuser, 'DataObjFormatters')
+
+        resource_data = resource.spappresourcedatas.get()
+        resource_data.data = '<formatters></formatters>'
+        resource_data.save()
+        data, mimetype, resource_id = app_resource.get_app_resource(self.collection, self.specifyuser, 'DataObjFormatters')
+        self.assertEqual(data, '<formatters></formatters>', "saving the data invalidates the resolution at once")
+
 class OpenApiTests(TestCase):
     def test_operations_spec(self) -> None:
         from .views import generate_openapi_for_endpoints
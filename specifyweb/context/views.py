@@ -428,7 +428,7 @@ def datamodel(request):
     from specifyweb.specify.models import datamodel
     global datamodel_json
     if datamodel_json is None:
-        datamodel_json = datamodel_to_json(datamodel)
+        datamodel_json = datamodel.serialized or datamodel_to_json(datamodel)
 
     return HttpResponse(datamodel_json, content_type='application/json')
 
@@ -3,6 +3,7 @@ Implements the express search mechanism
 """
 
 import logging
+from contextlib import ExitStack
 from functools import reduce
 from xml.etree import ElementTree
 
@@ -14,7 +15,7 @@ from specifyweb.middleware.general import require_GET
 from .search_terms import parse_search_str
 from ..context.app_resource import get_app_resource
 from ..permissions.permissions import check_table_permissions
-from ..specify.api import toJson
+from ..specify.api import toJson, json_stream_response, StreamedList, STREAM_BATCH_SIZE
 from ..specify.models import datamodel, Collection
 from ..specify.views import login_maybe_required
 from ..stored_queries import models
@@ -64,12 +65,15 @@ def make_fieldspecs(searchtable):
             for fieldname in searchtable.findall('.//displayfield/fieldName')]
 
 
-def run_primary_search(session, searchtable, terms, collection, user, limit, offset):
+def run_primary_search(session, searchtable, terms, collection, user, limit, offset, stream=False):
     query = build_primary_query(session, searchtable, terms, collection, user)
 
     if query is not None:
         total_count = query.count()
-        results = list(query.limit(limit).offset(offset))
+        query = query.limit(limit).offset(offset)
+        # Streamed results are fetched only when they are written out, so the
+        # server side cursors of the different tables are used one at a time.
+        results = StreamedList(query.yield_per(STREAM_BATCH_SIZE)) if stream else list(query)
     else:
         total_count = 0
         results = []
@@ -87,6 +91,8 @@ class SearchForm(forms.Form):
     name = forms.CharField(required=False)
     limit = forms.IntegerField(required=False)
     offset = forms.IntegerField(required=False)
+    stream = forms.ChoiceField(choices=(('true', 'true'), ('false', 'false')),
+                               required=False)
 
     def clean_limit(self):
         limit = self.cleaned_data['limit']
@@ -105,6 +111,7 @@ def search(request):
     'name' = restrict to the table 'name'
     'limit' = number of results to return
     'offest' = offset into results
+    'stream' = if 'true', stream the results as they are fetched
     """
     form = SearchForm(request.GET)
     if not form.is_valid():
@@ -118,13 +125,18 @@ def search(request):
     specific_table = form.cleaned_data['name'].lower()
     limit = form.cleaned_data['limit']
     offset = form.cleaned_data['offset']
+    stream = form.cleaned_data['stream'] == 'true'
 
-    with models.session_context() as session:
-        results = [run_primary_search(session, searchtable, terms, collection, user, limit, offset)
+    with ExitStack() as stack:
+        session = stack.enter_context(models.session_context())
+        results = [run_primary_search(session, searchtable, terms, collection, user, limit, offset, stream)
                    for searchtable in express_search_config.findall('tables/searchtable')
                    if specific_table == "" or searchtable.find('tableName').text.lower() == specific_table]
 
         result = {k: v for r in results for (k,v) in list(r.items())}
+        if stream:
+            # The response takes over closing the session.
+            return json_stream_response(result, close=stack.pop_all().close)
         return HttpResponse(toJson(result), content_type='application/json')
 
 class RelatedSearchForm(SearchForm):
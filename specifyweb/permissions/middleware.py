@@ -3,14 +3,15 @@ from typing import Optional
 from django import http
 
 from .permissions import PermissionsException, NoMatchingRuleException, \
-    CollectionAccessPT, check_permission_targets
+    CollectionAccessPT, check_permission_targets, permissions_cache
 
 class PermissionsMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        response = self.get_response(request)
+        with permissions_cache():
+            response = self.get_response(request)
         return response
 
     def process_view(self, request, view_func, view_args, view_kwargs):
@@ -1,9 +1,16 @@
-from typing import Any, Callable, Tuple, List, Dict, Union, Iterable, Optional, NamedTuple
+from typing import Any, Callable, Tuple, List, Dict, Union, Iterable, Optional, NamedTuple, Pattern
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import re
+import threading
+import time
 
 import logging
 logger = logging.getLogger(__name__)
 
-from django.db import connection
+from django.conf import settings
+from django.db import connection, transaction
 from django.db.models import Model
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -124,7 +131,152 @@ class QueryResult(NamedTuple):
 def query_pt(collectionid: Optional[int], userid: int, target: PermissionTargetAction) -> QueryResult:
     return query(collectionid, userid, target.resource(), target.action())
 
+def like_to_regex(pattern: str) -> Pattern:
+    """Compile the SQL LIKE 'pattern' to an equivalent regular expression.
+    Matching is case insensitive like the default MySQL collation.
+    """
+    parts = []
+    chars = iter(pattern)
+    for c in chars:
+        if c == '%':
+            parts.append('.*')
+        elif c == '_':
+            parts.append('.')
+        elif c == '\\':
+            parts.append(re.escape(next(chars, '\\')))
+        else:
+            parts.append(re.escape(c))
+    return re.compile(''.join(parts), re.IGNORECASE | re.DOTALL)
+
+def literal_prefix(pattern: str) -> str:
+    "Return the part of the LIKE 'pattern' before the first wildcard."
+    match = re.search(r'[%_\\]', pattern)
+    return (pattern if match is None else pattern[:match.start()]).lower()
+
+PolicyIndex = Dict[str, List[Tuple[Pattern, Pattern, Dict]]]
+
+class PolicyMatcher:
+    """The user and role policies applying to a user in a collection,
+    compiled so that permission queries can be answered without going
+    back to the database.
+
+    Policies are indexed by the literal prefix of their resource pattern,
+    so only policies whose prefix is a prefix of the queried resource have
+    to be matched.
+    """
+    def __init__(self, user_policies: List[Dict], role_policies: List[Dict]):
+        self.user_policies = self._index(user_policies)
+        self.role_policies = self._index(role_policies)
+
+    @staticmethod
+    def _index(policies: List[Dict]) -> PolicyIndex:
+        index: PolicyIndex = defaultdict(list)
+        for p in policies:
+            index[literal_prefix(p['resource'])].append(
+                (like_to_regex(p['resource']), like_to_regex(p['action']), p)
+            )
+        return dict(index)
+
+    @staticmethod
+    def _matching(index: PolicyIndex, resource: str, action: str) -> List[Dict]:
+        key = resource.lower()
+        return [
+            policy
+            for i in range(len(key) + 1)
+            for resource_re, action_re, policy in index.get(key[:i], [])
+            if resource_re.fullmatch(resource) and action_re.fullmatch(action)
+        ]
+
+    def query(self, resource: str, action: str) -> QueryResult:
+        ups = self._matching(self.user_policies, resource, action)
+        rps = self._matching(self.role_policies, resource, action)
+        return QueryResult(
+            allowed=bool(ups) or bool(rps),
+            matching_user_policies=ups,
+            matching_role_policies=rps,
+        )
+
+class _RequestCache(NamedTuple):
+    decisions: Dict[PermRequest, QueryResult]
+    matchers: Dict[Tuple[Optional[int], int], PolicyMatcher]
+
+# Permission decisions and policies memoized for the duration of the
+# current request. None when no request scope is active.
+_request_cache: ContextVar[Optional[_RequestCache]] = ContextVar('permissions_request_cache', default=None)
+
+# Optional per process cache of (expiry time, policies). Entries live for
+# settings.PERMISSIONS_CACHE_TTL seconds. Changes made in other processes
+# are only seen after the entries expire.
+_process_cache: Dict[Tuple[Optional[int], int], Tuple[float, PolicyMatcher]] = {}
+_process_cache_lock = threading.Lock()
+
+@contextmanager
+def permissions_cache():
+    "Memoize permission decisions made within the context."
+    token = _request_cache.set(_RequestCache({}, {}))
+    try:
+        yield
+    finally:
+        _request_cache.reset(token)
+
+def invalidate_permissions_cache() -> None:
+    """Drop memoized permission decisions. Should be called whenever
+    policies, roles or role assignments are changed.
+    """
+    _clear_caches()
+    # A concurrent request could repopulate the process cache from the
+    # pre-commit state, so clear it again once the change is visible.
+    transaction.on_commit(_clear_caches)
+
+def _clear_caches() -> None:
+    cache = _request_cache.get()
+    if cache is not None:
+        cache.decisions.clear()
+        cache.matchers.clear()
+    with _process_cache_lock:
+        _process_cache.clear()
+
 def query(collectionid: Optional[int], userid: int, resource: str, action: str) -> QueryResult:
+    request = PermRequest(collectionid, userid, resource, action)
+
+    cache = _request_cache.get()
+    if cache is not None and request in cache.decisions:
+        return cache.decisions[request]
+
+    result = get_policy_matcher(collectionid, userid).query(resource, action)
+
+    if cache is not None:
+        cache.decisions[request] = result
+    return result
+
+def get_policy_matcher(collectionid: Optional[int], userid: int) -> PolicyMatcher:
+    key = (collectionid, userid)
+
+    cache = _request_cache.get()
+    if cache is not None and key in cache.matchers:
+        return cache.matchers[key]
+
+    ttl = getattr(settings, 'PERMISSIONS_CACHE_TTL', 0)
+    matcher = _process_cache_get(key) if ttl > 0 else None
+    if matcher is None:
+        matcher = load_policies(collectionid, userid)
+        if ttl > 0:
+            with _process_cache_lock:
+                _process_cache[key] = (time.monotonic() + ttl, matcher)
+
+    if cache is not None:
+        cache.matchers[key] = matcher
+    return matcher
+
+def _process_cache_get(key: Tuple[Optional[int], int]) -> Optional[PolicyMatcher]:
+    with _process_cache_lock:
+        entry = _process_cache.get(key)
+    if entry is None:
+        return None
+    expires, matcher = entry
+    return matcher if time.monotonic() < expires else None
+
+def load_policies(collectionid: Optional[int], userid: int) -> PolicyMatcher:
     cursor = connection.cursor()
 
     cursor.execute("""
@@ -132,13 +284,9 @@ def query(collectionid: Optional[int], userid: int, resource: str, action: str)
     from spuserpolicy
     where (collection_id = %(collectionid)s or collection_id is null)
     and (specifyuser_id = %(userid)s or specifyuser_id is null)
-    and %(resource)s like resource
-    and %(action)s like action
     """, {
         'collectionid': collectionid,
         'userid': userid,
-        'resource': resource,
-        'action': action
     })
 
     ups = [
@@ -153,13 +301,9 @@ def query(collectionid: Optional[int], userid: int, resource: str, action: str)
     join sprolepolicy rp on rp.role_id = r.id
     where ur.specifyuser_id = %(userid)s
     and collection_id = %(collectionid)s
-    and %(resource)s like resource
-    and %(action)s like action
     """, {
         'collectionid': collectionid,
         'userid': userid,
-        'resource': resource,
-        'action': action
     })
 
     rps = [
@@ -167,11 +311,7 @@ def query(collectionid: Optional[int], userid: int, resource: str, action: str)
         for r in cursor.fetchall()
     ]
 
-    return QueryResult(
-        allowed=bool(ups) or bool(rps),
-        matching_user_policies=ups,
-        matching_role_policies=rps,
-    )
+    return PolicyMatcher(ups, rps)
 
 
 def check_table_permissions(collection, actor, obj, action: str) -> None:
@@ -518,3 +518,52 @@ class PermissionsApiTest(ApiTests):
             content_type='application/json',
         )
         self.assertEqual(response.status_code, 204)
+
+class PermissionsCacheTest(ApiTests):
+    def setUp(self):
+        super(PermissionsCacheTest, self).setUp()
+        initialize.wipe_permissions()
+
+    def test_request_cache(self) -> None:
+        with permissions.permissions_cache():
+            with self.assertNumQueries(2):
+                self.assertFalse(permissions.query(self.collection.id, self.specifyuser.id, '/table/agent', 'read').allowed)
+                self.assertFalse(permissions.query(self.collection.id, self.specifyuser.id, '/table/agent', 'read').allowed)
+
+            models.UserPolicy.objects.create(
+                collection=self.collection,
+                specifyuser=self.specifyuser,
+                resource='/table/%',
+                action='read',
+            )
+            permissions.invalidate_permissions_cache()
+            self.assertTrue(permissions.query(self.collection.id, self.specifyuser.id, '/table/agent', 'read').allowed)
+
+    def test_no_cache_outside_request(self) -> None:
+        with self.assertNumQueries(4):
+            permissions.query(self.collection.id, self.specifyuser.id, '/table/agent', 'read')
+            permissions.query(self.collection.id, self.specifyuser.id, '/table/agent', 'read')
+
+class PolicyMatcherTest(TestCase):
+    def test_like_semantics(self) -> None:
+        matcher = permissions.PolicyMatcher([
+            {'collectionid': None, 'userid': 1, 'resource': '/table/%', 'action': 'read'},
+            {'collectionid': None, 'userid': 1, 'resource': '/field/agent/_ame', 'action': '%'},
+            {'collectionid': None, 'userid': 1, 'resource': '/record/with\\_underscore', 'action': 'update'},
+        ], [
+            {'roleid': 1, 'rolename': 'role', 'resource': '%', 'action': 'delete'},
+        ])
+
+        self.assertTrue(matcher.query('/table/agent', 'read').allowed)
+        self.assertTrue(matcher.query('/TABLE/Agent', 'READ').allowed)
+        self.assertFalse(matcher.query('/table/agent', 'update').allowed)
+        self.assertTrue(matcher.query('/field/agent/name', 'update').allowed)
+        self.assertFalse(matcher.query('/field/agent/lastname', 'update').allowed)
+        self.assertTrue(matcher.query('/record/with_underscore', 'update').allowed)
+        self.assertFalse(matcher.query('/record/withxunderscore', 'update').allowed)
+
+        result = matcher.query('/table/agent', 'delete')
+        self.assertEqual(result.matching_user_policies, [])
+        self.assertEqual(result.matching_role_policies, [
+            {'roleid': 1, 'rolename': 'role', 'resource': '%', 'action': 'delete'},
+        ])
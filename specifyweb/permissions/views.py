@@ -11,7 +11,8 @@ from specifyweb.specify import models as spmodels
 from specifyweb.specify.views import openapi, check_collection_access_against_agents
 from . import models
 from .permissions import PermissionTarget, PermissionTargetAction, \
-    NoAdminUsersException, check_permission_targets, registry, query
+    NoAdminUsersException, check_permission_targets, registry, query, \
+    invalidate_permissions_cache
 
 Specifyuser = getattr(spmodels, "Specifyuser")
 
@@ -244,6 +245,8 @@ class UserPolicies(LoginRequiredMixin, View):
                         resource=resource,
                         action=action)
 
+            invalidate_permissions_cache()
+
             if not models.UserPolicy.objects.filter(collection__isnull=True, resource='%', action='%').exists():
                 raise NoAdminUsersException()
 
@@ -478,6 +481,8 @@ class UserRoles(LoginRequiredMixin, View):
                     role_id=role['id'],
                     specifyuser_id=userid)
 
+            invalidate_permissions_cache()
+
             check_collection_access_against_agents(userid)
 
         return http.HttpResponse('', status=204)
@@ -576,6 +581,8 @@ class Role(LoginRequiredMixin, View):
                 for action in actions:
                     r.policies.create(resource=resource, action=action)
 
+            invalidate_permissions_cache()
+
             affected_users = Specifyuser.objects.select_for_update().filter(roles__role=r).values_list('id', flat=True)
             for userid in affected_users:
                 check_collection_access_against_agents(userid)
@@ -587,6 +594,7 @@ class Role(LoginRequiredMixin, View):
         check_permission_targets(r.collection_id, request.specify_user.id, [RolePT.delete])
         affected_users = Specifyuser.objects.select_for_update().filter(roles__role=r).values_list('id', flat=True)
         r.delete()
+        invalidate_permissions_cache()
         # don't need to check collection access against agents because removing a role cannot give access to more collections
         # at least without there being DENY policies
         return http.HttpResponse('', status=204)
@@ -195,6 +195,7 @@ def run_query(collection, user, query_json):
     except ValueError as e:
         raise ReportException(e)
     spquery['limit'] = 0
+    spquery['cacheresults'] = getattr(settings, 'REPORT_QUERY_RESULT_CACHE', False)
 
     report_fields = ['id'] + [
         field['stringid']
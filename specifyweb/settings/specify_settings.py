@@ -75,6 +75,52 @@ WB_UPLOAD_LOG_DIR = "/home/specify/wb_upload_logs"
 # exports and Darwin Core archives.
 DEPOSITORY_DIR = '/home/specify/specify_depository'
 
+# The parsed datamodel is kept in a snapshot in this directory so that
+# new processes do not have to parse specify_datamodel.xml again. The
+# snapshot is rewritten when the XML or the Specify 7 build changes.
+# Defaults to the build directory of the Specify 7 checkout. It must not
+# be a served or shared directory such as DEPOSITORY_DIR, since the
+# snapshot is unpickled. Set DATAMODEL_SNAPSHOT to False to always parse
+# the XML.
+DATAMODEL_SNAPSHOT = True
+DATAMODEL_SNAPSHOT_DIR = None
+
+# Query results exported to CSV are written by the database server
+# with SELECT ... INTO OUTFILE when this is True. The database server
+# must see DEPOSITORY_DIR at the same path and its user needs the FILE
+# privilege there. Exports fall back to fetching the rows otherwise.
+QUERY_EXPORT_INTO_OUTFILE = False
+
+# Number of query results kept per process for queries that ask for
+# their results to be cached, the total number of rows they may hold and
+# the number of seconds they are kept. Cached results are dropped when
+# the tables they were read from are written. The write generations are
+# kept in the QUERY_RESULT_CACHE_ALIAS Django cache, so writes made
+# through other processes are only seen before the results expire when
+# that cache is shared, e.g. memcached, redis or the database cache.
+# Set the size to 0 to disable.
+QUERY_RESULT_CACHE_SIZE = 128
+QUERY_RESULT_CACHE_MAX_ROWS = 100000
+QUERY_RESULT_CACHE_SECONDS = 300
+QUERY_RESULT_CACHE_ALIAS = 'default'
+
+# Cache the query results of reports and labels. Only enable this when
+# QUERY_RESULT_CACHE_ALIAS is shared between all the Specify 7 processes,
+# otherwise reports can print data up to QUERY_RESULT_CACHE_SECONDS old.
+REPORT_QUERY_RESULT_CACHE = False
+
+# Bulk API requests creating at least this many tree nodes renumber the
+# trees once after applying the whole batch, instead of opening a node
+# number interval for every node created.
+BULK_DEFERRED_TREE_NUMBERING_MIN_NODES = 100
+
+# App resources saved or deleted through Specify 7 are seen by every
+# process at once when APP_RESOURCE_CACHE_ALIAS is a shared Django cache.
+# Changes made outside of it, e.g. by Specify 6, are checked for in the
+# database at most once every APP_RESOURCE_VERSION_SECONDS.
+APP_RESOURCE_VERSION_SECONDS = 10
+APP_RESOURCE_CACHE_ALIAS = 'default'
+
 # Old notifications are deleted after this many days.
 # If DEPOSITORY_DIR is being cleaned out with a
 # scheduled job, this interval should be shorter
@@ -84,6 +130,12 @@ NOTIFICATION_TTL_DAYS = 7
 
 DISABLE_AUDITING = False
 
+# Permission decisions are always cached for the duration of a request.
+# Setting this to a number of seconds also caches them per process for
+# that long. Policy changes made through other processes may then take
+# up to that long to be seen.
+PERMISSIONS_CACHE_TTL = 0
+
 # Configure OpenID Connect SSO by defining
 # identity providers below. An empty dict
 # disables OIC login.
@@ -2,21 +2,31 @@
 Implements the RESTful business data API
 """
 
+import contextvars
+import hashlib
 import json
 import logging
 import re
-from typing import Any, Dict, List, Optional, Tuple, Iterable, Union, \
-    Callable
+from collections import defaultdict
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Tuple, Iterable, \
+    Iterator, Union, Callable
 from urllib.parse import urlencode
 
 from typing_extensions import TypedDict
 
 logger = logging.getLogger(__name__)
 
+from MySQLdb.cursors import SSCursor
 from django import forms
-from django.db import transaction
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import prefetch_related_objects
 from django.http import (HttpResponse, HttpResponseBadRequest,
-                         Http404, HttpResponseNotAllowed, QueryDict)
+                         Http404, HttpResponseNotAllowed, QueryDict,
+                         HttpResponseNotModified, StreamingHttpResponse)
+from django.utils.http import parse_etags
 from django.core.exceptions import ObjectDoesNotExist, FieldError, FieldDoesNotExist
 from django.db.models.fields import DateTimeField, FloatField, DecimalField
 
@@ -27,7 +37,11 @@ from .autonumbering import autonumber_and_save
 from .uiformatters import AutonumberOverflowException
 from .filter_by_col import filter_by_collection
 from .auditlog import auditlog
-from .calculated_fields import calculate_extra_fields
+from .batch_cache import batch_scope
+from .calculated_fields import calculate_extra_fields, calculated_fields_version
+from .tree_extras import Tree, deferred_tree_numbering
+from .pagination import CursorError, decode_cursor, filter_after, keyset_order, \
+    key_values, cursor_for, estimate_count
 
 ReadPermChecker = Callable[[Any], None]
 
@@ -61,6 +75,83 @@ class JsonEncoder(json.JSONEncoder):
 def toJson(obj: Any) -> str:
     return json.dumps(obj, cls=JsonEncoder)
 
+# Number of records fetched and serialized at a time when streaming.
+STREAM_BATCH_SIZE = 2000
+
+# Approximate size of the chunks written to streamed responses.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class StreamedList(object):
+    """Wraps an iterable which stream_json writes out as a JSON array
+    one item at a time instead of materializing it as a list.
+    """
+    def __init__(self, items: Iterable[Any]):
+        self.items = items
+
+def stream_json(obj: Any) -> Iterator[str]:
+    """Incrementally encode 'obj' as JSON, yielding chunks of about
+    STREAM_CHUNK_SIZE characters. Values wrapped in StreamedList are
+    consumed lazily.
+    """
+    chunk: List[str] = []
+    size = 0
+    for piece in _iterencode(obj):
+        chunk.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+def _iterencode(obj: Any) -> Iterator[str]:
+    if isinstance(obj, StreamedList):
+        yield '['
+        for i, item in enumerate(obj.items):
+            if i > 0: yield ', '
+            yield toJson(item)
+        yield ']'
+    elif isinstance(obj, dict):
+        yield '{'
+        for i, (key, value) in enumerate(obj.items()):
+            if i > 0: yield ', '
+            yield json.dumps(str(key)) + ': '
+            yield from _iterencode(value)
+        yield '}'
+    else:
+        yield toJson(obj)
+
+class _ClosingIterator(object):
+    """Iterator with a close method, which Django calls when the
+    response is finished, even if iteration never started.
+
+    The content is produced in a copy of the context the response was
+    created in, so request scoped state such as the permissions cache
+    remains available after the view has returned.
+    """
+    def __init__(self, iterator: Iterator[str], close: Optional[Callable[[], None]]):
+        self.iterator = iterator
+        self.context = contextvars.copy_context()
+        self._close = close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        return self.context.run(next, self.iterator)
+
+    def close(self) -> None:
+        if self._close is not None:
+            self._close()
+
+def json_stream_response(obj: Any, close: Optional[Callable[[], None]]=None, **kwargs) -> StreamingHttpResponse:
+    """Return a response streaming 'obj' as JSON. The 'close' callback,
+    if given, is called once the response is finished and can be used to
+    release resources such as database sessions the content depends on.
+    """
+    return StreamingHttpResponse(_ClosingIterator(stream_json(obj), close),
+                                 content_type='application/json', **kwargs)
+
 class RecordSetException(Exception):
     """Raised for problems related to record sets."""
     pass
@@ -89,6 +180,15 @@ class OrderByError(Exception):
     """Raised for bad fields in order by clause."""
     pass
 
+class BulkOperationException(Exception):
+    """Raised when one of the operations of a bulk request fails,
+    causing the whole batch to be rolled back.
+    """
+    def __init__(self, index: int, exception: Exception):
+        super(BulkOperationException, self).__init__(index, exception)
+        self.index = index
+        self.exception = exception
+
 class HttpResponseCreated(HttpResponse):
     """Returned to the client when a POST request succeeds and a new
     resource is created.
@@ -119,8 +219,31 @@ def resource_dispatch(request, model, id) -> HttpResponse:
 
     # Dispatch on the request type.
     if request.method == 'GET':
-        data = get_resource(model, id, checker, request.GET.get('recordsetid', None))
-        resp = HttpResponse(toJson(data), content_type='application/json')
+        serialization_params = SerializationForm(request.GET)
+        if not serialization_params.is_valid():
+            return HttpResponseBadRequest(toJson(serialization_params.errors),
+                                          content_type='application/json')
+        serialization = serialization_params.serialization()
+        recordsetid = request.GET.get('recordsetid', None)
+        model = get_model_or_404(model) if isinstance(model, str) else model
+        obj = get_object_or_404(select_columns(model.objects.filter(id=int(id)), serialization))
+        prefetch_dependents([obj], serialization)
+
+        # The recordset info can change without the resource changing,
+        # so the tag is only taken before serializing without it.
+        etag = resource_etag(obj, serialization) if recordsetid is None else None
+        if etag is not None and etag_matches(request, etag):
+            for o, _ in walk_dependents(obj, serialization):
+                checker(o)
+            resp = HttpResponseNotModified()
+            resp['ETag'] = etag
+        else:
+            data = obj_to_resource_data(obj, checker, recordsetid, serialization)
+            if etag is not None:
+                resp = HttpResponse(toJson(data), content_type='application/json')
+                resp['ETag'] = etag
+            else:
+                resp = conditional_json_response(request, toJson(data))
 
     elif request.method == 'PUT':
         data = json.load(request)
@@ -150,7 +273,55 @@ def resource_dispatch(request, model, id) -> HttpResponse:
 
     return resp
 
-class GetCollectionForm(forms.Form):
+class Serialization(NamedTuple):
+    """Selects the parts of resources included by _obj_to_data."""
+    # Names of the fields to include. None for all.
+    fields: Optional[FrozenSet[str]] = None
+    # Names of the dependent fields to inline. None for all.
+    expand: Optional[FrozenSet[str]] = None
+    # Levels of dependents to inline. None for no limit.
+    depth: Optional[int] = None
+
+    def includes(self, name: str) -> bool:
+        return self.fields is None or name.lower() in self.fields or name in ALWAYS_SERIALIZED
+
+    def inlines(self, name: str) -> bool:
+        return (self.depth is None or self.depth > 0) \
+            and (self.expand is None or name.lower() in self.expand) \
+            and self.includes(name)
+
+    def nested(self) -> "Serialization":
+        "The serialization of inlined dependents."
+        return Serialization(depth=None if self.depth is None else self.depth - 1)
+
+FULL_SERIALIZATION = Serialization()
+
+# Fields included regardless of the requested fields.
+ALWAYS_SERIALIZED = ('id', 'version')
+
+class SerializationForm(forms.Form):
+    # Comma separated names of the fields to include. All by default.
+    # The id, version and resource_uri are always included.
+    fields = forms.CharField(required=False)
+
+    # Comma separated names of the dependent fields to inline.
+    # All by default. The rest are given as URIs.
+    expand = forms.CharField(required=False)
+
+    # Levels of dependent resources to inline. Unlimited by default.
+    depth = forms.IntegerField(required=False, min_value=0)
+
+    def serialization(self) -> Serialization:
+        return serialization_from_params(self.cleaned_data)
+
+def serialization_from_params(control_params) -> Serialization:
+    "Return the Serialization given by cleaned SerializationForm parameters."
+    def names(param: str) -> Optional[FrozenSet[str]]:
+        value = control_params.get(param, None)
+        return frozenset(n.strip().lower() for n in value.split(',')) if value else None
+    return Serialization(names('fields'), names('expand'), control_params.get('depth', None))
+
+class GetCollectionForm(SerializationForm):
     # Use the logged_in_collection to limit request
     # to relevant items.
     domainfilter = forms.ChoiceField(choices=(('true', 'true'), ('false', 'false')),
@@ -165,11 +336,31 @@ class GetCollectionForm(forms.Form):
 
     orderby = forms.CharField(required=False)
 
+    # Stream the response instead of building it in memory.
+    stream = forms.ChoiceField(choices=(('true', 'true'), ('false', 'false')),
+                               required=False)
+
+    # Return items following the position given by an opaque cursor
+    # from the 'next' meta data of a previous page instead of using
+    # 'offset'. An empty value starts from the beginning.
+    after = forms.CharField(required=False)
+
+    # How to determine the total count. 'estimate' uses the
+    # query optimizer's estimate and 'none' skips it.
+    count = forms.ChoiceField(choices=(('exact', 'exact'), ('estimate', 'estimate'), ('none', 'none')),
+                              required=False)
+
     defaults = dict(
         domainfilter=None,
         limit=0,
         offset=0,
         orderby=None,
+        stream=None,
+        after=None,
+        count=None,
+        fields=None,
+        expand=None,
+        depth=None,
     )
 
     def clean_limit(self):
@@ -180,6 +371,9 @@ class GetCollectionForm(forms.Form):
         offset = self.cleaned_data['offset']
         return 0 if offset is None else offset
 
+    def clean_after(self):
+        return self.cleaned_data['after'] if 'after' in self.data else None
+
 def collection_dispatch(request, model) -> HttpResponse:
     """Handles requests related to collections of resources.
 
@@ -195,12 +389,16 @@ def collection_dispatch(request, model) -> HttpResponse:
         if not control_params.is_valid():
             return HttpResponseBadRequest(toJson(control_params.errors),
                                           content_type='application/json')
+        stream = control_params.cleaned_data['stream'] == 'true'
         try:
             data = get_collection(request.specify_collection, model, checker,
-                                  control_params.cleaned_data, request.GET)
-        except (FilterError, OrderByError) as e:
+                                  control_params.cleaned_data, request.GET, stream)
+        except (FilterError, OrderByError, CursorError) as e:
             return HttpResponseBadRequest(e)
-        resp = HttpResponse(toJson(data), content_type='application/json')
+        if stream:
+            resp = json_stream_response(data)
+        else:
+            resp = conditional_json_response(request, toJson(data))
 
     elif request.method == 'POST':
         obj = post_resource(request.specify_collection,
@@ -216,6 +414,131 @@ def collection_dispatch(request, model) -> HttpResponse:
 
     return resp
 
+def bulk_dispatch(request) -> HttpResponse:
+    """Handles requests applying a list of create, update and delete
+    operations in a single transaction.
+
+    Each operation is a dict with the keys:
+    'operation' - one of 'create', 'update' or 'delete'.
+    'model' - the name of the table of the resource.
+    'id' - the id of the resource to update or delete.
+    'version' - the optimistic locking version for updates and deletes.
+    'data' - the resource data for creates and updates.
+    'recordsetid' - optionally add a created resource to the record set.
+
+    Returns a list with the result of each operation. If any operation
+    fails none are applied and the response describes the failed one.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    operations = json.load(request)
+    if not isinstance(operations, list):
+        return HttpResponseBadRequest('expected a list of operations')
+
+    checker = table_permissions_checker(request.specify_collection, request.specify_user_agent, "read")
+
+    try:
+        results = apply_bulk_operations(request.specify_collection,
+                                        request.specify_user_agent,
+                                        operations, checker)
+    except BulkOperationException as e:
+        status = bulk_error_status(e.exception)
+        if status is None:
+            raise e.exception
+        return HttpResponse(toJson({
+            'index': e.index,
+            'exception': e.exception.__class__.__name__,
+            'message': str(e.exception),
+        }), status=status, content_type='application/json')
+
+    return HttpResponse(toJson(results), content_type='application/json')
+
+def bulk_error_status(exception: Exception) -> Optional[int]:
+    "The HTTP status for a failed bulk operation or None to reraise."
+    from specifyweb.permissions.permissions import PermissionsException
+    if isinstance(exception, StaleObjectException):
+        return 409
+    if isinstance(exception, (MissingVersionException, RecordSetException, BulkRequestError)):
+        return 400
+    if isinstance(exception, Http404):
+        return 404
+    if isinstance(exception, PermissionsException):
+        return exception.status_code
+    return None
+
+class BulkRequestError(Exception):
+    """Raised for malformed operations in a bulk request."""
+    pass
+
+BulkResult = TypedDict('BulkResult', {'status': int, 'resource': Optional[Dict[str, Any]]})
+
+def tree_nodes_created(operations: List[Dict[str, Any]]) -> int:
+    "Return the number of 'operations' creating tree nodes."
+    count = 0
+    for op in operations:
+        if not isinstance(op, dict) or op.get('operation') != 'create':
+            continue
+        model = getattr(models, str(op.get('model', '')).capitalize(), None)
+        if isinstance(model, type) and issubclass(model, Tree):
+            count += 1
+    return count
+
+@transaction.atomic
+def apply_bulk_operations(collection, agent, operations: List[Dict[str, Any]], checker: ReadPermChecker) -> List[BulkResult]:
+    """Apply the given create, update and delete 'operations' in order.
+    Lookups of formatters and business rules are shared across the batch
+    and field level audit log entries are inserted together at the end.
+    When the batch adds at least BULK_DEFERRED_TREE_NUMBERING_MIN_NODES
+    tree nodes the trees changed are renumbered once for the whole batch
+    instead of opening an interval for every node.
+    """
+    defer_numbering = tree_nodes_created(operations) >= \
+        getattr(settings, 'BULK_DEFERRED_TREE_NUMBERING_MIN_NODES', 100)
+    applied: List[Tuple[int, Any]] = []
+    with batch_scope(), auditlog.deferred_field_logs(), \
+         deferred_tree_numbering() if defer_numbering else nullcontext():
+        for index, op in enumerate(operations):
+            try:
+                applied.append(apply_bulk_operation(collection, agent, op))
+            except Exception as e:
+                raise BulkOperationException(index, e)
+
+    # Serialized only now that the trees changed have been renumbered.
+    results: List[BulkResult] = []
+    for index, (status, obj) in enumerate(applied):
+        try:
+            if isinstance(obj, Tree):
+                obj.refresh_from_db(fields=['nodenumber', 'highestchildnodenumber', 'fullname'])
+            results.append({'status': status, 'resource': None if obj is None else _obj_to_data(obj, checker)})
+        except Exception as e:
+            raise BulkOperationException(index, e)
+    return results
+
+def apply_bulk_operation(collection, agent, op: Dict[str, Any]) -> Tuple[int, Any]:
+    "Apply the operation 'op' returning the HTTP status and the affected object, if any."
+    try:
+        operation = op['operation']
+        model = op['model']
+    except (KeyError, TypeError) as e:
+        raise BulkRequestError("operation and model are required: %r" % op)
+
+    if operation == 'create':
+        return 201, post_resource(collection, agent, model, op.get('data', {}), op.get('recordsetid', None))
+
+    if 'id' not in op:
+        raise BulkRequestError("id is required to %s %s" % (operation, model))
+
+    if operation == 'update':
+        data = op.get('data', {})
+        return 200, put_resource(collection, agent, model, op['id'], data.get('version', op.get('version', None)), data)
+
+    if operation == 'delete':
+        delete_resource(collection, agent, model, op['id'], op.get('version', None))
+        return 204, None
+
+    raise BulkRequestError("unknown operation: %r" % operation)
+
 def get_model_or_404(name: str):
     """Lookup a specify model by name. Raise Http404 if not found."""
     try:
@@ -232,14 +555,22 @@ def get_object_or_404(model, *args, **kwargs):
         model = get_model_or_404(model)
     return get_object(model, *args, **kwargs)
 
-def get_resource(name, id, checker: ReadPermChecker, recordsetid=None) -> Dict:
+def get_resource(name, id, checker: ReadPermChecker, recordsetid=None, serialization: Serialization=FULL_SERIALIZATION) -> Dict:
     """Return a dict of the fields from row 'id' in model 'name'.
 
     If given a recordset id, the data will be suplemented with
     data about the resource's relationship to the given record set.
+
+    Only the columns and dependents selected by 'serialization' are
+    loaded and included.
     """
-    obj = get_object_or_404(name, id=int(id))
-    data = _obj_to_data(obj, checker)
+    model = get_model_or_404(name) if isinstance(name, str) else name
+    obj = get_object_or_404(select_columns(model.objects.filter(id=int(id)), serialization))
+    prefetch_dependents([obj], serialization)
+    return obj_to_resource_data(obj, checker, recordsetid, serialization)
+
+def obj_to_resource_data(obj, checker: ReadPermChecker, recordsetid=None, serialization: Serialization=FULL_SERIALIZATION) -> Dict:
+    data = _obj_to_data(obj, checker, serialization)
     if recordsetid is not None:
         data['recordset_info'] = get_recordset_info(obj, recordsetid)
     return data
@@ -702,9 +1033,13 @@ def obj_to_data(obj) -> Dict[str, Any]:
     # read permisions enforcement.
     return _obj_to_data(obj, lambda o: None)
 
-def _obj_to_data(obj, perm_checker: ReadPermChecker) -> Dict[str, Any]:
+def _obj_to_data(obj, perm_checker: ReadPermChecker, serialization: Serialization=FULL_SERIALIZATION) -> Dict[str, Any]:
     """Return a (potentially nested) dictionary of the fields of the
     Django model instance 'obj'.
+
+    The fields included and the dependents inlined are limited by
+    'serialization'. Calculated fields are only included when all
+    fields are.
     """
     perm_checker(obj)
 
@@ -714,43 +1049,207 @@ def _obj_to_data(obj, perm_checker: ReadPermChecker) -> Dict[str, Any]:
         # block out password field from users table
         fields = [f for f in fields if f.name != 'password']
 
-    data = dict((field.name, field_to_val(obj, field, perm_checker))
+    data = dict((field.name, field_to_val(obj, field, perm_checker, serialization))
                 for field in fields
-                if not (field.auto_created or field.one_to_many or field.many_to_many))
+                if not (field.auto_created or field.one_to_many or field.many_to_many)
+                and serialization.includes(field.name))
     # Get *-to-many fields.
-    data.update(dict((ro.get_accessor_name(), to_many_to_data(obj, ro, perm_checker))
+    data.update(dict((ro.get_accessor_name(), to_many_to_data(obj, ro, perm_checker, serialization))
                      for ro in obj._meta.get_fields()
                      if ro.one_to_many
-                     and obj.specify_model.get_field(ro.get_accessor_name()) is not None))
+                     and obj.specify_model.get_field(ro.get_accessor_name()) is not None
+                     and serialization.includes(ro.get_accessor_name())))
     # Add a meta data field with the resource's URI.
     data['resource_uri'] = uri_for_model(obj.__class__.__name__.lower(), obj.id)
 
-    data.update(calculate_extra_fields(obj, data))
+    if serialization.fields is None:
+        data.update(calculate_extra_fields(obj, data))
     return data
 
-def to_many_to_data(obj, rel, checker: ReadPermChecker) -> Union[str, List[Dict[str, Any]]]:
+# Relations read by is_dependent_field() when deciding if a
+# collectingevent or paleocontext is embedded in its parent.
+DEPENDENCE_CONTEXT: Dict[str, List[str]] = {
+    'Collectionobject': ['collection__discipline'],
+    'Collectingevent': ['discipline'],
+    'Locality': ['discipline'],
+}
+
+# *-to-one fields that are dependent only for some collections.
+CONDITIONALLY_DEPENDENT: Dict[str, List[str]] = {
+    'Collectionobject': ['collectingevent', 'paleocontext'],
+    'Collectingevent': ['paleocontext'],
+    'Locality': ['paleocontext'],
+}
+
+@lru_cache(maxsize=None)
+def dependent_relations(model) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Return the names of the *-to-one and *-to-many relations of the
+    Django 'model' which are always inlined by _obj_to_data.
+    """
+    to_ones = tuple(
+        field.name for field in model._meta.get_fields()
+        if (field.many_to_one or (field.one_to_one and not field.auto_created))
+        and is_specify_dependent(model, field.name)
+    )
+    to_manys = tuple(
+        rel.get_accessor_name() for rel in model._meta.get_fields()
+        if rel.one_to_many and is_specify_dependent(model, rel.get_accessor_name())
+    )
+    return to_ones, to_manys
+
+def is_specify_dependent(model, field_name: str) -> bool:
+    field = model.specify_model.get_field(field_name)
+    return field is not None and field.is_relationship and field.dependent
+
+def conditionally_dependent_fields(model) -> List[str]:
+    fields = CONDITIONALLY_DEPENDENT.get(model.__name__, [])
+    return [f for f in fields if has_django_field(model, f)]
+
+def has_django_field(model, field_name: str) -> bool:
+    try:
+        model._meta.get_field(field_name)
+    except FieldDoesNotExist:
+        return False
+    return True
+
+def inlined_relations(model, serialization: Serialization) -> Tuple[Tuple[str, ...], Tuple[str, ...], List[str]]:
+    """Return the names of the *-to-one, *-to-many and conditionally
+    dependent relations of the Django 'model' that 'serialization' inlines.
+    """
+    to_ones, to_manys = dependent_relations(model)
+    if serialization == FULL_SERIALIZATION:
+        return to_ones, to_manys, conditionally_dependent_fields(model)
+    return (
+        tuple(name for name in to_ones if serialization.inlines(name)),
+        tuple(name for name in to_manys if serialization.inlines(name)),
+        [name for name in conditionally_dependent_fields(model) if serialization.inlines(name)],
+    )
+
+def prefetch_dependents(objs: List[Any], serialization: Serialization=FULL_SERIALIZATION) -> None:
+    """Load the dependent object graph below the Django model instances
+    'objs' with one query per relationship per level of nesting, so that
+    _obj_to_data can serialize them without hitting the database for each
+    related object. Only the dependents 'serialization' inlines are loaded.
+    """
+    level = objs
+    while level:
+        by_model: Dict[Any, List[Any]] = defaultdict(list)
+        for obj in level:
+            by_model[obj.__class__].append(obj)
+
+        level = []
+        for model, instances in by_model.items():
+            to_ones, to_manys, conditional = inlined_relations(model, serialization)
+            context = DEPENDENCE_CONTEXT.get(model.__name__, []) if conditional else []
+            prefetch_related_objects(instances, *context, *to_ones, *to_manys)
+
+            for field_name in conditional:
+                embedding = [o for o in instances if is_dependent_field(o, field_name)]
+                prefetch_related_objects(embedding, field_name)
+                level.extend(_f for _f in (getattr(o, field_name) for o in embedding) if _f)
+
+            for obj in instances:
+                level.extend(_f for _f in (getattr(obj, name) for name in to_ones) if _f)
+                for name in to_manys:
+                    level.extend(getattr(obj, name).all())
+
+        serialization = serialization.nested()
+
+def walk_dependents(obj, serialization: Serialization=FULL_SERIALIZATION) -> Iterator[Tuple[Any, Serialization]]:
+    """Yield 'obj' and all the objects inlined in its serialization, each
+    with the serialization it is serialized with. Runs without queries if
+    prefetch_dependents was applied to 'obj'.
+    """
+    yield obj, serialization
+    to_ones, to_manys, conditional = inlined_relations(obj.__class__, serialization)
+    embedded = [f for f in conditional if is_dependent_field(obj, f)]
+    for name in (*to_ones, *embedded):
+        related = getattr(obj, name)
+        if related is not None:
+            yield from walk_dependents(related, serialization.nested())
+    for name in to_manys:
+        for related in getattr(obj, name).all():
+            yield from walk_dependents(related, serialization.nested())
+
+def resource_etag(obj, serialization: Serialization=FULL_SERIALIZATION) -> Optional[str]:
+    """Return a strong ETag for the serialization of 'obj' taken from the
+    versions of it and of its inlined dependents, without serializing
+    it. The calculated fields are covered by calculated_fields_version.
+    Returns None if any of the objects is not versioned.
+    """
+    digest = hashlib.sha1()
+    for o, o_serialization in walk_dependents(obj, serialization):
+        version = getattr(o, 'version', None)
+        if version is None:
+            version = getattr(o, 'timestampmodified', None)
+        if version is None:
+            return None
+        token = [o.__class__.__name__, o.id, version]
+        if o_serialization.fields is None:
+            token.append(calculated_fields_version(o))
+        digest.update(toJson(token).encode())
+    return '"%s"' % digest.hexdigest()
+
+def select_columns(objs, serialization: Serialization):
+    """Defer loading the columns of the queryset 'objs' that are not
+    needed to serialize its objects with 'serialization'.
+    """
+    if serialization.fields is None:
+        return objs
+    model = objs.model
+    needed = {'timestampmodified', *(path.split('__')[0] for path in DEPENDENCE_CONTEXT.get(model.__name__, []))}
+    return objs.only(*(
+        field.name for field in model._meta.concrete_fields
+        if serialization.includes(field.name) or field.name in needed
+    ))
+
+def conditional_json_response(request, body: str) -> HttpResponse:
+    """Return the JSON 'body' tagged with an ETag hashed from it, or
+    304 Not Modified if the request's If-None-Match already has it.
+    Used where no tag can be taken before serializing.
+    """
+    etag = '"%s"' % hashlib.sha1(body.encode()).hexdigest()
+    if etag_matches(request, etag):
+        resp = HttpResponseNotModified()
+    else:
+        resp = HttpResponse(body, content_type='application/json')
+    resp['ETag'] = etag
+    return resp
+
+def etag_matches(request, etag: str) -> bool:
+    "Whether the If-None-Match header of the request matches 'etag' by weak comparison."
+    header = request.META.get('HTTP_IF_NONE_MATCH', None)
+    if header is None:
+        return False
+    tags = parse_etags(header)
+    return '*' in tags or any(strip_weak(t) == strip_weak(etag) for t in tags)
+
+def strip_weak(etag: str) -> str:
+    return etag[2:] if etag.startswith('W/') else etag
+
+def to_many_to_data(obj, rel, checker: ReadPermChecker, serialization: Serialization=FULL_SERIALIZATION) -> Union[str, List[Dict[str, Any]]]:
     """Return the URI or nested data of the 'rel' collection
-    depending on if the field is included in the 'inlined_fields' global.
+    depending on if the field is dependent and inlined by 'serialization'.
     """
     parent_model = rel.model.specify_model
     field_name = rel.get_accessor_name()
     field = parent_model.get_field(field_name)
-    if field is not None and field.dependent:
+    if field is not None and field.dependent and serialization.inlines(field_name):
         objs = getattr(obj, field_name)
-        return [_obj_to_data(o, checker) for o in objs.all()]
+        return [_obj_to_data(o, checker, serialization.nested()) for o in objs.all()]
 
     collection_uri = uri_for_model(rel.related_model)
     return collection_uri + '?' + urlencode([(rel.field.name.lower(), str(obj.id))])
 
-def field_to_val(obj, field, checker: ReadPermChecker) -> Any:
+def field_to_val(obj, field, checker: ReadPermChecker, serialization: Serialization=FULL_SERIALIZATION) -> Any:
     """Return the value or nested data or URI for the given field which should
     be either a regular field or a *-to-one field.
     """
     if field.many_to_one or (field.one_to_one and not field.auto_created):
-        if is_dependent_field(obj, field.name):
+        if serialization.inlines(field.name) and is_dependent_field(obj, field.name):
             related_obj = getattr(obj, field.name)
             if related_obj is None: return None
-            return _obj_to_data(related_obj, checker)
+            return _obj_to_data(related_obj, checker, serialization.nested())
         related_id = getattr(obj, field.name + '_id')
         if related_id is None: return None
         return uri_for_model(field.related_model, related_id)
@@ -760,25 +1259,67 @@ def field_to_val(obj, field, checker: ReadPermChecker) -> Any:
 CollectionPayloadMeta = TypedDict('CollectionPayloadMeta', {
     'limit': int,
     'offset': int,
-    'total_count': int
+    'total_count': Optional[int]
 })
 
+class KeysetPayloadMeta(CollectionPayloadMeta, total=False):
+    # Cursor for the following page when using keyset pagination.
+    next: Optional[str]
+
 CollectionPayload = TypedDict('CollectionPayload', {
     'objects': List[Dict[str, Any]],
     'meta': CollectionPayloadMeta
 })
 
-def get_collection(logged_in_collection, model, checker: ReadPermChecker, control_params=GetCollectionForm.defaults, params={}) -> CollectionPayload:
+def get_collection(logged_in_collection, model, checker: ReadPermChecker, control_params=GetCollectionForm.defaults, params={}, stream: bool=False) -> CollectionPayload:
     """Return a list of structured data for the objects from 'model'
-    subject to the request 'params'."""
+    subject to the request 'params'.
+
+    If 'stream' is true the objects are returned as a StreamedList which
+    fetches and serializes them in batches as it is consumed.
+
+    If the 'after' control parameter is given, the page following the
+    cursor is returned and the meta data includes the cursor of the next
+    page unless streaming.
+
+    The 'fields', 'expand' and 'depth' control parameters select the
+    columns loaded and the parts of the objects that are serialized.
+    """
 
     objs = apply_filters(logged_in_collection, params, model, control_params)
+    serialization = serialization_from_params(control_params)
+    objs = select_columns(objs, serialization)
+    mapper = lambda o: _obj_to_data(o, checker, serialization)
+    prefetch = lambda objs: prefetch_dependents(objs, serialization)
+    count_mode = control_params.get('count', None) or 'exact'
+    after = control_params.get('after', None)
 
     try:
-        return objs_to_data_(objs, objs.count(), lambda o: _obj_to_data(o, checker), control_params['offset'], control_params['limit'])
+        total_count = (
+            objs.count() if count_mode == 'exact' else
+            estimate_count(objs) if count_mode == 'estimate' else
+            None
+        )
+
+        if after is None:
+            return objs_to_data_(objs, total_count, mapper, control_params['offset'], control_params['limit'], prefetch, stream)
+
+        keys = keyset_order(objs)
+        page = objs.order_by(*keys)
+        if after != '':
+            page = filter_after(page, keys, decode_cursor(after))
+        data = objs_to_data_(page, total_count, mapper, 0, control_params['limit'], prefetch, stream)
     except FieldError as e:
         raise OrderByError(e)
 
+    if not stream:
+        meta: KeysetPayloadMeta = data['meta'] # type: ignore
+        limit = meta['limit']
+        last = data['objects'][-1] if data['objects'] else None
+        meta['next'] = cursor_for(objs, keys, last['id']) \
+            if last is not None and limit != 0 and len(data['objects']) == limit else None
+    return data
+
 def apply_filters(logged_in_collection, params, model, control_params=GetCollectionForm.defaults):
     filters = {}
 
@@ -813,30 +1354,92 @@ def apply_filters(logged_in_collection, params, model, control_params=GetCollect
 
 def objs_to_data(objs, offset=0, limit=20) -> CollectionPayload:
     """Wrapper for backwards compatibility."""
-    return objs_to_data_(objs, objs.count(), lambda o: _obj_to_data(o, lambda x: None), offset, limit)
+    return objs_to_data_(objs, objs.count(), lambda o: _obj_to_data(o, lambda x: None), offset, limit, prefetch_dependents)
 
 def objs_to_data_(
     objs,
     total_count,
     mapper: Callable[[Any], Dict[str, Any]],
     offset=0,
-    limit=20
+    limit=20,
+    prefetch: Optional[Callable[[List[Any]], None]]=None,
+    stream: bool=False
 ) -> CollectionPayload:
     """Return a collection structure with a list of the data of given objects
     and collection meta data.
+
+    If 'prefetch' is given it is called with the page of objects before
+    they are mapped, allowing related data to be loaded in batches.
+
+    If 'stream' is true the objects are fetched and mapped lazily in
+    batches of STREAM_BATCH_SIZE as the returned StreamedList is consumed.
     """
     offset, limit = int(offset), int(limit)
 
-    if limit == 0:
-        objs = objs[offset:]
+    if stream:
+        objects: Any = StreamedList(mapper(o) for o in iterate_in_batches(objs, prefetch, offset, limit))
     else:
-        objs = objs[offset:offset + limit]
+        if limit == 0:
+            objs = objs[offset:]
+        else:
+            objs = objs[offset:offset + limit]
 
-    return {'objects': [mapper(o) for o in objs],
+        if prefetch is not None:
+            objs = list(objs)
+            prefetch(objs)
+        objects = [mapper(o) for o in objs]
+
+    return {'objects': objects,
             'meta': {'limit': limit,
                      'offset': offset,
                      'total_count': total_count}}
 
+def iterate_in_batches(objs, prefetch: Optional[Callable[[List[Any]], None]]=None,
+                       offset: int=0, limit: int=0, batch_size: int=STREAM_BATCH_SIZE) -> Iterator[Any]:
+    """Iterate over the unsliced queryset 'objs' starting at 'offset' and
+    yielding at most 'limit' objects unless it is 0. The objects are
+    fetched 'batch_size' at a time by keyset queries continuing after the
+    last object of the previous batch, so only one batch is in memory.
+    The MySQL client buffers whole result sets, so streaming one large
+    query would not keep memory flat. 'prefetch' is called on each batch.
+    """
+    keys = keyset_order(objs)
+    objs = objs.order_by(*keys)
+    remaining = limit or None
+    page = objs[offset:]
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        batch = list(page[:size])
+        if prefetch is not None and batch: prefetch(batch)
+        yield from batch
+        if len(batch) < size:
+            return
+        if remaining is not None:
+            remaining -= size
+        page = filter_after(objs, keys, key_values(objs, keys, batch[-1].pk))
+
+def stream_rows(query) -> Iterator[Any]:
+    """Yield the rows of the values_list queryset 'query' fetched through
+    an unbuffered cursor on the request's own database connection, which
+    does not load the whole result set the way Django's MySQL cursors do.
+    No other query can run on the connection until the rows are consumed.
+    """
+    compiler = query.query.get_compiler(using=query.db)
+    sql, params = compiler.as_sql()
+    converters = compiler.get_converters([s[0] for s in compiler.select[0:compiler.col_count]])
+    connection = connections[query.db]
+    connection.ensure_connection()
+    cursor = connection.connection.cursor(SSCursor)
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield from (compiler.apply_converters(rows, converters) if converters else rows)
+    finally:
+        cursor.close()
+
 def uri_for_model(model, id=None) -> str:
     """Given a Django model and optionally an id, return a URI
     for the collection or resource (if an id is given).
@@ -858,6 +1461,11 @@ class RowsForm(GetCollectionForm):
         orderby=None,
         distinct=False,
         fields=None,
+        stream=None,
+        after=None,
+        count=None,
+        expand=None,
+        depth=None,
     )
 
 def rows(request, model_name: str) -> HttpResponse:
@@ -891,5 +1499,8 @@ def rows(request, model_name: str) -> HttpResponse:
     else:
         query = query[offset:offset + limit]
 
+    if form.cleaned_data['stream'] == 'true':
+        return json_stream_response(StreamedList(stream_rows(query)))
+
     data = list(query)
     return HttpResponse(toJson(data), content_type='application/json')
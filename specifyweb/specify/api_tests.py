@@ -6,8 +6,10 @@ from datetime import datetime
 import json
 from unittest import skip
 
+from django.db import connection
 from django.db.models import Max
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 
 from specifyweb.permissions.models import UserPolicy
 from specifyweb.specify import api, models, scoping
@@ -464,6 +466,244 @@ class InlineApiTests(ApiTests):
     # version control on inlined resources should be tested
 
 
+class PrefetchDependentsTests(ApiTests):
+    def setUp(self):
+        super(PrefetchDependentsTests, self).setUp()
+        for i in range(5):
+            ce = models.Collectingevent.objects.create(discipline=self.discipline)
+            for j in range(3):
+                models.Collector.objects.create(
+                    isprimary=(j == 0),
+                    ordernumber=j,
+                    agent=self.agent,
+                    collectingevent=ce)
+
+        for co in self.collectionobjects:
+            for i in range(2):
+                co.determinations.create(iscurrent=(i == 0), number1=i)
+
+    def count_queries(self, model_name: str, limit: int) -> int:
+        with CaptureQueriesContext(connection) as context:
+            data = api.get_collection(self.collection, model_name, skip_perms_check,
+                                      dict(api.GetCollectionForm.defaults, limit=limit))
+        self.assertEqual(len(data['objects']), limit)
+        return len(context.captured_queries)
+
+    def test_query_count_independent_of_page_size(self):
+        self.assertEqual(self.count_queries('collectingevent', 1),
+                         self.count_queries('collectingevent', 5))
+
+    def test_collectionobject_query_count(self):
+        # Only the calculated fields issue a query per collection object.
+        self.assertEqual(self.count_queries('collectionobject', 5) - self.count_queries('collectionobject', 1), 4)
+
+    def test_prefetched_data_matches_unplanned(self):
+        co = self.collectionobjects[0]
+        planned = api.get_resource('collectionobject', co.id, skip_perms_check)
+        unplanned = api._obj_to_data(models.Collectionobject.objects.get(id=co.id), skip_perms_check)
+        self.assertEqual(planned, unplanned)
+
+class StreamingApiTests(ApiTests):
+    def test_stream_json_matches_toJson(self):
+        data = {'objects': [{'a': 1, 'b': [1, 2]}, {'c': None}], 'meta': {'limit': 0}}
+        streamed = {'objects': api.StreamedList(iter(data['objects'])), 'meta': data['meta']}
+        self.assertEqual(''.join(api.stream_json(streamed)), api.toJson(data))
+
+    def test_streamed_collection(self):
+        expected = api.get_collection(self.collection, 'collectionobject', skip_perms_check)
+        streamed = api.get_collection(self.collection, 'collectionobject', skip_perms_check, stream=True)
+        self.assertIsInstance(streamed['objects'], api.StreamedList)
+        self.assertEqual(json.loads(''.join(api.stream_json(streamed))), json.loads(api.toJson(expected)))
+
+    def test_streamed_collection_response(self):
+        c = Client()
+        c.force_login(self.specifyuser)
+        response = c.get('/api/specify/collectionobject/?limit=0&stream=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['meta']['total_count'], len(self.collectionobjects))
+        self.assertEqual(len(data['objects']), len(self.collectionobjects))
+
+    def test_iterate_in_keyset_batches(self):
+        objs = models.Collectionobject.objects.all()
+        expected = list(objs.order_by('id')[1:4])
+        self.assertEqual(list(api.iterate_in_batches(objs, offset=1, limit=3, batch_size=2)), expected)
+        self.assertEqual(list(api.iterate_in_batches(objs, batch_size=2)), list(objs.order_by('id')))
+
+    def test_streamed_rows_response(self):
+        c = Client()
+        c.force_login(self.specifyuser)
+        expected = json.loads(c.get('/api/specify_rows/collectionobject/?fields=catalognumber,id').content)
+        self.assertEqual(len(expected), len(self.collectionobjects))
+        response = c.get('/api/specify_rows/collectionobject/?fields=catalognumber,id&stream=true')
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), expected)
+
+class KeysetPaginationTests(ApiTests):
+    def get_pages(self, orderby, limit=2):
+        params = dict(api.GetCollectionForm.defaults, orderby=orderby, limit=limit, after='')
+        pages = []
+        while True:
+            data = api.get_collection(self.collection, 'collectionobject', skip_perms_check, params)
+            pages.append(data)
+            if data['meta']['next'] is None:
+                return pages
+            params['after'] = data['meta']['next']
+
+    def test_pages_cover_collection(self):
+        self.collectionobjects[1].catalognumber = None
+        self.collectionobjects[1].save()
+        for orderby in ('catalognumber', '-catalognumber', None):
+            expected = [o.id for o in models.Collectionobject.objects.filter(
+                collection=self.collection).order_by(*([orderby, 'id'] if orderby else ['id']))]
+            pages = self.get_pages(orderby)
+            self.assertEqual([o['id'] for page in pages for o in page['objects']], expected)
+            self.assertTrue(all(page['meta']['total_count'] == len(expected) for page in pages))
+
+    def test_skip_count(self):
+        params = dict(api.GetCollectionForm.defaults, count='none', after='')
+        data = api.get_collection(self.collection, 'collectionobject', skip_perms_check, params)
+        self.assertIsNone(data['meta']['total_count'])
+
+    def test_bad_cursor(self):
+        params = dict(api.GetCollectionForm.defaults, after='garbage')
+        with self.assertRaises(api.CursorError):
+            api.get_collection(self.collection, 'collectionobject', skip_perms_check, params)
+
+class BulkApiTests(ApiTests):
+    def test_bulk_operations(self):
+        co = self.collectionobjects[0]
+        results = api.apply_bulk_operations(self.collection, self.agent, [
+            {'operation': 'create', 'model': 'determination', 'data': {
+                'collectionobject': api.uri_for_model('collectionobject', co.id),
+                'iscurrent': False, 'number1': i}}
+            for i in range(3)
+        ] + [
+            {'operation': 'update', 'model': 'collectionobject', 'id': co.id,
+             'data': {'version': co.version, 'remarks': 'bulk'}},
+            {'operation': 'delete', 'model': 'collectionobject', 'id': self.collectionobjects[1].id,
+             'version': self.collectionobjects[1].version},
+        ], skip_perms_check)
+
+        self.assertEqual([r['status'] for r in results], [201, 201, 201, 200, 204])
+        self.assertEqual(co.determinations.count(), 3)
+        self.assertEqual(models.Collectionobject.objects.get(id=co.id).remarks, 'bulk')
+        self.assertFalse(models.Collectionobject.objects.filter(id=self.collectionobjects[1].id).exists())
+
+    def test_bulk_rollback(self):
+        co = self.collectionobjects[0]
+        with self.assertRaises(api.BulkOperationException) as cm:
+            api.apply_bulk_operations(self.collection, self.agent, [
+                {'operation': 'create', 'model': 'determination', 'data': {
+                    'collectionobject': api.uri_for_model('collectionobject', co.id),
+                    'iscurrent': False}},
+                {'operation': 'update', 'model': 'collectionobject', 'id': co.id,
+                 'data': {'version': co.version + 1, 'remarks': 'stale'}},
+            ], skip_perms_check)
+
+        self.assertEqual(cm.exception.index, 1)
+        self.assertIsInstance(cm.exception.exception, api.StaleObjectException)
+        self.assertEqual(co.determinations.count(), 0)
+
+class SerializationTests(ApiTests):
+    def setUp(self):
+        super(SerializationTests, self).setUp()
+        self.collectionobjects[0].determinations.create(iscurrent=True)
+
+    def test_sparse_fields(self):
+        params = dict(api.GetCollectionForm.defaults, fields='catalognumber,determinations')
+        data = api.get_collection(self.collection, 'collectionobject', skip_perms_check, params)
+        obj = next(o for o in data['objects'] if o['id'] == self.collectionobjects[0].id)
+        self.assertEqual(set(obj.keys()), {'id', 'version', 'catalognumber', 'determinations', 'resource_uri'})
+        self.assertEqual(len(obj['determinations']), 1)
+
+    def test_depth(self):
+        co = self.collectionobjects[0]
+        data = api.get_resource('collectionobject', co.id, skip_perms_check,
+                                serialization=api.Serialization(depth=0))
+        self.assertEqual(data['determinations'], api.uri_for_model('determination') + f'?collectionobject={co.id}')
+        self.assertNotIn('currentdetermination', data)
+
+    def test_expand(self):
+        co = self.collectionobjects[0]
+        full = api.get_resource('collectionobject', co.id, skip_perms_check)
+        expanded = api.get_resource('collectionobject', co.id, skip_perms_check,
+                                    serialization=api.Serialization(expand=frozenset(['determinations'])))
+        self.assertEqual(expanded['determinations'], full['determinations'])
+        self.assertIsInstance(expanded['preparations'], str)
+
+    def test_sparse_resource_request(self):
+        co = self.collectionobjects[0]
+        c = Client()
+        c.force_login(self.specifyuser)
+        response = c.get(f'/api/specify/collectionobject/{co.id}/?fields=catalognumber')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(json.loads(response.content).keys()), {'id', 'version', 'catalognumber', 'resource_uri'})
+
+class ConditionalGetTests(ApiTests):
+    def test_resource_not_modified(self):
+        co = self.collectionobjects[0]
+        c = Client()
+        c.force_login(self.specifyuser)
+        response = c.get(f'/api/specify/collectionobject/{co.id}/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = c.get(f'/api/specify/collectionobject/{co.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_dependent_change_changes_etag(self):
+        co = self.collectionobjects[0]
+        c = Client()
+        c.force_login(self.specifyuser)
+        etag = c.get(f'/api/specify/collectionobject/{co.id}/')['ETag']
+        co.determinations.create(iscurrent=True)
+        response = c.get(f'/api/specify/collectionobject/{co.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified_before_serializing(self):
+        co = self.collectionobjects[0]
+        c = Client()
+        c.force_login(self.specifyuser)
+        with CaptureQueriesContext(connection) as full:
+            etag = c.get(f'/api/specify/collectionobject/{co.id}/')['ETag']
+        with CaptureQueriesContext(connection) as not_modified:
+            response = c.get(f'/api/specify/collectionobject/{co.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertLess(len(not_modified), len(full))
+
+    def test_calculated_field_change_changes_etag(self):
+        co = self.collectionobjects[0]
+        prep = co.preparations.create(
+            collectionmemberid=self.collection.id,
+            preptype=models.Preptype.objects.create(collection=self.collection),
+            countamt=2)
+        c = Client()
+        c.force_login(self.specifyuser)
+        etag = c.get(f'/api/specify/collectionobject/{co.id}/')['ETag']
+
+        gift = models.Gift.objects.create(giftnumber='1', discipline=self.discipline)
+        gift.giftpreparations.create(preparation=prep, quantity=1, discipline=self.discipline)
+        response = c.get(f'/api/specify/collectionobject/{co.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['actualTotalCountAmt'], 1)
+
+    def test_collection_etag(self):
+        c = Client()
+        c.force_login(self.specifyuser)
+        response = c.get('/api/specify/collectionobject/')
+        etag = response['ETag']
+
+        response = c.get('/api/specify/collectionobject/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.collectionobjects[0].determinations.create(iscurrent=True)
+        response = c.get('/api/specify/collectionobject/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200, "changes to inlined dependents are seen")
+
 class UserApiTests(ApiTests):
     def setUp(self):
         "OOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOF!"
@@ -1,10 +1,14 @@
 import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
 from time import time
+from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 import re
 
 from django.db import connection
+from django.db.models import Max
 from django.conf import settings
 
 from specifyweb.specify.models import Spauditlog
@@ -18,12 +22,34 @@ Division = datamodel.get_table_strict('Division')
 
 from . import auditcodes
 
+# Field level audit log entries waiting to be inserted together.
+# None unless inside AuditLog.deferred_field_logs().
+_deferred_fields: ContextVar[Optional[List[Spauditlogfield]]] = ContextVar('auditlog_deferred_fields', default=None)
+
 class AuditLog(object):
 
     _auditingFlds = None
     _auditing = None
     _lastCheck = None
     _checkInterval = 900
+
+    @contextmanager
+    def deferred_field_logs(self):
+        """Collect the field level entries logged within the context and
+        insert them with a single bulk insert when the context exits
+        normally. Nothing is inserted if an exception is raised.
+        """
+        if _deferred_fields.get() is not None:
+            yield
+            return
+
+        pending: List[Spauditlogfield] = []
+        token = _deferred_fields.set(pending)
+        try:
+            yield
+        finally:
+            _deferred_fields.reset(token)
+        Spauditlogfield.objects.bulk_create(pending, batch_size=1000)
     
     def isAuditingFlds(self):
         return self.isAuditing() and self._auditingFlds
@@ -82,34 +108,75 @@ class AuditLog(object):
                                 self._log_fld_update({'field_name': fldattr, 'old_value': fk_id, 'new_value': None}, log_obj, agent)
         return log_obj
         
+    def update_many(self, updates, agent):
+        """Log the updates of many objects of the same table at once.
+        'updates' is a list of (obj, dirty_flds) pairs. See _log_many.
+        """
+        logs = self._log_many(auditcodes.UPDATE, [obj for obj, __ in updates], agent)
+        if logs and self.isAuditingFlds():
+            with self.deferred_field_logs():
+                for obj, dirty_flds in updates:
+                    for vals in dirty_flds:
+                        self._log_fld_update(vals, logs[obj.id], agent)
+        return logs
+
+    def insert_many(self, objs, agent):
+        return self._log_many(auditcodes.INSERT, objs, agent)
+
     def _log(self, action, obj, agent, parent_record):
-        agent_id = agent if isinstance(agent, int) else (agent and agent.id)
         if self.isAuditing():
             logger.info("inserting into auditlog: %s", [action, obj, agent, parent_record])
-            assert obj.id is not None, "attempt to add object with null id to audit log"
-            parentId = parent_record and parent_record.id
-            parentTbl = parent_record and parent_record.specify_model.tableId
-            if not parent_record:
-                scoper, model = next(((s,m) for s,m in [
-                    ('collectionmemberid', Collection),
-                    ('collection_id', Collection),
-                    ('discipline_id', Discipline),
-                    ('division_id', Division),
-                ] if hasattr(obj, s)), (None, None))
-                scopeId = scoper and getattr(obj, scoper)
-                if scopeId is not None:
-                    parentId = scopeId
-                    parentTbl = model.tableId
-
-            return Spauditlog.objects.create(
+            log_obj = self._log_entry(action, obj, agent, parent_record)
+            log_obj.save(force_insert=True)
+            return log_obj
+
+    def _log_many(self, action, objs, agent):
+        """Insert the entries for 'objs', which all belong to the same
+        table, with a bulk insert and return them by record id. The
+        objects must be locked by the current transaction so that the
+        inserted entries can be told apart from any others.
+        """
+        if not objs or not self.isAuditing():
+            return {}
+        logger.info("inserting %d entries into auditlog: %s", len(objs), [action, objs[0].specify_model.name, agent])
+        last_id = Spauditlog.objects.aggregate(Max('id'))['id__max'] or 0
+        Spauditlog.objects.bulk_create([self._log_entry(action, obj, agent, None) for obj in objs], batch_size=1000)
+        return {
+            log.recordid: log
+            for log in Spauditlog.objects.filter(
+                id__gt=last_id,
                 action=action,
-                parentrecordid=parentId,
-                parenttablenum=parentTbl,
-                recordid=obj.id,
-                recordversion=obj.version if hasattr(obj, 'version') else 0,
-                tablenum=obj.specify_model.tableId,
-                createdbyagent_id=agent_id,
-                modifiedbyagent_id=agent_id)
+                tablenum=objs[0].specify_model.tableId,
+                recordid__in=[obj.id for obj in objs],
+            )
+        }
+
+    def _log_entry(self, action, obj, agent, parent_record):
+        agent_id = agent if isinstance(agent, int) else (agent and agent.id)
+        assert obj.id is not None, "attempt to add object with null id to audit log"
+        parentId = parent_record and parent_record.id
+        parentTbl = parent_record and parent_record.specify_model.tableId
+        if not parent_record:
+            scoper, model = next(((s,m) for s,m in [
+                ('collectionmemberid', Collection),
+                ('collection_id', Collection),
+                ('discipline_id', Discipline),
+                ('division_id', Division),
+            ] if hasattr(obj, s)), (None, None))
+            scopeId = scoper and getattr(obj, scoper)
+            if scopeId is not None:
+                parentId = scopeId
+                parentTbl = model.tableId
+
+        return Spauditlog(
+            action=action,
+            parentrecordid=parentId,
+            parenttablenum=parentTbl,
+            recordid=obj.id,
+            recordversion=obj.version if hasattr(obj, 'version') else 0,
+            tablenum=obj.specify_model.tableId,
+            createdbyagent_id=agent_id,
+            modifiedbyagent_id=agent_id)
     
     def _log_fld_update(self, vals, log, agent):
         agent_id = agent if isinstance(agent, int) else (agent and agent.id)
@@ -119,7 +186,7 @@ class AuditLog(object):
         oldval = vals['old_value']
         if oldval is not None:
             oldval = str(vals['old_value'])[:(2**16 - 1)]
-        return Spauditlogfield.objects.create(
+        fld_log = Spauditlogfield(
             fieldname=vals['field_name'],
             newvalue=newval,
             oldvalue=oldval,
@@ -127,6 +194,13 @@ class AuditLog(object):
             createdbyagent_id=agent_id,
             modifiedbyagent_id=agent_id)
 
+        pending = _deferred_fields.get()
+        if pending is not None:
+            pending.append(fld_log)
+        else:
+            fld_log.save(force_insert=True)
+        return fld_log
+
     def purge(self):
         match = re.search(r'AUDIT_LIFESPAN_MONTHS=(.+)', get_global_prefs())
         logger.info("checking to see if purge is required")
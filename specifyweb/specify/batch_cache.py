@@ -0,0 +1,40 @@
+"""
+Memoization of lookups shared by all the operations of a batch
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar('T')
+
+_batch_cache: ContextVar[Optional[Dict[Hashable, Any]]] = ContextVar('batch_cache', default=None)
+
+@contextmanager
+def batch_scope():
+    """Within the context, values computed through batch_memoize are
+    reused. Used when applying many changes at once where things like
+    formatters and business rules cannot change between the operations.
+    """
+    if _batch_cache.get() is not None:
+        # Already in a batch.
+        yield
+        return
+
+    token = _batch_cache.set({})
+    try:
+        yield
+    finally:
+        _batch_cache.reset(token)
+
+def batch_memoize(key: Hashable, compute: Callable[[], T]) -> T:
+    """Return the value for 'key' computed in the current batch scope, or
+    call 'compute' to get it. Outside of a batch scope 'compute' is always
+    called.
+    """
+    cache = _batch_cache.get()
+    if cache is None:
+        return compute()
+    if key not in cache:
+        cache[key] = compute()
+    return cache[key]
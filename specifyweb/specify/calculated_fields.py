@@ -58,10 +58,12 @@ select coalesce(sum(countamt), 0) as TotalCountAmt, coalesce(sum(available), 0)
         extra["actualTotalCountAmt"] = int(actualTotalCountAmt)
         extra["totalCountAmt"] = int(totalCountAmt)
 
-        dets = data['determinations'] or []
-        extra['currentdetermination'] = next((det['resource_uri'] for det in dets if det['iscurrent']), None)
+        # The determinations are given as a URI when not inlined.
+        dets = data['determinations']
+        if not isinstance(dets, str):
+            extra['currentdetermination'] = next((det['resource_uri'] for det in dets or [] if det['iscurrent']), None)
 
-    elif isinstance(obj, get_model('Loan')):
+    elif isinstance(obj, get_model('Loan')) and isinstance(data['loanpreparations'], list):
         preps = data['loanpreparations']
         items = 0
         quantities = 0
@@ -110,3 +112,44 @@ select count(id) as PreparationCount, coalesce(sum(countamt), 0) as TotalCountAm
     return extra
 
 
+
+# The tables referring to preparations whose records are read by the
+# calculated fields of preparations, collection objects and accessions.
+PREPARATION_USES = ('preparation', 'giftpreparation', 'exchangeoutprep', 'disposalpreparation', 'loanpreparation')
+
+def calculated_fields_version(obj) -> Any:
+    """Return a value that changes whenever the records that are not
+    dependents of 'obj' but are read by calculate_extra_fields for it
+    change, or None if there are none. Every update bumps the version
+    of a record, so the count and sum of the versions of the records
+    read is used.
+    """
+    if isinstance(obj, get_model('Preparation')):
+        preparations, params = "select %s", [obj.id]
+
+    elif isinstance(obj, get_model('Collectionobject')):
+        preparations, params = "select preparationid from preparation where collectionobjectid = %s", [obj.id]
+
+    elif isinstance(obj, get_model('Accession')):
+        preparations, params = (
+            "select p.preparationid from preparation p join collectionobject co using (collectionobjectid) "
+            "where co.accessionid = %s"
+        ), [obj.id]
+
+    elif isinstance(obj, get_model('Specifyuser')):
+        return obj.userpolicy_set.filter(collection=None, resource='%', action='%').exists()
+
+    else:
+        return None
+
+    cursor = connection.cursor()
+    cursor.execute(" union all ".join(
+        "select count(*), coalesce(sum(version), 0) from {table} where preparationid in ({preparations})"
+        .format(table=table, preparations=preparations)
+        for table in PREPARATION_USES
+    ), params * len(PREPARATION_USES))
+    versions = [tuple(row) for row in cursor.fetchall()]
+
+    if isinstance(obj, get_model('Accession')):
+        versions.append(tuple(obj.collectionobjects.aggregate(count=Count('id'), versions=Sum('version')).values()))
+    return versions
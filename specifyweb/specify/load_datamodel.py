@@ -1,7 +1,11 @@
 
-from typing import List, Dict, Union, Optional, Iterable, TypeVar, Callable
+from typing import List, Dict, Union, Optional, Tuple, TypeVar, Callable
 from xml.etree import ElementTree
+import hashlib
+import hmac
 import os
+import pickle
+import tempfile
 import warnings
 import logging
 logger = logging.getLogger(__name__)
@@ -9,6 +13,8 @@ logger = logging.getLogger(__name__)
 from django.conf import settings # type: ignore
 from django.utils.translation import gettext as _
 
+from .serialize_datamodel import datamodel_to_json
+
 class DoesNotExistError(Exception):
     pass
 
@@ -22,9 +28,14 @@ class FieldDoesNotExistError(DoesNotExistError):
 T = TypeVar('T')
 U = TypeVar('U')
 
+_warned_deprecated = False
+
 def strict_to_optional(f: Callable[[U], T], lookup: U, strict: bool) -> Optional[T]:
+    global _warned_deprecated
     try:
-        warnings.warn("deprecated. use strict version.", DeprecationWarning)
+        if not _warned_deprecated:
+            _warned_deprecated = True
+            warnings.warn("deprecated. use strict version.", DeprecationWarning)
         return f(lookup)
     except DoesNotExistError:
         if not strict:
@@ -34,23 +45,42 @@ def strict_to_optional(f: Callable[[U], T], lookup: U, strict: bool) -> Optional
 class Datamodel(object):
     tables: List['Table']
 
+    # The JSON representation of the datamodel when it was loaded from
+    # or written to a snapshot. See load_datamodel.
+    serialized: Optional[str] = None
+
+    # The tables by lower case name and by id, along with the number
+    # of tables they were built from. Rebuilt when tables are added.
+    _table_index: Optional[Tuple[int, Dict[str, 'Table'], Dict[int, 'Table']]] = None
+
+    def _tables_by_name_and_id(self) -> Tuple[Dict[str, 'Table'], Dict[int, 'Table']]:
+        index = self._table_index
+        if index is None or index[0] != len(self.tables):
+            by_name: Dict[str, 'Table'] = {}
+            by_id: Dict[int, 'Table'] = {}
+            for table in self.tables:
+                by_name.setdefault(table.name.lower(), table)
+                by_id.setdefault(table.tableId, table)
+            index = self._table_index = (len(self.tables), by_name, by_id)
+        return index[1], index[2]
+
     def get_table(self, tablename: str, strict: bool=False) -> Optional['Table']:
         return strict_to_optional(self.get_table_strict, tablename, strict)
 
     def get_table_strict(self, tablename: str) -> 'Table':
         tablename = tablename.lower()
-        for table in self.tables:
-            if table.name.lower() == tablename:
-                return table
+        table = self._tables_by_name_and_id()[0].get(tablename, None)
+        if table is not None:
+            return table
         raise TableDoesNotExistError(_("No table with name: %(table_name)r") % {'table_name':tablename})
 
     def get_table_by_id(self, table_id: int, strict: bool=False) -> Optional['Table']:
         return strict_to_optional(self.get_table_by_id_strict, table_id, strict)
 
     def get_table_by_id_strict(self, table_id: int, strict: bool=False) -> 'Table':
-        for table in self.tables:
-            if table.tableId == table_id:
-                return table
+        table = self._tables_by_name_and_id()[1].get(table_id, None)
+        if table is not None:
+            return table
         raise TableDoesNotExistError(_("No table with id: %(table_id)d") % {'table_id':table_id})
 
     def reverse_relationship(self, relationship: 'Relationship') -> Optional['Relationship']:
@@ -73,6 +103,22 @@ class Table(object):
     relationships: List['Relationship']
     fieldAliases: List[Dict[str, str]]
 
+    # All the fields in order and by lower case name, along with the
+    # number of fields and relationships they were built from. Rebuilt
+    # when fields or relationships are added.
+    _field_index: Optional[Tuple[int, List[Union['Field', 'Relationship']], Dict[str, Union['Field', 'Relationship']]]] = None
+
+    def _all_fields_by_name(self) -> Tuple[List[Union['Field', 'Relationship']], Dict[str, Union['Field', 'Relationship']]]:
+        size = len(self.fields) + len(self.relationships)
+        index = self._field_index
+        if index is None or index[0] != size:
+            all_fields: List[Union['Field', 'Relationship']] = [*self.fields, *self.relationships, self.idField]
+            by_name: Dict[str, Union['Field', 'Relationship']] = {}
+            for field in all_fields:
+                by_name.setdefault(field.name.lower(), field)
+            index = self._field_index = (size, all_fields, by_name)
+        return index[1], index[2]
+
     @property
     def name(self) -> str:
         return self.classname.split('.')[-1]
@@ -83,14 +129,7 @@ class Table(object):
 
     @property
     def all_fields(self) -> List[Union['Field', 'Relationship']]:
-        def af() -> Iterable[Union['Field', 'Relationship']]:
-            for f in self.fields:
-                yield f
-            for r in self.relationships:
-                yield r
-            yield self.idField
-
-        return list(af())
+        return list(self._all_fields_by_name()[0])
 
 
     def get_field(self, fieldname: str, strict: bool=False) -> Union['Field', 'Relationship', None]:
@@ -98,9 +137,9 @@ class Table(object):
 
     def get_field_strict(self, fieldname: str) -> Union['Field', 'Relationship']:
         fieldname = fieldname.lower()
-        for field in self.all_fields:
-            if field.name.lower() == fieldname:
-                return field
+        field = self._all_fields_by_name()[1].get(fieldname, None)
+        if field is not None:
+            return field
         raise FieldDoesNotExistError(_("Field %(field_name)s not in table %(table_name)s. ") % {'field_name':fieldname, 'table_name':self.name} +
                                      _("Fields: %(fields)s") % {'fields':[f.name for f in self.all_fields]})
 
@@ -129,6 +168,8 @@ class Table(object):
 
 
 class Field(object):
+    __slots__ = ('name', 'column', 'indexed', 'unique', 'required', 'type', 'length')
+
     is_relationship: bool = False
     name: str
     column: str
@@ -145,17 +186,21 @@ class Field(object):
         return self.type in ('java.util.Date', 'java.util.Calendar', 'java.sql.Timestamp')
 
 class IdField(Field):
+    __slots__ = ()
+
     name: str
     column: str
     type: str
-    required: bool = True
+    required: bool
 
     def __repr__(self) -> str:
         return "<SpecifyIdField: %s>" % self.name
 
 class Relationship(Field):
+    __slots__ = ('dependent', 'relatedModelName', 'otherSideName')
+
     is_relationship: bool = True
-    dependent: bool = False
+    dependent: bool
     name: str
     type: str
     required: bool
@@ -163,6 +208,9 @@ class Relationship(Field):
     column: str
     otherSideName: str
 
+    def __init__(self) -> None:
+        self.dependent = False
+
 def make_table(tabledef: ElementTree.Element) -> Table:
     table = Table()
     table.classname = tabledef.attrib['classname']
@@ -189,6 +237,7 @@ def make_id_field(fielddef: ElementTree.Element) -> IdField:
     field.name = fielddef.attrib['name']
     field.column = fielddef.attrib['column']
     field.type = fielddef.attrib['type']
+    field.required = True
     return field
 
 def make_field(fielddef: ElementTree.Element) -> Field:
@@ -219,8 +268,66 @@ def make_field_alias(aliasdef: ElementTree.Element) -> Dict[str, str]:
     alias = dict(aliasdef.attrib)
     return alias
 
+# Changed whenever what is stored in the datamodel snapshot changes.
+SNAPSHOT_FORMAT = 1
+
+def datamodel_xml_path() -> str:
+    return os.path.join(settings.SPECIFY_CONFIG_DIR, 'specify_datamodel.xml')
+
+# Where the snapshot is kept unless DATAMODEL_SNAPSHOT_DIR is set. It
+# must not be a directory that is served or writable by other users.
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'build')
+
+def snapshot_path() -> Optional[str]:
+    if not getattr(settings, 'DATAMODEL_SNAPSHOT', True):
+        return None
+    directory = getattr(settings, 'DATAMODEL_SNAPSHOT_DIR', None) or DEFAULT_SNAPSHOT_DIR
+    return os.path.join(directory, 'specify_datamodel.pickle')
+
+def snapshot_key(xml: bytes) -> str:
+    "Return a digest of the datamodel XML and of everything else the loaded datamodel depends on."
+    digest = hashlib.sha1(xml)
+    digest.update(repr((
+        SNAPSHOT_FORMAT,
+        getattr(settings, 'VERSION', None),
+        getattr(settings, 'DEBUG', False),
+        sorted(dependent_fields),
+        sorted(system_tables),
+    )).encode())
+    return digest.hexdigest()
+
+def snapshot_signature(payload: bytes) -> str:
+    "Return the HMAC of the pickled snapshot 'payload' keyed with SECRET_KEY."
+    return hmac.new(settings.SECRET_KEY.encode(), payload, hashlib.sha256).hexdigest()
+
 def load_datamodel() -> Datamodel:
-    datamodeldef = ElementTree.parse(os.path.join(settings.SPECIFY_CONFIG_DIR, 'specify_datamodel.xml'))
+    """Return the datamodel defined by specify_datamodel.xml. It is
+    unpickled from the snapshot when one was written for the same XML
+    and the same build, and parsed otherwise. A parsed datamodel is
+    written to the snapshot, along with its JSON representation, so the
+    processes started after it do not have to parse it again.
+    """
+    with open(datamodel_xml_path(), 'rb') as f:
+        xml = f.read()
+
+    key = snapshot_key(xml)
+    path = snapshot_path()
+    try:
+        datamodel = read_snapshot(path, key) if path is not None else None
+    except Exception:
+        # The snapshot is current and was written by this installation,
+        # so rewriting it would only fail the same way at every start.
+        logger.exception("unable to load datamodel snapshot %s", path)
+        return parse_datamodel(xml)
+
+    if datamodel is None:
+        datamodel = parse_datamodel(xml)
+        if path is not None:
+            write_snapshot(path, key, datamodel)
+    return datamodel
+
+def parse_datamodel(xml: bytes) -> Datamodel:
+    datamodeldef = ElementTree.fromstring(xml)
     datamodel = Datamodel()
     datamodel.tables = [make_table(tabledef) for tabledef in datamodeldef.findall('table')]
     add_collectingevents_to_locality(datamodel)
@@ -230,6 +337,57 @@ def load_datamodel() -> Datamodel:
 
     return datamodel
 
+def read_snapshot(path: str, key: str) -> Optional[Datamodel]:
+    """Return the datamodel stored at 'path' if it was written for 'key'.
+    The snapshot starts with a header line holding its key and the
+    signature of the pickled payload following it, and the payload is
+    only unpickled once both have been checked. Errors unpickling a
+    payload that passed both checks are raised.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.readline().split()
+            payload = f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning("unable to read datamodel snapshot %s: %s", path, e)
+        return None
+
+    if len(header) != 2 or header[0].decode(errors='replace') != key:
+        logger.info("datamodel snapshot %s is out of date", path)
+        return None
+
+    if not hmac.compare_digest(header[1].decode(errors='replace'), snapshot_signature(payload)):
+        logger.warning("datamodel snapshot %s has a bad signature", path)
+        return None
+
+    datamodel, serialized = pickle.loads(payload)
+    datamodel.serialized = serialized
+    return datamodel
+
+def write_snapshot(path: str, key: str, datamodel: Datamodel) -> None:
+    serialized = datamodel_to_json(datamodel)
+    payload = pickle.dumps((datamodel, serialized), protocol=pickle.HIGHEST_PROTOCOL)
+    header = ('%s %s\n' % (key, snapshot_signature(payload))).encode()
+    temp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # Written to a temporary file first so other processes never
+        # read a partial snapshot.
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.datamodel', delete=False) as f:
+            temp_path = f.name
+            f.write(header)
+            f.write(payload)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning("unable to write datamodel snapshot %s: %s", path, e)
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+        return
+    logger.info("wrote datamodel snapshot %s", path)
+    datamodel.serialized = serialized
+
 def add_collectingevents_to_locality(datamodel: Datamodel) -> None:
     rel = Relationship()
     rel.name = 'collectingEvents'
@@ -18,3 +18,28 @@ def lock_tables(*tables):
             yield
         finally:
             cursor.execute('unlock tables')
+
+class LockTimeout(Exception):
+    """Raised when a named lock cannot be acquired in time."""
+    pass
+
+@contextmanager
+def named_lock(name, timeout=60):
+    """Hold the MySQL user level lock 'name', scoped to the current
+    database, for the duration of the context.
+    """
+    cursor = connection.cursor()
+    if cursor.db.vendor != 'mysql':
+        logger.warning("unable to get lock %s", name)
+        yield
+        return
+
+    lock_name = '%s.%s' % (cursor.db.settings_dict['NAME'], name)
+    cursor.execute('select get_lock(%s, %s)', [lock_name, timeout])
+    acquired, = cursor.fetchone()
+    if acquired != 1:
+        raise LockTimeout("timed out waiting for lock %s" % lock_name)
+    try:
+        yield
+    finally:
+        cursor.execute('select release_lock(%s)', [lock_name])
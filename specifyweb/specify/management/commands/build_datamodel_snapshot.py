@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from specifyweb.specify import load_datamodel
+
+class Command(BaseCommand):
+    help = 'Parses specify_datamodel.xml and writes the datamodel snapshot loaded by new processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Where to write the snapshot. Defaults to the configured snapshot path.')
+
+    def handle(self, **options):
+        path = options['path'] or load_datamodel.snapshot_path()
+        if path is None:
+            raise CommandError("datamodel snapshots are disabled. Set DATAMODEL_SNAPSHOT or pass --path.")
+
+        with open(load_datamodel.datamodel_xml_path(), 'rb') as f:
+            xml = f.read()
+        datamodel = load_datamodel.parse_datamodel(xml)
+        load_datamodel.write_snapshot(path, load_datamodel.snapshot_key(xml), datamodel)
+        if datamodel.serialized is None:
+            raise CommandError("unable to write the datamodel snapshot to %s" % path)
+        self.stdout.write("wrote datamodel snapshot for %d tables to %s" % (len(datamodel.tables), path))
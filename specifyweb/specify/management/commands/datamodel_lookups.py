@@ -0,0 +1,27 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from specifyweb.specify.datamodel import datamodel
+
+class Command(BaseCommand):
+    help = 'Reports the cost of looking up every table of the datamodel by name and id and every field by name.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=10, help='Number of passes over the datamodel per timing.')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of timings. The fastest is reported.')
+
+    def handle(self, **options):
+        names = [(table.name, [field.name for field in table.all_fields]) for table in datamodel.tables]
+
+        def lookup_all():
+            for tablename, fieldnames in names:
+                table = datamodel.get_table_strict(tablename)
+                datamodel.get_table_by_id_strict(table.tableId)
+                for fieldname in fieldnames:
+                    table.get_field_strict(fieldname)
+
+        number = options['number']
+        seconds = min(timeit.repeat(lookup_all, number=number, repeat=options['repeat'])) / number
+        lookups = sum(2 + len(fieldnames) for __, fieldnames in names)
+        self.stdout.write("%d datamodel lookups took %.6fs (%.3fus each)" % (lookups, seconds, seconds / lookups * 1e6))
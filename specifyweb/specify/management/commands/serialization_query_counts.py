@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from specifyweb.specify import api
+from specifyweb.specify.datamodel import datamodel, TableDoesNotExistError
+
+class Command(BaseCommand):
+    help = 'Reports the number of queries needed to serialize a page of each table with and without batched prefetching.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*', help='Tables to report on. Defaults to all tables with dependent fields.')
+        parser.add_argument('--limit', type=int, default=20, help='Page size.')
+
+    def handle(self, **options):
+        if options['tables']:
+            try:
+                tables = [datamodel.get_table_strict(name) for name in options['tables']]
+            except TableDoesNotExistError as e:
+                raise CommandError(e)
+        else:
+            tables = [t for t in datamodel.tables
+                      if any(getattr(r, 'dependent', False) for r in t.relationships)]
+
+        self.stdout.write('\t'.join(('table', 'objects', 'unplanned', 'planned')))
+        for table in tables:
+            model = api.get_model(table.django_name)
+            objs = list(model.objects.all()[:options['limit']])
+            unplanned = self.count_queries(objs, model, prefetch=False)
+            planned = self.count_queries(objs, model, prefetch=True)
+            self.stdout.write('\t'.join((table.name, str(len(objs)), str(unplanned), str(planned))))
+
+    def count_queries(self, objs, model, prefetch: bool) -> int:
+        # Refetch so nothing is cached on the instances between runs.
+        objs = list(model.objects.filter(id__in=[o.id for o in objs]))
+        with CaptureQueriesContext(connection) as context:
+            if prefetch:
+                api.prefetch_dependents(objs)
+            for obj in objs:
+                api._obj_to_data(obj, lambda o: None)
+        return len(context.captured_queries)
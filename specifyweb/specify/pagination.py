@@ -0,0 +1,111 @@
+"""
+Keyset (seek) pagination and row count estimation for querysets
+"""
+
+import base64
+import json
+import logging
+from functools import reduce
+from operator import or_
+from typing import Any, List, Optional
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+class CursorError(Exception):
+    """Raised when a pagination cursor cannot be decoded."""
+    pass
+
+def encode_cursor(values: List[Any]) -> str:
+    from .api import toJson
+    return base64.urlsafe_b64encode(toJson(values).encode()).decode()
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError as e:
+        raise CursorError(e)
+    if not isinstance(values, list):
+        raise CursorError("bad cursor: %r" % cursor)
+    return values
+
+def keyset_order(objs) -> List[str]:
+    """Return the ordering of the queryset 'objs' made total by
+    appending the primary key if it is not already included.
+    """
+    keys = list(objs.query.order_by or objs.model._meta.ordering)
+    if not any(k.lstrip('-') in ('id', 'pk') for k in keys):
+        keys.append('id')
+    return keys
+
+def filter_after(objs, keys: List[str], values: List[Any]):
+    """Restrict the queryset 'objs' ordered by 'keys' to the rows following
+    the row having the given key 'values'. Nulls are taken to sort before
+    all other values as they do in MySQL.
+    """
+    if len(values) != len(keys):
+        raise CursorError("cursor does not match ordering")
+
+    clauses = []
+    equal = Q()
+    for key, value in zip(keys, values):
+        field = key.lstrip('-')
+        descending = key.startswith('-')
+        if value is None:
+            # Only non-null values follow a null when ascending. Nothing
+            # but more nulls follow when descending.
+            following = None if descending else Q(**{field + '__isnull': False})
+            same = Q(**{field + '__isnull': True})
+        else:
+            following = (Q(**{field + '__lt': value}) | Q(**{field + '__isnull': True})) if descending \
+                else Q(**{field + '__gt': value})
+            same = Q(**{field: value})
+
+        if following is not None:
+            clauses.append(equal & following)
+        equal &= same
+
+    if not clauses:
+        return objs.none()
+    try:
+        return objs.filter(reduce(or_, clauses))
+    except (ValueError, ValidationError) as e:
+        raise CursorError(e)
+
+def key_values(objs, keys: List[str], pk: int) -> List[Any]:
+    "Return the values of the ordering 'keys' for the row with primary key 'pk' in 'objs'."
+    return list(objs.model._base_manager.filter(pk=pk).values_list(*[k.lstrip('-') for k in keys])[0])
+
+def cursor_for(objs, keys: List[str], pk: int) -> str:
+    "Return the cursor pointing after the row with primary key 'pk' in 'objs' ordered by 'keys'."
+    return encode_cursor(key_values(objs, keys, pk))
+
+def estimate_count(objs) -> Optional[int]:
+    """Return the optimizer's estimate of the number of rows of the
+    queryset 'objs', or None if it cannot be determined.
+    """
+    sql, params = objs.query.sql_with_params()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [c[0].lower() for c in cursor.description]
+            row = cursor.fetchone()
+    except Exception as e:
+        logger.warning("unable to estimate row count: %s", e)
+        return None
+    return estimate_from_plan(columns, row)
+
+def estimate_from_plan(columns: List[str], row) -> Optional[int]:
+    """Return the number of rows estimated by the first 'row' of an
+    EXPLAIN result with the lower cased 'columns', or None if it has no
+    estimate.
+    """
+    if row is None or 'rows' not in columns:
+        return None
+    plan = dict(zip(columns, row))
+    rows = plan['rows'] or 0
+    filtered = plan.get('filtered', None)
+    return int(rows * filtered / 100) if filtered is not None else int(rows)
@@ -1,8 +1,70 @@
-from django.test import TestCase
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+from specifyweb.specify import load_datamodel
 from specifyweb.specify.models import datamodel
+from specifyweb.specify.serialize_datamodel import datamodel_to_json
 
 class DatamodelTests(TestCase):
-    pass
+    def test_lookups_are_case_insensitive(self):
+        table = datamodel.get_table_strict('COLLECTIONOBJECT')
+        self.assertIs(table, datamodel.get_table_strict('CollectionObject'))
+        self.assertIs(table, datamodel.get_table_by_id_strict(table.tableId))
+        self.assertIs(table.get_field_strict('CATALOGNUMBER'), table.get_field_strict('catalogNumber'))
+        self.assertIs(table.get_field_strict(table.idFieldName.upper()), table.idField)
+        self.assertIsNone(datamodel.get_table('NoSuchTable'))
+        self.assertIsNone(table.get_field('noSuchField'))
+
+    def test_snapshot_roundtrip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'datamodel.pickle')
+            load_datamodel.write_snapshot(path, 'key', datamodel)
+            self.assertIsNone(load_datamodel.read_snapshot(path, 'other-key'))
+            loaded = load_datamodel.read_snapshot(path, 'key')
+
+            with open(path, 'ab') as f:
+                f.write(b'tampered')
+            self.assertIsNone(load_datamodel.read_snapshot(path, 'key'), "modified snapshots are not unpickled")
+
+        self.assertEqual(loaded.serialized, datamodel_to_json(datamodel))
+        self.assertEqual(datamodel_to_json(loaded), loaded.serialized)
+        table = loaded.get_table_strict('collectionobject')
+        self.assertTrue(table.get_relationship('determinations').dependent)
+        self.assertTrue(table.idField.required)
+
+    def test_unloadable_snapshot_not_rewritten(self):
+        with open(load_datamodel.datamodel_xml_path(), 'rb') as f:
+            key = load_datamodel.snapshot_key(f.read())
+
+        with tempfile.TemporaryDirectory() as directory, \
+             override_settings(DATAMODEL_SNAPSHOT=True, DATAMODEL_SNAPSHOT_DIR=directory):
+            path = load_datamodel.snapshot_path()
+            payload = b'not a pickle'
+            with open(path, 'wb') as f:
+                f.write(('%s %s\n' % (key, load_datamodel.snapshot_signature(payload))).encode())
+                f.write(payload)
+            with open(path, 'rb') as f:
+                written = f.read()
+
+            with self.assertLogs(load_datamodel.logger, 'ERROR'):
+                loaded = load_datamodel.load_datamodel()
+
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), written)
+
+        self.assertEqual(len(loaded.tables), len(datamodel.tables))
+
+    def test_lookups_match_linear_search(self):
+        "The indexed lookups find the first table or field with the name or id, as a scan would."
+        for table in datamodel.tables:
+            first = next(t for t in datamodel.tables if t.name.lower() == table.name.lower())
+            self.assertIs(datamodel.get_table_strict(table.name), first)
+            first = next(t for t in datamodel.tables if t.tableId == table.tableId)
+            self.assertIs(datamodel.get_table_by_id_strict(table.tableId), first)
+            for field in table.all_fields:
+                first_field = next(f for f in table.all_fields if f.name.lower() == field.name.lower())
+                self.assertIs(table.get_field_strict(field.name), first_field)
 
 
 def make_attachments_field_dependent_test(table):
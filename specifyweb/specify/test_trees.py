@@ -1,7 +1,9 @@
+from django.test import override_settings
+
 from specifyweb.specify import models
 from specifyweb.specify.api_tests import ApiTests, get_table
 from specifyweb.specify.tree_stats import get_tree_stats
-from specifyweb.stored_queries.tests import SQLAlchemySetup
+from specifyweb.stored_queries.tests import SQLAlchemySetup, display_field_specs
 
 class TestTreeSetup(ApiTests):
     def setUp(self) -> None:
@@ -209,3 +211,121 @@ class TreeStatsTest(SqlTreeSetup):
         ]
 
 
+
+class TreeRankQueryTest(SqlTreeSetup):
+    def test_rank_columns(self):
+        from specifyweb.stored_queries import execution
+        field_specs = display_field_specs(['3.geography.Country', '3.geography.State'])
+
+        with self.test_session_context() as session:
+            results = execution.execute(session, self.collection, self.specifyuser, 3, False, False, field_specs, 0, 0)['results']
+
+        ranks = {row[0]: tuple(row[1:]) for row in results}
+        self.assertEqual(ranks[self.earth.id], (None, None))
+        self.assertEqual(ranks[self.usa.id], ('USA', None))
+        self.assertEqual(ranks[self.kansas.id], ('USA', 'Kansas'))
+        self.assertEqual(ranks[self.springill.id], ('USA', 'Illinois'))
+        self.assertEqual(ranks[self.greeneoh.id], ('USA', 'Ohio'))
+
+class DeferredNumberingTest(GeographyTree):
+    def test_deferred_tree_numbering(self):
+        from specifyweb.specify import tree_extras
+        with tree_extras.deferred_tree_numbering():
+            johnson = get_table('Geography').objects.create(
+                name="Johnson",
+                definitionitem=get_table('Geographytreedefitem').objects.get(name="County"),
+                definition=self.geographytreedef,
+                parent=self.kansas,
+            )
+            olathe = get_table('Geography').objects.create(
+                name="Olathe",
+                definitionitem=get_table('Geographytreedefitem').objects.get(name="City"),
+                definition=self.geographytreedef,
+                parent=johnson,
+            )
+            self.assertIsNone(johnson.nodenumber)
+            self.assertIsNone(olathe.nodenumber)
+
+        tree_extras.validate_tree_numbering('geography')
+        self.kansas.refresh_from_db()
+        johnson.refresh_from_db()
+        olathe.refresh_from_db()
+        self.assertTrue(self.kansas.nodenumber < johnson.nodenumber < olathe.nodenumber <= self.kansas.highestchildnodenumber)
+        self.assertIsNotNone(olathe.fullname)
+
+    def test_deferred_create_then_move(self):
+        from specifyweb.specify import tree_extras
+        with tree_extras.deferred_tree_numbering():
+            johnson = get_table('Geography').objects.create(
+                name="Johnson",
+                definitionitem=get_table('Geographytreedefitem').objects.get(name="County"),
+                definition=self.geographytreedef,
+                parent=self.kansas,
+            )
+            self.springmo.parent = johnson
+            self.springmo.save()
+            johnson.parent = self.mo
+            johnson.save()
+
+        tree_extras.validate_tree_numbering('geography')
+        for node in (self.mo, johnson, self.springmo):
+            node.refresh_from_db()
+        self.assertTrue(self.mo.nodenumber < johnson.nodenumber < self.springmo.nodenumber <= johnson.highestchildnodenumber <= self.mo.highestchildnodenumber)
+
+        fullname = self.springmo.fullname
+        tree_extras.set_fullnames(self.geographytreedef)
+        self.springmo.refresh_from_db()
+        self.assertEqual(self.springmo.fullname, fullname, "the full names of the moved nodes are recomputed")
+
+    def test_bulk_create_tree_node(self):
+        self.check_bulk_create_tree_node()
+
+    @override_settings(BULK_DEFERRED_TREE_NUMBERING_MIN_NODES=1)
+    def test_bulk_create_tree_node_deferred(self):
+        self.check_bulk_create_tree_node()
+
+    def check_bulk_create_tree_node(self):
+        import json
+        from django.test import Client
+        from specifyweb.specify import api
+        c = Client()
+        c.force_login(self.specifyuser)
+        response = c.post('/api/specify/bulk/', json.dumps([
+            {'operation': 'create', 'model': 'geography', 'data': {
+                'name': "Johnson",
+                'definitionitem': api.uri_for_model('geographytreedefitem', get_table('Geographytreedefitem').objects.get(name="County").id),
+                'definition': api.uri_for_model('geographytreedef', self.geographytreedef.id),
+                'parent': api.uri_for_model('geography', self.kansas.id),
+            }},
+        ]), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        [result] = json.loads(response.content)
+        self.assertEqual(result['status'], 201)
+        johnson = get_table('Geography').objects.get(id=result['resource']['id'])
+        self.assertIsNotNone(johnson.nodenumber)
+        self.assertEqual(result['resource']['nodenumber'], johnson.nodenumber)
+        self.assertEqual(result['resource']['highestchildnodenumber'], johnson.highestchildnodenumber)
+        self.assertEqual(result['resource']['fullname'], johnson.fullname)
+
+class RenumberTreeTest(GeographyTree):
+    def test_full_renumber(self):
+        from specifyweb.specify import tree_extras
+        get_table('Geography').objects.update(nodenumber=None, highestchildnodenumber=None)
+        tree_extras.renumber_tree('geography')
+        tree_extras.validate_tree_numbering('geography')
+
+    def test_incremental_renumber(self):
+        from specifyweb.specify import tree_extras
+        self.assertFalse(tree_extras.update_tree_numbering('geography'), "valid trees are left alone")
+
+        numbers = lambda: {
+            id: (nn, hcnn) for id, nn, hcnn in
+            get_table('Geography').objects.values_list('id', 'nodenumber', 'highestchildnodenumber')
+        }
+        before = numbers()
+        get_table('Geography').objects.filter(id=self.springill.id).update(nodenumber=None, highestchildnodenumber=None)
+
+        self.assertTrue(tree_extras.update_tree_numbering('geography'))
+        tree_extras.validate_tree_numbering('geography')
+        self.assertEqual(before, numbers(), "the existing order of the nodes is kept")
@@ -1,23 +1,102 @@
 import re
 from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
 import logging
 logger = logging.getLogger(__name__)
 
 
-from django.db import models, connection
+from django.db import models, connection, transaction
 from django.db.models import F, Q, ProtectedError
 from django.conf import settings
 
 from specifyweb.businessrules.exceptions import TreeBusinessRuleException
 
 from  .auditcodes import TREE_MERGE, TREE_SYNONYMIZE, TREE_DESYNONYMIZE
+from .lock_tables import named_lock
+
+# Rows read and written per statement when renumbering a tree.
+RENUMBER_BATCH_SIZE = 5000
+
+class DirtyTree(NamedTuple):
+    # The tree definitions of the nodes added.
+    treedefs: Set[Any]
+    # The tree definitions of the nodes moved or renamed by id. The full
+    # names of their subtrees are recomputed once they are renumbered.
+    changed: Dict[int, Any]
+
+# The trees that nodes were added to or moved in inside of
+# deferred_tree_numbering(), by table name. None unless inside
+# deferred_tree_numbering().
+_deferred_trees: ContextVar[Optional[Dict[str, DirtyTree]]] = ContextVar('deferred_trees', default=None)
+
+@contextmanager
+def deferred_tree_numbering():
+    """Skip maintaining the node numbers and full names of the nodes
+    added to or moved in trees within the context. The trees are marked
+    dirty instead, and are renumbered and have their full names set
+    once when the context exits normally, under the tree lock.
+    Nothing is done if an exception is raised.
+    """
+    if _deferred_trees.get() is not None:
+        yield
+        return
+
+    dirty: Dict[str, DirtyTree] = {}
+    token = _deferred_trees.set(dirty)
+    try:
+        yield
+    finally:
+        _deferred_trees.reset(token)
+
+    for table, tree in dirty.items():
+        renumber_and_set_fullnames(table, tree.treedefs, tree.changed)
+
+def mark_tree_dirty(node, changed: bool=False) -> bool:
+    """Record that 'node' was added, or moved or renamed if 'changed', without
+    numbering it if inside deferred_tree_numbering(). Returns False when
+    outside of it.
+    """
+    dirty = _deferred_trees.get()
+    if dirty is None:
+        return False
+    tree = dirty.setdefault(node._meta.db_table, DirtyTree(set(), {}))
+    if changed:
+        tree.changed[node.id] = node.definition
+    else:
+        tree.treedefs.add(node.definition)
+    return True
+
+def tree_lock(table):
+    "Serializes the renumbering of the tree 'table' across connections."
+    return named_lock('tree_' + table)
+
+def renumber_and_set_fullnames(table, treedefs, changed: Optional[Dict[int, Any]]=None):
+    """Renumber the tree 'table' and set the missing full names of the
+    nodes of 'treedefs', and the full names of the subtrees of the
+    'changed' nodes, while holding the tree lock.
+    """
+    with tree_lock(table):
+        if changed:
+            # Moves can leave numbers that still look valid, e.g. a node
+            # moved up to an ancestor of its old parent.
+            renumber_tree(table, incremental=True)
+        else:
+            update_tree_numbering(table)
+        for node_id, treedef in (changed or {}).items():
+            numbers = treedef.treeentries.model.objects.filter(id=node_id) \
+                .values_list('nodenumber', 'highestchildnodenumber').first()
+            if numbers is not None:
+                set_fullnames(treedef, node_number_range=list(numbers))
+        for treedef in treedefs:
+            set_fullnames(treedef, null_only=True)
 
 @contextmanager
 def validate_node_numbers(table, revalidate_after=True):
     try:
         validate_tree_numbering(table)
     except AssertionError:
-        renumber_tree(table)
+        renumber_tree(table, incremental=True)
     yield
     if revalidate_after:
         validate_tree_numbering(table)
@@ -40,6 +119,7 @@ class Tree(models.Model):
         prev_self = None if self.id is None \
                     else model.objects.select_for_update().get(id=self.id)
 
+        deferred = False
         if prev_self is None:
             self.nodenumber = None
             self.highestchildnodenumber = None
@@ -56,13 +136,24 @@ class Tree(models.Model):
                 save()
                 return
 
-            with validate_node_numbers(self._meta.db_table, revalidate_after=False):
-                adding_node(self)
+            if _deferred_trees.get() is not None:
+                # Numbered along with the rest of the batch.
+                check_adding_node(self)
                 save()
+                deferred = mark_tree_dirty(self)
+            else:
+                with validate_node_numbers(self._meta.db_table, revalidate_after=False):
+                    adding_node(self)
+                    save()
         elif prev_self.parent_id != self.parent_id:
-            with validate_node_numbers(self._meta.db_table):
-                moving_node(self)
+            if _deferred_trees.get() is not None:
+                check_moving_node(self)
                 save()
+                deferred = mark_tree_dirty(self, changed=True)
+            else:
+                with validate_node_numbers(self._meta.db_table):
+                    moving_node(self)
+                    save()
         else:
             save()
 
@@ -103,13 +194,18 @@ class Tree(models.Model):
                  }})
 
         if prev_self is None:
-            set_fullnames(self.definition, null_only=True, node_number_range=[self.nodenumber, self.highestchildnodenumber])
+            if not deferred:
+                set_fullnames(self.definition, null_only=True, node_number_range=[self.nodenumber, self.highestchildnodenumber])
         elif (
             prev_self.name != self.name
             or prev_self.definitionitem_id != self.definitionitem_id
             or prev_self.parent_id != self.parent_id
         ):
-            set_fullnames(self.definition, node_number_range=[self.nodenumber, self.highestchildnodenumber])
+            if not deferred and self.nodenumber is None:
+                # Added earlier within the same deferred_tree_numbering().
+                deferred = mark_tree_dirty(self, changed=True)
+            if not deferred:
+                set_fullnames(self.definition, node_number_range=[self.nodenumber, self.highestchildnodenumber])
 
     def accepted_id_attr(self):
         return 'accepted{}_id'.format(self._meta.db_table)
@@ -161,6 +257,12 @@ def close_interval(model, node_number, size):
     )
 
 def adding_node(node):
+    parent = check_adding_node(node)
+    insertion_point = open_interval(type(node), parent.nodenumber, 1)
+    node.highestchildnodenumber = node.nodenumber = insertion_point
+
+def check_adding_node(node):
+    "Lock and return the parent of the new 'node' after checking it can be added to."
     logger.info('adding node %s', node)
     model = type(node)
     parent = model.objects.select_for_update().get(id=node.parent.id)
@@ -190,14 +292,30 @@ def adding_node(node):
                     "children": list(parent.children.values('id', 'fullname'))
                  }})
 
-    insertion_point = open_interval(model, parent.nodenumber, 1)
-    node.highestchildnodenumber = node.nodenumber = insertion_point
+    return parent
 
 def moving_node(to_save):
-    logger.info('moving node %s', to_save)
     model = type(to_save)
     current = model.objects.get(id=to_save.id)
     size = current.highestchildnodenumber - current.nodenumber + 1
+    new_parent = check_moving_node(to_save)
+
+    insertion_point = open_interval(model, new_parent.nodenumber, size)
+    # node interval will have moved if it is to the right of the insertion point
+    # so fetch again
+    current = model.objects.get(id=current.id)
+    move_interval(model, current.nodenumber, current.highestchildnodenumber, insertion_point)
+    close_interval(model, current.nodenumber, size)
+
+    # update the nodenumbers in to_save so the new values are not overwritten.
+    current = model.objects.get(id=current.id)
+    to_save.nodenumber = current.nodenumber
+    to_save.highestchildnodenumber = current.highestchildnodenumber
+
+def check_moving_node(to_save):
+    "Lock and return the new parent of 'to_save' after checking it can be moved there."
+    logger.info('moving node %s', to_save)
+    model = type(to_save)
     new_parent = model.objects.select_for_update().get(id=to_save.parent.id)
     if new_parent.accepted_id is not None:
         raise TreeBusinessRuleException(
@@ -220,17 +338,7 @@ def moving_node(to_save):
                 "children": list(new_parent.children.values('id', 'fullname'))
              }})
 
-    insertion_point = open_interval(model, new_parent.nodenumber, size)
-    # node interval will have moved if it is to the right of the insertion point
-    # so fetch again
-    current = model.objects.get(id=current.id)
-    move_interval(model, current.nodenumber, current.highestchildnodenumber, insertion_point)
-    close_interval(model, current.nodenumber, size)
-
-    # update the nodenumbers in to_save so the new values are not overwritten.
-    current = model.objects.get(id=current.id)
-    to_save.nodenumber = current.nodenumber
-    to_save.highestchildnodenumber = current.highestchildnodenumber
+    return new_parent
 
 def mutation_log(action, node, agent, parent, dirty_flds):
     from .auditlog import auditlog
@@ -570,17 +678,71 @@ def print_paths(table, depth):
         print(r)
     print(sql)
 
-def renumber_tree(table):
-    logger.info('renumbering tree')
+def renumber_tree(table, incremental=False):
+    """Set the nodenumbers and highestchildnodenumbers of the tree 'table'
+    from a depth first traversal of its parent links made in python.
+
+    A full renumbering orders siblings by name after setting the rankids
+    from the tree definition items. An incremental one keeps the
+    existing order of the numbered nodes and places the unnumbered ones
+    after their numbered siblings, so that only the nodes following the
+    first change get new numbers. Either way, only the rows whose
+    numbers change are written.
+
+    The nodes are read with a locking read inside of a transaction, so
+    nodes added or moved concurrently by Tree.save either finish before
+    they are read or wait until the new numbers are committed.
+    """
+    with transaction.atomic():
+        _renumber_tree(table, incremental)
+
+def _renumber_tree(table, incremental):
+    logger.info('renumbering tree%s', ' incrementally' if incremental else '')
     cursor = connection.cursor()
 
-    # make sure rankids are set correctly
-    cursor.execute((
-        "update {table} t\n"
-        "join {table}treedefitem d on t.{table}treedefitemid = d.{table}treedefitemid\n"
-        "set t.rankid = d.rankid\n"
-    ).format(table=table))
+    if not incremental:
+        # make sure rankids are set correctly
+        cursor.execute((
+            "update {table} t\n"
+            "join {table}treedefitem d on t.{table}treedefitemid = d.{table}treedefitemid\n"
+            "set t.rankid = d.rankid\n"
+        ).format(table=table))
+        check_tree_ranks(cursor, table)
+
+    order = "nodenumber is null, nodenumber, {table}id" if incremental else "name, {table}id"
+    changed, unreachable = number_tree(cursor, table, order.format(table=table))
+    if unreachable:
+        # Nothing has been written yet.
+        if incremental:
+            check_tree_ranks(cursor, table)
+        raise AssertionError("Bad Tree Structure: Found {} node(s) not descending from a root".format(unreachable))
+    write_node_numbers(cursor, table, changed)
+
+    # Clear the BadNodes and UpdateNodes flags.
+    tree_flags(table).update(islocked=False)
 
+def update_tree_numbering(table):
+    """Incrementally renumber the tree 'table' if it is flagged as
+    needing it, or if its numbering is not valid. Returns True if it was
+    renumbered.
+    """
+    if not tree_flags(table).filter(islocked=True).exists():
+        try:
+            validate_tree_numbering(table)
+            return False
+        except AssertionError:
+            pass
+    renumber_tree(table, incremental=True)
+    return True
+
+def tree_flags(table):
+    "The Sptasksemaphore rows flagging the tree 'table' as needing renumbering."
+    from .models import datamodel, Sptasksemaphore
+    tree_model = datamodel.get_table(table)
+    tasknames = [name.format(tree_model.name) for name in ("UpdateNodes{}", "BadNodes{}")]
+    return Sptasksemaphore.objects.filter(taskname__in=tasknames)
+
+def check_tree_ranks(cursor, table):
     # make sure there are no cycles
     cursor.execute((
         "select p.{table}id, p.fullname, t.{table}id, t.fullName, tdef.title\n"
@@ -611,52 +773,63 @@ def renumber_tree(table):
         f"Bad Tree Structure: Found {bad_ranks_count} case(s) where node rank is not greater than its parent",
         formattedResults)
 
-    # Get the tree ranks in leaf -> root order.
-    cursor.execute("select distinct rankid from {} order by rankid desc".format(table))
-    ranks = [rank for (rank,) in cursor.fetchall()]
-    depth = len(ranks)
-
-    # Construct a path enumeration for each node and set the
-    # nodenumbers according to the lexical ordering of the paths. This
-    # ensures ancestor node numbers come before descendents and
-    # sibling nodes get consecutive ranges.
-    cursor.execute("set @rn := 0")
+def number_tree(cursor, table, order):
+    """Number the nodes of the tree 'table' in a depth first traversal
+    visiting siblings in the SQL 'order'. Returns the (id, nodenumber,
+    highestchildnodenumber) triples of the nodes whose numbers change and
+    the count of nodes not reached from a root. Nothing is written, but
+    the rows read stay locked until the transaction ends.
+    """
     cursor.execute((
-        "update {table} t\n"
-        "join (select @rn := @rn + 1 as nn, p.id as id from \n"
-        "         (select t0.{table}id as id, {path} as path\n"
-        "          from {table} t0\n"
-        "          {parent_joins}\n"
-        "          order by path) p\n"
-        ") r on t.{table}id = r.id\n"
-        # Set the highestchildnodenumber to be the same as the
-        # nodenumber.  This is correct for leaves, and interior nodes
-        # will be adjusted in the next step.
-        "set t.nodenumber = r.nn, t.highestchildnodenumber = r.nn\n"
-    ).format(
-        table=table,
-        path=path_expr(table, depth),
-        parent_joins=parent_joins(table, depth),
-    ))
-
-    # Adjust the highestchildnodenumbers working from the penultimate
-    # rank downward towards the roots. The highest rank cannot have
-    # any children, so all nodes there correctly have
-    # highestchildnodenumber = nodenumber as set in the previous step.
-    # Interior nodes are updated by inner joining against their
-    # children so that nodes with no children are not updated leaving
-    # highestchildnodenumber = nodenumber.
-    for rank in ranks[1:]:
+        "select {table}id, parentid, nodenumber, highestchildnodenumber\n"
+        "from {table} order by {order} for update"
+    ).format(table=table, order=order))
+
+    roots: List[int] = []
+    children: Dict[int, List[int]] = {}
+    current: Dict[int, Tuple[Optional[int], Optional[int]]] = {}
+    while True:
+        rows = cursor.fetchmany(RENUMBER_BATCH_SIZE)
+        if not rows:
+            break
+        for id, parentid, nodenumber, highestchildnodenumber in rows:
+            current[id] = (nodenumber, highestchildnodenumber)
+            if parentid is None:
+                roots.append(id)
+            else:
+                children.setdefault(parentid, []).append(id)
+
+    numbers: Dict[int, Tuple[int, int]] = {}
+    nodenumber = 0
+    stack: List[Tuple[int, bool]] = [(id, False) for id in reversed(roots)]
+    while stack:
+        id, visited = stack.pop()
+        if visited:
+            numbers[id] = (numbers[id][0], nodenumber)
+            continue
+        nodenumber += 1
+        numbers[id] = (nodenumber, nodenumber)
+        stack.append((id, True))
+        stack.extend((child, False) for child in reversed(children.get(id, [])))
+
+    changed = [(id, nn, hcnn) for id, (nn, hcnn) in numbers.items() if current[id] != (nn, hcnn)]
+    logger.info('renumbering %d of %d nodes', len(changed), len(current))
+    return changed, len(current) - len(numbers)
+
+def write_node_numbers(cursor, table, changed):
+    "Write the (id, nodenumber, highestchildnodenumber) triples 'changed' through a temporary table join."
+    if not changed:
+        return
+    cursor.execute("create temporary table tree_renumbering (id int primary key, nn int, hcnn int)")
+    try:
+        for start in range(0, len(changed), RENUMBER_BATCH_SIZE):
+            cursor.executemany(
+                "insert into tree_renumbering (id, nn, hcnn) values (%s, %s, %s)",
+                changed[start:start + RENUMBER_BATCH_SIZE],
+            )
         cursor.execute((
-            "update {table} t join (\n"
-            "   select max(highestchildnodenumber) as hcnn, parentid\n"
-            "   from {table} where rankid > %(rank)s group by parentid\n"
-            ") as sub on sub.parentid = t.{table}id\n"
-            "set highestchildnodenumber = hcnn where rankid = %(rank)s\n"
-        ).format(table=table), {'rank': rank})
-
-    # Clear the BadNodes and UpdateNodes flags.
-    from .models import datamodel, Sptasksemaphore
-    tree_model = datamodel.get_table(table)
-    tasknames = [name.format(tree_model.name) for name in ("UpdateNodes{}", "BadNodes{}")]
-    Sptasksemaphore.objects.filter(taskname__in=tasknames).update(islocked=False)
\ No newline at end of file
+            "update {table} t join tree_renumbering r on t.{table}id = r.id\n"
+            "set t.nodenumber = r.nn, t.highestchildnodenumber = r.hcnn"
+        ).format(table=table))
+    finally:
+        cursor.execute("drop temporary table tree_renumbering")
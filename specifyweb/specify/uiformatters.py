@@ -19,6 +19,7 @@ from specifyweb.context.app_resource import get_app_resource
 
 from .models import Splocalecontaineritem as Item
 from .filter_by_col import filter_by_collection
+from .batch_cache import batch_memoize
 
 class AutonumberOverflowException(Exception):
     pass
@@ -300,6 +301,12 @@ def new_field(node) -> Field:
         by_year = node.attrib.get('byyear', 'false') == 'true')
 
 def get_uiformatters(collection, user, tablename: str) -> List[UIFormatter]:
+    return batch_memoize(
+        ('uiformatters', collection.id, getattr(user, 'id', None), tablename.lower()),
+        lambda: _get_uiformatters(collection, user, tablename),
+    )
+
+def _get_uiformatters(collection, user, tablename: str) -> List[UIFormatter]:
     filters = dict(container__discipline=collection.discipline,
                    container__name=tablename.lower(),
                    format__isnull=False)
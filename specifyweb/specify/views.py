@@ -82,6 +82,7 @@ def api_view(dispatch_func):
 
 resource = api_view(api.resource_dispatch)
 collection = api_view(api.collection_dispatch)
+bulk = api_view(api.bulk_dispatch)
 
 
 def raise_error(request):
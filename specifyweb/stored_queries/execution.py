@@ -1,28 +1,43 @@
 import csv
+import gzip
+import io
 import json
 import logging
 import os
-import re
+import shutil
+import threading
+import time
 import xml.dom.minidom
-from collections import namedtuple, defaultdict
+import zipfile
+from collections import namedtuple, defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import reduce
 
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
 from sqlalchemy import sql, orm, func, select
 from sqlalchemy.sql.expression import asc, desc, insert, literal
 
 from specifyweb.stored_queries.group_concat import group_by_displayed_fields
 
 from . import models
-from .format import ObjectFormatter
+from .explain import Explain
+from .format import ObjectFormatter, formatter_registry_version
 from .query_construct import QueryConstruct
 from .queryfield import QueryField
 from .relative_date_utils import apply_absolute_date
+from .result_cache import cached_results, table_written
+from .select_into_outfile import SelectIntoOutfile
 from .field_spec_maps import apply_specify_user_name
+from ..context.app_resource import app_resources_version
 from ..notifications.models import Message
 from ..permissions.permissions import check_table_permissions
+from ..specify.api import StreamedList, STREAM_BATCH_SIZE
+from ..specify.pagination import estimate_from_plan
 from ..specify.auditlog import auditlog
 from ..specify.models import Loan, Loanpreparation, Loanreturnpreparation
 
@@ -30,6 +45,13 @@ logger = logging.getLogger(__name__)
 
 SORT_TYPES = [None, asc, desc]
 
+# Number of rows fetched from the server side cursor at a time
+# when exporting query results.
+EXPORT_BATCH_SIZE = 10000
+
+# Line breaks in exported values are replaced with spaces.
+LINE_BREAKS = str.maketrans('\r\n', '  ')
+
 def set_group_concat_max_len(session):
     """The default limit on MySQL group concat function is quite
     small. This function increases it for the database connection for
@@ -155,10 +177,11 @@ def do_export(spquery, collection, user, filename, exporttype, host):
             query_to_csv(session, collection, user, tableid, field_specs, path,
                          recordsetid=recordsetid, 
                          captions=spquery['captions'], strip_id=True,
-                         distinct=spquery['selectdistinct'], delimiter=spquery['delimiter'],)
+                         distinct=spquery['selectdistinct'], delimiter=spquery['delimiter'],
+                         compress=spquery.get('compress', False))
         elif exporttype == 'kml':
             query_to_kml(session, collection, user, tableid, field_specs, path, spquery['captions'], host,
-                         recordsetid=recordsetid, strip_id=False)
+                         recordsetid=recordsetid, strip_id=False, compress=spquery.get('compress', False))
             message_type = 'query-export-to-kml-complete'
 
     Message.objects.create(user=user, content=json.dumps({
@@ -183,19 +206,25 @@ def stored_query_to_csv(query_id, collection, user, path):
 
 def query_to_csv(session, collection, user, tableid, field_specs, path,
                  recordsetid=None, captions=False, strip_id=False, row_filter=None,
-                 distinct=False, delimiter=','):
+                 distinct=False, delimiter=',', compress=False):
     """Build a sqlalchemy query using the QueryField objects given by
     field_specs and send the results to a CSV file at the given
-    file path.
+    file path. The file is gzip compressed if 'compress' is true.
+
+    Rows are fetched and written in batches of EXPORT_BATCH_SIZE, unless
+    the QUERY_EXPORT_INTO_OUTFILE setting lets the database server
+    write them itself.
 
     See build_query for details of the other accepted arguments.
     """
     set_group_concat_max_len(session)
-    query, __ = build_query(session, collection, user, tableid, field_specs, recordsetid, replace_nulls=True, distinct=distinct)
+    query, __ = build_sized_query(session, collection, user, tableid, field_specs, recordsetid=recordsetid,
+                                  replace_nulls=True, distinct=distinct)
+    skip = 1 if strip_id or distinct else 0
 
     logger.debug('query_to_csv starting')
 
-    with open(path, 'w', newline='', encoding='utf-8') as f:
+    with open_export_file(path, compress) as f:
         csv_writer = csv.writer(f, delimiter=delimiter)
         if captions:
             header = captions
@@ -203,16 +232,67 @@ def query_to_csv(session, collection, user, tableid, field_specs, path,
                 header = ['id'] + header
             csv_writer.writerow(header)
 
-        for row in query.yield_per(1):
-            if row_filter is not None and not row_filter(row): continue
-            encoded = [
-                re.sub('\r|\n', ' ', str(f))
-                for f in (row[1:] if strip_id or distinct else row)
-            ]
-            csv_writer.writerow(encoded)
+        if row_filter is not None or not getattr(settings, 'QUERY_EXPORT_INTO_OUTFILE', False) \
+           or not query_into_outfile(session, query, f, path, skip, delimiter):
+            for rows in fetch_in_batches(session, query):
+                if row_filter is not None:
+                    rows = [row for row in rows if row_filter(row)]
+                csv_writer.writerows(sanitize_rows(rows, skip))
 
     logger.debug('query_to_csv finished')
 
+def fetch_in_batches(session, query):
+    "Yield the result rows of 'query' in lists of up to EXPORT_BATCH_SIZE rows."
+    result = session.execute(query.statement)
+    while True:
+        rows = result.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows: break
+        yield rows
+
+def open_export_file(path, compress=False):
+    if compress:
+        return gzip.open(path, 'wt', newline='', encoding='utf-8')
+    return open(path, 'w', newline='', encoding='utf-8')
+
+def sanitize_rows(rows, skip=0):
+    """Return the values of the rows as strings without line breaks,
+    dropping the first 'skip' columns. The values are converted a
+    column at a time.
+    """
+    columns = list(zip(*rows))[skip:]
+    return zip(*([str(v).translate(LINE_BREAKS) for v in column] for column in columns))
+
+def query_into_outfile(session, query, f, path, skip=0, delimiter=','):
+    """Have the database server write the results of 'query' to a
+    temporary file next to 'path' with SELECT ... INTO OUTFILE and
+    copy them to the open file 'f'. This requires the database server
+    to share the filesystem at the same path and to have the FILE
+    privilege there.
+
+    Values are written as MySQL formats them, with line breaks replaced
+    and nulls blank. Returns False without writing anything if the
+    database server cannot write the file.
+    """
+    columns = [
+        func.replace(func.replace(func.coalesce(c['expr'], ''), '\r', ' '), '\n', ' ')
+        for c in query.column_descriptions[skip:]
+    ]
+    rows_path = path + '.rows'
+    try:
+        session.execute(SelectIntoOutfile(
+            query.with_entities(*columns).statement, rows_path,
+            delimiter=delimiter, line_terminator='\r\n', escaped_by='"'))
+    except Exception as e:
+        logger.warning("unable to export with INTO OUTFILE, falling back to fetching rows: %s", e)
+        return False
+
+    try:
+        with open(rows_path, newline='', encoding='utf-8') as rows:
+            shutil.copyfileobj(rows, f)
+    finally:
+        os.remove(rows_path)
+    return True
+
 def row_has_geocoords(coord_cols, row):
     """Assuming single point
     """
@@ -220,26 +300,23 @@ def row_has_geocoords(coord_cols, row):
 
 
 def query_to_kml(session, collection, user, tableid, field_specs, path, captions, host,
-                 recordsetid=None, strip_id=False):
+                 recordsetid=None, strip_id=False, compress=False):
     """Build a sqlalchemy query using the QueryField objects given by
     field_specs and send the results to a kml file at the given
-    file path.
+    file path. If 'compress' is true the file is written as a KMZ
+    archive instead.
+
+    Rows are fetched from the server side cursor STREAM_BATCH_SIZE at a
+    time and each placemark is written as soon as it is created.
 
     See build_query for details of the other accepted arguments.
     """
     set_group_concat_max_len(session)
-    query, __ = build_query(session, collection, user, tableid, field_specs, recordsetid, replace_nulls=True)
+    query, __ = build_sized_query(session, collection, user, tableid, field_specs, recordsetid=recordsetid,
+                                  replace_nulls=True)
 
     logger.debug('query_to_kml starting')
 
-    kmlDoc = xml.dom.minidom.Document()
-
-    kmlElement = kmlDoc.createElementNS('http://earth.google.com/kml/2.2', 'kml')
-    kmlElement.setAttribute('xmlns','http://earth.google.com/kml/2.2')
-    kmlElement = kmlDoc.appendChild(kmlElement)
-    documentElement = kmlDoc.createElement('Document')
-    documentElement = kmlElement.appendChild(documentElement)
-
     if not strip_id:
         model = models.models_by_tableid[tableid]
         table = str(getattr(model, model._id)).split('.')[0].lower() #wtfiw
@@ -248,16 +325,40 @@ def query_to_kml(session, collection, user, tableid, field_specs, path, captions
 
     coord_cols = getCoordinateColumns(field_specs, table != None)
 
-    for row in query.yield_per(1):
-        if row_has_geocoords(coord_cols, row):
-            placemarkElement = createPlacemark(kmlDoc, row, coord_cols, table, captions, host)
-            documentElement.appendChild(placemarkElement)
+    # Only used to create the placemark elements.
+    kmlDoc = xml.dom.minidom.Document()
+
+    with open_kml_file(path, compress) as kmlFile:
+        kmlFile.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        kmlFile.write('<kml xmlns="http://earth.google.com/kml/2.2">\n')
+        kmlFile.write('  <Document>\n')
+
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            if row_has_geocoords(coord_cols, row):
+                placemarkElement = createPlacemark(kmlDoc, row, coord_cols, table, captions, host)
+                placemarkElement.writexml(kmlFile, '    ', '  ', '\n')
+                placemarkElement.unlink()
 
-    with open(path, 'wb') as kmlFile:
-        kmlFile.write(kmlDoc.toprettyxml('  ', newl = '\n', encoding = 'utf-8'))
+        kmlFile.write('  </Document>\n')
+        kmlFile.write('</kml>\n')
 
     logger.debug('query_to_kml finished')
 
+@contextmanager
+def open_kml_file(path, compress=False):
+    """Open a text file for writing KML at 'path', inside a KMZ archive
+    if 'compress' is true.
+    """
+    if not compress:
+        with open(path, 'w', encoding='utf-8') as f:
+            yield f
+        return
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as kmz, \
+         kmz.open('doc.kml', 'w') as entry, \
+         io.TextIOWrapper(entry, encoding='utf-8') as f:
+        yield f
+
 def getCoordinateColumns(field_specs, hasId):
     lat1, lng1, lat2, lng2, lltype = (-1,-1,-1,-1,-1)
     f = 1 if hasId else 0
@@ -395,6 +496,9 @@ def run_ephemeral_query(collection, user, spquery):
     distinct = spquery['selectdistinct']
     tableid = spquery['contexttableid']
     count_only = spquery['countonly']
+    # Either 'exact' or 'estimate' to include the count with the results.
+    with_count = spquery.get('includecount', None)
+    cache_results = spquery.get('cacheresults', False)
     try:
         format_audits = spquery['formatauditrecids']
     except:
@@ -403,7 +507,10 @@ def run_ephemeral_query(collection, user, spquery):
     with models.session_context() as session:
         field_specs = field_specs_from_json(spquery['fields'])
         return execute(session, collection, user, tableid, distinct, count_only,
-                       field_specs, limit, offset, recordsetid, formatauditobjs=format_audits)
+                       field_specs, limit, offset, recordsetid, formatauditobjs=format_audits,
+                       with_count=with_count if with_count in COUNT_MODES else None,
+                       count_session_context=models.session_context,
+                       cache_results=cache_results)
 
 def augment_field_specs(field_specs, formatauditobjs=False):
     print("augment_field_specs ######################################")
@@ -462,9 +569,23 @@ def recordset(collection, user, user_agent, recordset_info):
         ins = insert(RSI).from_select((RSI.recordId, RSI.RecordSetID), query)
         session.execute(ins)
 
+    table_written('recordsetitem')
     return new_rs_id
 
-def return_loan_preps(collection, user, agent, data):
+# Number of loan preparations updated or return preparations inserted
+# per statement when returning loan preparations.
+RETURN_BATCH_SIZE = 1000
+
+def return_loan_preps(collection, user, agent, data, session_context=None):
+    """Resolve and return the unresolved quantities of the loan
+    preparations matched by the query in 'data', closing any loans that
+    are then fully resolved. The loan preparations are locked, updated,
+    audited and given return preparations with a few set based
+    statements rather than row by row. Only the list of preparations to
+    return is computed unless 'data' has 'commit' set. The query is run
+    in a session from 'session_context', models.session_context by
+    default.
+    """
     spquery = data['query']
     commit = data['commit']
 
@@ -475,7 +596,7 @@ def return_loan_preps(collection, user, agent, data):
          "expectedTableId": Loanpreparation.specify_model.tableId,
          "localizationKey" : "unexpectedTableId"})
 
-    with models.session_context() as session:
+    with (session_context or models.session_context)() as session:
         model = models.models_by_tableid[tableid]
         id_field = getattr(model, model._id)
 
@@ -495,21 +616,33 @@ def return_loan_preps(collection, user, agent, data):
         if not commit:
             return to_return
         with transaction.atomic():
-            for lp_id, quantity, _, _ in to_return:
-                lp = Loanpreparation.objects.select_for_update().get(pk=lp_id)
-                was_resolved = lp.isresolved
+            quantities = {lp_id: quantity for lp_id, quantity, _, _ in to_return}
+            lps = list(Loanpreparation.objects.select_for_update().filter(pk__in=quantities.keys()))
+            now = timezone.now()
+            updates = []
+            for lp in lps:
+                quantity = quantities[lp.id]
+                updates.append((lp, [
+                    {'field_name': 'quantityresolved', 'old_value': lp.quantityresolved, 'new_value': lp.quantityresolved + quantity},
+                    {'field_name': 'quantityreturned', 'old_value': lp.quantityreturned, 'new_value': lp.quantityreturned + quantity},
+                    {'field_name': 'isresolved', 'old_value': lp.isresolved, 'new_value': True},
+                ]))
                 lp.quantityresolved = lp.quantityresolved + quantity
                 lp.quantityreturned = lp.quantityreturned + quantity
                 lp.isresolved = True
-                lp.save()
-
-                auditlog.update(lp, agent, None, [
-                    {'field_name': 'quantityresolved', 'old_value': lp.quantityresolved - quantity, 'new_value': lp.quantityresolved},
-                    {'field_name': 'quantityreturned', 'old_value': lp.quantityreturned - quantity, 'new_value': lp.quantityreturned},
-                    {'field_name': 'isresolved', 'old_value': was_resolved, 'new_value': True},
-                ])
-
-                new_lrp = Loanreturnpreparation.objects.create(
+                lp.timestampmodified = now
+
+            # Returning only makes more of each preparation available, so
+            # the availability rule checked when saving cannot fail here.
+            Loanpreparation.objects.bulk_update(
+                lps, ['quantityresolved', 'quantityreturned', 'isresolved', 'timestampmodified'],
+                batch_size=RETURN_BATCH_SIZE)
+            table_written(Loanpreparation._meta.db_table)
+            auditlog.update_many(updates, agent)
+
+            last_lrp_id = Loanreturnpreparation.objects.aggregate(Max('id'))['id__max'] or 0
+            Loanreturnpreparation.objects.bulk_create([
+                Loanreturnpreparation(
                     quantityresolved=quantity,
                     quantityreturned=quantity,
                     loanpreparation_id=lp_id,
@@ -518,7 +651,16 @@ def return_loan_preps(collection, user, agent, data):
                     createdbyagent=agent,
                     discipline=collection.discipline,
                 )
-                auditlog.insert(new_lrp, agent)
+                for lp_id, quantity in quantities.items()
+            ], batch_size=RETURN_BATCH_SIZE)
+            table_written(Loanreturnpreparation._meta.db_table)
+            # The loan preparations are locked, so the only new return
+            # preparations for them are the ones just inserted.
+            auditlog.insert_many(list(Loanreturnpreparation.objects.filter(
+                id__gt=last_lrp_id,
+                loanpreparation_id__in=quantities.keys(),
+            )), agent)
+
             loans_to_close = Loan.objects.select_for_update().filter(
                 pk__in=set((loan_id for _, _, loan_id, _ in to_return)),
                 isclosed=False,
@@ -533,24 +675,200 @@ def return_loan_preps(collection, user, agent, data):
                 ])
         return to_return
 
-def execute(session, collection, user, tableid, distinct, count_only, field_specs, limit, offset, recordsetid=None, formatauditobjs=False):
-    "Build and execute a query, returning the results as a data structure for json serialization"
+COUNT_MODES = ('exact', 'estimate')
 
-    set_group_concat_max_len(session)
-    query, order_by_exprs = build_query(session, collection, user, tableid, field_specs, recordsetid=recordsetid, formatauditobjs=formatauditobjs, distinct=distinct)
+# Aggregations are computed as grouped derived tables joined to the
+# query instead of as correlated subqueries when more than this many
+# result rows are expected. See build_sized_query.
+AGGREGATE_WITH_JOINS_MIN_ROWS = 1000
+
+# Threads counting query results alongside fetching them.
+COUNT_WORKERS = 4
+
+_count_executor = ThreadPoolExecutor(max_workers=COUNT_WORKERS, thread_name_prefix='query-count')
+
+def execute(session, collection, user, tableid, distinct, count_only, field_specs, limit, offset, recordsetid=None, formatauditobjs=False, stream=False,
+            with_count=None, count_session_context=None, cache_results=False):
+    """Build and execute a query, returning the results as a data structure for json serialization.
+
+    If 'stream' is true, the results are returned as a StreamedList fetching
+    rows from the server side cursor in batches. The session must then be
+    kept open until the results have been consumed.
+
+    If 'with_count' is one of COUNT_MODES, the exact or estimated number
+    of rows is included with the results. It is determined without the
+    formatted columns, concurrently in a session from
+    'count_session_context' if one is given.
 
+    If 'cache_results' is true, the results of an identical earlier
+    query are returned while the tables it reads are unchanged. See
+    result_cache.cached_results. Streamed results are never cached.
+    """
+
+    set_group_concat_max_len(session)
     if count_only:
-        return {'count': query.count()}
+        query, order_by_exprs = build_query(session, collection, user, tableid, field_specs, recordsetid=recordsetid, formatauditobjs=formatauditobjs, distinct=distinct)
     else:
+        query, order_by_exprs = build_sized_query(session, collection, user, tableid, field_specs, limit=limit, recordsetid=recordsetid,
+                                                  formatauditobjs=formatauditobjs, distinct=distinct)
+
+    counting = None
+    if not count_only:
+        if with_count is not None:
+            counting = counting_query(query)
+
         logger.debug("order by: %s", order_by_exprs)
         query = query.order_by(*order_by_exprs).offset(offset)
         if limit:
             query = query.limit(limit)
 
-        return {'results': list(query)}
+    def run():
+        start = time.perf_counter()
+        try:
+            if count_only:
+                return {'count': query.count()}
+
+            count = count_future = None
+            if counting is not None:
+                if count_session_context is not None:
+                    count_future = _count_executor.submit(count_in_session, counting.with_session(None), with_count, count_session_context)
+                else:
+                    count = count_rows(session, counting, with_count)
+
+            if stream:
+                # Start executing now so errors are raised before any response is sent.
+                data = {'results': StreamedList(iter(query.yield_per(STREAM_BATCH_SIZE)))}
+            else:
+                data = {'results': list(query)}
+
+            if counting is not None:
+                data['count'] = count_future.result() if count_future is not None else count
+            return data
+        finally:
+            record_query_timing('execute', time.perf_counter() - start)
+
+    if cache_results and not stream:
+        return cached_results(query, (count_only, with_count), run)
+    return run()
+
+def counting_query(query):
+    """Return 'query' selecting only its first column. The formatted
+    and aggregated columns are dropped while the joins, filters and
+    grouping that determine the rows are kept.
+    """
+    return query.with_entities(query.column_descriptions[0]['expr'])
+
+def count_in_session(query, mode, session_context):
+    with session_context() as session:
+        set_group_concat_max_len(session)
+        return count_rows(session, query.with_session(session), mode)
+
+def count_rows(session, query, mode):
+    "Return the number of rows of 'query' or the optimizer's estimate of it if 'mode' is 'estimate'."
+    if mode == 'exact':
+        return query.count()
+
+    result = session.execute(Explain(query.statement))
+    columns = [c.lower() for c in result.keys()]
+    return estimate_from_plan(columns, result.first())
+
+# Maximum number of built queries kept by build_query.
+QUERY_PLAN_CACHE_SIZE = 256
+
+QueryPlan = namedtuple('QueryPlan', 'query order_by_exprs tables_to_read')
+
+_query_plans: "OrderedDict[tuple, QueryPlan]" = OrderedDict()
+_query_plans_lock = threading.Lock()
+_query_stats = {'hits': 0, 'misses': 0, 'build_seconds': 0.0, 'execute_seconds': 0.0, 'executions': 0}
+
+def query_plan_stats():
+    """Return the hit and miss counts of the query plan cache along
+    with the total time spent building and executing queries.
+    """
+    with _query_plans_lock:
+        return dict(_query_stats, size=len(_query_plans))
+
+def record_query_timing(phase, seconds):
+    with _query_plans_lock:
+        _query_stats[phase + '_seconds'] += seconds
+        if phase == 'execute':
+            _query_stats['executions'] += 1
+
+def clear_query_plan_cache():
+    with _query_plans_lock:
+        _query_plans.clear()
 
 def build_query(session, collection, user, tableid, field_specs,
-                recordsetid=None, replace_nulls=False, formatauditobjs=False, distinct=False, implicit_or=True):
+                recordsetid=None, replace_nulls=False, formatauditobjs=False, distinct=False, implicit_or=True,
+                aggregate_with_joins=False):
+    """Return the sqlalchemy query for the given QueryField objects and
+    the expressions to order it by, reusing the query built for an
+    identical request while the formatters are unchanged. The table
+    permissions are checked every time.
+
+    See _build_query for the arguments.
+    """
+    field_specs = [apply_absolute_date(field_spec) for field_spec in field_specs]
+    field_specs = [apply_specify_user_name(field_spec, user) for field_spec in field_specs]
+
+    key = (tableid, tuple(field_specs), collection.id, user and user.id, recordsetid,
+           replace_nulls, formatauditobjs, distinct, implicit_or, aggregate_with_joins,
+           app_resources_version(), formatter_registry_version(collection))
+    try:
+        hash(key)
+    except TypeError:
+        key = None
+
+    with _query_plans_lock:
+        plan = _query_plans.get(key, None) if key is not None else None
+        if plan is not None:
+            _query_plans.move_to_end(key)
+            _query_stats['hits'] += 1
+
+    if plan is not None:
+        for table in plan.tables_to_read:
+            check_table_permissions(collection, user, table, "read")
+        return plan.query.with_session(session), plan.order_by_exprs
+
+    start = time.perf_counter()
+    plan = _build_query(session, collection, user, tableid, field_specs,
+                        recordsetid, replace_nulls, formatauditobjs, distinct, implicit_or,
+                        aggregate_with_joins)
+    elapsed = time.perf_counter() - start
+    logger.debug("built query in %.3fs", elapsed)
+
+    with _query_plans_lock:
+        _query_stats['misses'] += 1
+        _query_stats['build_seconds'] += elapsed
+        if key is not None:
+            _query_plans[key] = plan._replace(query=plan.query.with_session(None))
+            while len(_query_plans) > QUERY_PLAN_CACHE_SIZE:
+                _query_plans.popitem(last=False)
+
+    return plan.query, plan.order_by_exprs
+
+def build_sized_query(session, collection, user, tableid, field_specs, limit=None, recordsetid=None, **kwargs):
+    """Return build_query(...) computing the aggregated fields with
+    derived tables only when the query is expected to return more than
+    AGGREGATE_WITH_JOINS_MIN_ROWS rows, at most 'limit' if one is given.
+    The derived tables group all the related rows in the database, so
+    the correlated subqueries are kept for record set queries and for
+    those the optimizer estimates to be small.
+    """
+    query, order_by_exprs = build_query(session, collection, user, tableid, field_specs, recordsetid=recordsetid, **kwargs)
+    if recordsetid is not None or (limit and limit <= AGGREGATE_WITH_JOINS_MIN_ROWS):
+        return query, order_by_exprs
+
+    estimate = count_rows(session, counting_query(query), 'estimate')
+    if estimate is None or estimate <= AGGREGATE_WITH_JOINS_MIN_ROWS:
+        return query, order_by_exprs
+
+    return build_query(session, collection, user, tableid, field_specs, recordsetid=recordsetid,
+                       aggregate_with_joins=True, **kwargs)
+
+def _build_query(session, collection, user, tableid, field_specs,
+                 recordsetid=None, replace_nulls=False, formatauditobjs=False, distinct=False, implicit_or=True,
+                 aggregate_with_joins=False):
     """Build a sqlalchemy query using the QueryField objects given by
     field_specs.
 
@@ -567,7 +885,7 @@ def build_query(session, collection, user, tableid, field_specs,
     See specify_datamodel.xml.
 
     field_specs = [QueryField instances] defining the fields of
-    the Specify query.
+    the Specify query, with relative dates and user names resolved.
 
     recordsetid = integer id of a row from the RecordSet table. Results
     will be filtered to items from the given record set unless None.
@@ -575,17 +893,16 @@ def build_query(session, collection, user, tableid, field_specs,
     replace_nulls = if True, replace null values with ""
 
     distinct = if True, group by all display fields, and return all record IDs associated with a row
+
+    aggregate_with_joins = if True, compute aggregated fields once with
+    grouped derived tables instead of correlated subqueries per row
     """
     model = models.models_by_tableid[tableid]
     id_field = getattr(model, model._id)
 
-    field_specs = [apply_absolute_date(field_spec) for field_spec in field_specs]
-    field_specs = [apply_specify_user_name(field_spec, user) for field_spec in field_specs]
-
-
     query = QueryConstruct(
         collection=collection,
-        objectformatter=ObjectFormatter(collection, user, replace_nulls),
+        objectformatter=ObjectFormatter(collection, user, replace_nulls, aggregate_with_joins),
         query=session.query(func.group_concat(id_field.distinct(), separator=',')) if distinct else session.query(id_field),
     )
 
@@ -648,4 +965,4 @@ def build_query(session, collection, user, tableid, field_specs,
         query = group_by_displayed_fields(query, selected_fields)
 
     logger.debug("query: %s", query.query)
-    return query.query, order_by_exprs
+    return QueryPlan(query.query, order_by_exprs, tables_to_read)
@@ -0,0 +1,11 @@
+from sqlalchemy.sql.expression import Executable, ClauseElement
+from sqlalchemy.ext import compiler
+
+
+class Explain(Executable, ClauseElement):
+    def __init__(self, select):
+        self.select = select
+
+@compiler.compiles(Explain)
+def compile(element, compiler, **kwargs):
+    return "EXPLAIN %s" % compiler.process(element.select)
@@ -1,10 +1,10 @@
 import logging
 import re
+import threading
 from django.utils.translation import gettext as _text
 
 from xml.etree import ElementTree
 from xml.etree.ElementTree import Element
-from xml.sax.saxutils import quoteattr
 
 from sqlalchemy import orm, Table as SQLTable, inspect
 from sqlalchemy.sql.expression import case, func, cast, literal, Label
@@ -13,9 +13,11 @@ from sqlalchemy.orm.attributes import InstrumentedAttribute
 from sqlalchemy.sql.elements import Extract
 from sqlalchemy import types
 
-from typing import Tuple, Optional, Union, Any
+from typing import Tuple, Optional, Union, Any, Dict, List
 
-from specifyweb.context.app_resource import get_app_resource
+from django.db.models import Count, Max
+
+from specifyweb.context.app_resource import get_app_resource, get_usertype
 from specifyweb.context.remote_prefs import get_remote_prefs
 
 from specifyweb.specify.models import datamodel, Spappresourcedata, \
@@ -37,34 +39,97 @@ Agent_model = datamodel.get_table('Agent')
 Spauditlog_model = datamodel.get_table('SpAuditLog')
 
 
+class FormatterRegistry(object):
+    """The formatters and aggregators of a DataObjFormatters resource
+    indexed by name and class, together with the formatter names chosen
+    for each table in the schema configuration of a discipline.
+    """
+    def __init__(self, formattersDom: Element, schema_formats: Dict[str, Optional[str]]):
+        self.formattersDom = formattersDom
+        self.schema_formats = schema_formats
+        formatters = formattersDom.findall('format')
+        aggregators = formattersDom.findall('aggregators/aggregator')
+        self.formatters = {attr: index_by_attribute(formatters, attr) for attr in ('name', 'class')}
+        self.aggregators = {attr: index_by_attribute(aggregators, attr) for attr in ('name', 'class')}
+
+    def formatter(self, attr: str, val: str) -> Optional[Element]:
+        return self.formatters[attr].get(val, None)
+
+    def aggregator(self, attr: str, val: str) -> Optional[Element]:
+        return self.aggregators[attr].get(val, None)
+
+def index_by_attribute(elements: List[Element], attr: str) -> Dict[str, Element]:
+    "Map the values of 'attr' to the first of 'elements' having them, as find() would."
+    index: Dict[str, Element] = {}
+    for element in elements:
+        if attr in element.attrib:
+            index.setdefault(element.attrib[attr], element)
+    return index
+
+_registries: Dict[Tuple, Tuple[Tuple, FormatterRegistry]] = {}
+_registries_lock = threading.Lock()
+
+def get_formatter_registry(collection, user) -> FormatterRegistry:
+    """Return the FormatterRegistry for the given collection and user.
+    Registries are cached per process and rebuilt when the version
+    of the DataObjFormatters resources or schema formatters changes.
+    """
+    key = (collection.id, user and user.id, get_usertype(user))
+    version = formatter_registry_version(collection)
+    with _registries_lock:
+        cached = _registries.get(key, None)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    formattersXML, _, __ = get_app_resource(collection, user, 'DataObjFormatters')
+    schema_formats: Dict[str, Optional[str]] = {}
+    for name, format in Splocalecontainer.objects.filter(
+            schematype=0, discipline=collection.discipline_id
+    ).values_list('name', 'format'):
+        schema_formats.setdefault(name.lower(), format)
+    registry = FormatterRegistry(ElementTree.fromstring(formattersXML), schema_formats)
+    with _registries_lock:
+        _registries[key] = (version, registry)
+    return registry
+
+def formatter_registry_version(collection) -> Tuple:
+    """Return a value that changes whenever a DataObjFormatters resource
+    or a schema formatter of the collection's discipline is saved or deleted.
+    """
+    resources = Spappresourcedata.objects.filter(spappresource__name='DataObjFormatters') \
+        .aggregate(modified=Max('timestampmodified'), count=Count('id'))
+    containers = Splocalecontainer.objects.filter(schematype=0, discipline=collection.discipline_id) \
+        .aggregate(modified=Max('timestampmodified'), count=Count('id'))
+    return (resources['modified'], resources['count'], containers['modified'], containers['count'])
+
 class ObjectFormatter(object):
-    def __init__(self, collection, user, replace_nulls):
+    def __init__(self, collection, user, replace_nulls, aggregate_with_joins=False):
 
-        formattersXML, _, __ = get_app_resource(collection, user, 'DataObjFormatters')
-        self.formattersDom = ElementTree.fromstring(formattersXML)
+        self.registry = get_formatter_registry(collection, user)
         self.date_format = get_date_format()
         self.date_format_year = MYSQL_TO_YEAR.get(self.date_format)
         self.date_format_month = MYSQL_TO_MONTH.get(self.date_format)
         self.collection = collection
         self.replace_nulls = replace_nulls
+        # Compute aggregations once per query as grouped derived tables
+        # instead of as correlated subqueries evaluated per row.
+        self.aggregate_with_joins = aggregate_with_joins
         self.aggregator_count = 0
 
+    @property
+    def formattersDom(self) -> Element:
+        return self.registry.formattersDom
+
+    @formattersDom.setter
+    def formattersDom(self, formattersDom: Element) -> None:
+        self.registry = FormatterRegistry(formattersDom, self.registry.schema_formats)
+
     def getFormatterDef(self, specify_model: Table, formatter_name) -> Optional[
         Element]:
-        def lookup(attr: str, val: str) -> Optional[Element]:
-            return self.formattersDom.find(
-                'format[@%s=%s]' % (attr, quoteattr(val)))
-
-        def getFormatterFromSchema() -> Element:
-            try:
-                formatter_name = Splocalecontainer.objects.get(
-                    name=specify_model.name.lower(),
-                    schematype=0,
-                    discipline=self.collection.discipline
-                ).format
-            except Splocalecontainer.DoesNotExist:
-                return None
+        lookup = self.registry.formatter
 
+        def getFormatterFromSchema() -> Optional[Element]:
+            formatter_name = self.registry.schema_formats.get(specify_model.name.lower(), None)
             return formatter_name and lookup('name', formatter_name)
 
         return (formatter_name and lookup('name', formatter_name)) \
@@ -73,9 +138,7 @@ class ObjectFormatter(object):
 
     def getAggregatorDef(self, specify_model: Table, aggregator_name) -> \
     Optional[Element]:
-        def lookup(attr: str, val: str) -> Optional[Element]:
-            return self.formattersDom.find(
-                'aggregators/aggregator[@%s=%s]' % (attr, quoteattr(val)))
+        lookup = self.registry.aggregator
 
         return (aggregator_name and lookup('name', aggregator_name)) \
                or lookup('class', specify_model.classname)
@@ -190,6 +253,18 @@ class ObjectFormatter(object):
             expr = case(cases, formatted)
         return query, blank_nulls(expr)
 
+    def add_aggregate(self, query: QueryConstruct,
+                      field: Union[Field, Relationship], rel_table: SQLTable,
+                      aggregator_name,
+                      cycle_detector=[]) -> Tuple[QueryConstruct, Any]:
+        """Return the query and the expression aggregating the objects
+        of the to-many 'field' of 'rel_table' using the strategy
+        selected by aggregate_with_joins.
+        """
+        if self.aggregate_with_joins:
+            return self.aggregate_joined(query, field, rel_table, aggregator_name, cycle_detector)
+        return query, self.aggregate(query, field, rel_table, aggregator_name, cycle_detector)
+
     def aggregate(self, query: QueryConstruct,
                   field: Union[Field, Relationship], rel_table: SQLTable,
                   aggregator_name,
@@ -197,13 +272,55 @@ class ObjectFormatter(object):
 
         logger.info('aggregating field %s on %s using %s', field, rel_table,
                     aggregator_name)
+        aggregation = self._aggregation(query, field, aggregator_name, cycle_detector,
+                                        lambda q, join_column: q.filter(join_column == getattr(rel_table, rel_table._id)).correlate(rel_table))
+        if aggregation is None:
+            return literal(_text("<Aggregator not defined.>"))
+        subquery, aggregated, join_column, limit = aggregation
+
+        aggregator_label = f"aggregator_{self.aggregator_count}"
+        self.aggregator_count += 1
+        return subquery.query.add_column(blank_nulls(aggregated)).limit(limit).label(aggregator_label)
+
+    def aggregate_joined(self, query: QueryConstruct,
+                         field: Union[Field, Relationship], rel_table: SQLTable,
+                         aggregator_name,
+                         cycle_detector=[]) -> Tuple[QueryConstruct, Any]:
+        """Aggregate as aggregate does, but with a derived table grouping
+        all the related objects by their parent, outer joined to 'query'.
+        """
+        logger.info('aggregating field %s on %s using %s with a join', field, rel_table,
+                    aggregator_name)
+        aggregation = self._aggregation(query, field, aggregator_name, cycle_detector,
+                                        lambda q, join_column: q)
+        if aggregation is None:
+            return query, literal(_text("<Aggregator not defined.>"))
+        subquery, aggregated, join_column, _ = aggregation
+
+        aggregator_label = f"aggregator_{self.aggregator_count}"
+        self.aggregator_count += 1
+        derived = subquery.query \
+            .add_columns(join_column.label('parent_id'), aggregated.label('aggregated')) \
+            .group_by(join_column) \
+            .subquery(aggregator_label)
+        query = query.outerjoin(derived, derived.c.parent_id == getattr(rel_table, rel_table._id))
+        return query, blank_nulls(derived.c.aggregated)
+
+    def _aggregation(self, query: QueryConstruct,
+                     field: Union[Field, Relationship], aggregator_name,
+                     cycle_detector, restrict) -> Optional[Tuple[QueryConstruct, group_concat, Any, Optional[str]]]:
+        """Build the query over the objects of the to-many 'field' with
+        their formatted and group concatenated values. 'restrict' is
+        applied to the query with the column joining the objects to
+        their parent. Returns None if no aggregator is defined.
+        """
         specify_model = datamodel.get_table(field.relatedModelName, strict=True)
         aggregatorNode = self.getAggregatorDef(specify_model, aggregator_name)
         cycle_with_self = [*cycle_detector, (field.relatedModelName, 'aggregating')] if (
                 cycle_detector is not None) else None
         if aggregatorNode is None:
             logger.warning("aggregator is not defined")
-            return literal(_text("<Aggregator not defined.>"))
+            return None
         logger.debug("using aggregator: %s",
                      ElementTree.tostring(aggregatorNode))
         formatter_name = aggregatorNode.attrib.get('format', None)
@@ -219,9 +336,7 @@ class ObjectFormatter(object):
         subquery = QueryConstruct(
             collection=query.collection,
             objectformatter=self,
-            query=orm.Query([]).select_from(orm_table) \
-                .filter(join_column == getattr(rel_table, rel_table._id)) \
-                .correlate(rel_table)
+            query=restrict(orm.Query([]).select_from(orm_table), join_column)
         )
 
         subquery, formatted = self.objformat(subquery, orm_table,
@@ -233,12 +348,7 @@ class ObjectFormatter(object):
         else:
             order_by_expr = []
 
-        aggregated = blank_nulls(group_concat(formatted, separator, *order_by_expr))
-
-
-        aggregator_label = f"aggregator_{self.aggregator_count}"
-        self.aggregator_count += 1
-        return subquery.query.add_column(aggregated).limit(limit).label(aggregator_label)
+        return subquery, group_concat(formatted, separator, *order_by_expr), join_column, limit
 
     def fieldformat(self, query_field: QueryField,
                     field: blank_nulls) -> blank_nulls:
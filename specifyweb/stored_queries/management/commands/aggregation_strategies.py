@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from specifyweb.specify.datamodel import datamodel, TableDoesNotExistError, FieldDoesNotExistError
+from specifyweb.specify.models import Specifyuser, Collection
+from specifyweb.stored_queries import models
+from specifyweb.stored_queries.format import ObjectFormatter
+from specifyweb.stored_queries.query_construct import QueryConstruct
+
+class Command(BaseCommand):
+    help = 'Times aggregating to-many relationships of a table with correlated subqueries and with joined derived tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('collection_id', type=int)
+        parser.add_argument('specifyuser_id', type=int)
+        parser.add_argument('table', help='Table whose relationships are aggregated.')
+        parser.add_argument('relationships', nargs='*', help='Relationships to aggregate. Defaults to all to-many relationships.')
+        parser.add_argument('--limit', type=int, default=None, help='Number of rows fetched. Defaults to all rows.')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of times each query is run.')
+
+    def handle(self, **options):
+        collection = Collection.objects.get(id=options['collection_id'])
+        user = Specifyuser.objects.get(id=options['specifyuser_id'])
+        try:
+            table = datamodel.get_table_strict(options['table'])
+            if options['relationships']:
+                fields = [table.get_relationship(name) for name in options['relationships']]
+            else:
+                fields = [r for r in table.relationships if r.type.endswith('to-many')]
+        except (TableDoesNotExistError, FieldDoesNotExistError) as e:
+            raise CommandError(e)
+
+        model = models.models_by_tableid[table.tableId]
+        id_field = getattr(model, model._id)
+
+        self.stdout.write('\t'.join(('relationship', 'rows', 'subqueries', 'joins', 'agree')))
+        with models.session_context() as session:
+            for field in fields:
+                results = {}
+                timings = {}
+                for aggregate_with_joins in (False, True):
+                    object_formatter = ObjectFormatter(collection, user, False, aggregate_with_joins)
+                    query = QueryConstruct(
+                        collection=collection,
+                        objectformatter=object_formatter,
+                        query=session.query(id_field),
+                    )
+                    query, expr = object_formatter.add_aggregate(query, field, model, None)
+                    query = query.query.add_columns(expr).order_by(id_field).limit(options['limit'])
+
+                    start = time.perf_counter()
+                    for __ in range(options['repeat']):
+                        results[aggregate_with_joins] = list(query)
+                    timings[aggregate_with_joins] = (time.perf_counter() - start) / options['repeat']
+
+                self.stdout.write('\t'.join((
+                    field.name,
+                    str(len(results[True])),
+                    '%.4fs' % timings[False],
+                    '%.4fs' % timings[True],
+                    str(results[False] == results[True]),
+                )))
@@ -1,3 +1,4 @@
+import threading
 from contextlib import contextmanager
 
 from MySQLdb.cursors import SSCursor
@@ -35,10 +36,29 @@ def generate_models():
     build_models.map_classes(datamodel, tables, classes)
     return tables, classes
 
-tables, classes = generate_models()
+_generate_lock = threading.Lock()
 
-models_by_tableid = dict((cls.tableid, cls) for cls in list(classes.values()))
+def _generated_names():
+    """Build the tables and mapped classes the first time any of them
+    is used and add them to the module, so processes that never query
+    through sqlalchemy do not pay for them.
+    """
+    with _generate_lock:
+        if 'tables' not in globals():
+            tables, classes = generate_models()
+            globals().update(classes)
+            globals().update(
+                tables=tables,
+                classes=classes,
+                models_by_tableid=dict((cls.tableid, cls) for cls in list(classes.values())),
+                __all__=['session_context', 'tables', 'classes', 'models_by_tableid'] + list(classes.keys()),
+            )
+    return globals()
 
-globals().update(classes)
-
-__all__ = ['session_context', 'tables', 'classes', 'models_by_tableid'] + list(classes.keys())
+def __getattr__(name):
+    if name.startswith('__') and name != '__all__':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        return _generated_names()[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
@@ -26,6 +26,11 @@ class QueryConstruct(namedtuple('QueryConstruct', 'collection objectformatter qu
         return super(QueryConstruct, cls).__new__(cls, *args, **kwargs)
 
     def handle_tree_field(self, node, table, tree_rank, tree_field):
+        """Return the query joined to the ancestor of 'node' at 'tree_rank'
+        and the column for 'tree_field' of that ancestor. The ancestor is
+        found with a single join on the nested set node numbers, which
+        include the node itself.
+        """
         query = self
         if query.collection is None: raise AssertionError( # Not sure it makes sense to query across collections
             f"No Collection found in Query for {table}",
@@ -33,38 +38,35 @@ class QueryConstruct(namedtuple('QueryConstruct', 'collection objectformatter qu
              "localizationKey" : "noCollectionInQuery"}) 
         logger.info('handling treefield %s rank: %s field: %s', table, tree_rank, tree_field)
 
+        treedef_column = table.name + 'TreeDefID'
         treedefitem_column = table.name + 'TreeDefItemID'
 
-        if (table, 'TreeRanks') in query.join_cache:
-            logger.debug("using join cache for %r tree ranks.", table)
-            ancestors, treedef = query.join_cache[(table, 'TreeRanks')]
+        if (node, 'TreeRank', tree_rank) in query.join_cache:
+            logger.debug("using join cache for %r rank %s.", table, tree_rank)
+            ancestor = query.join_cache[(node, 'TreeRank', tree_rank)]
         else:
             treedef = get_treedef(query.collection, table.name)
-            rank_count = treedef.treedefitems.count()
 
-            ancestors = [node]
-            for i in range(rank_count-1):
-                ancestor = orm.aliased(node)
-                query = query.outerjoin(ancestor, ancestors[-1].ParentID == getattr(ancestor, ancestor._id))
-                ancestors.append(ancestor)
+            query = query._replace(param_count=self.param_count+1)
+            treedefitem_param = sql.bindparam('tdi_%s' % query.param_count, value=treedef.treedefitems.get(name=tree_rank).id)
 
-            logger.debug("adding to join cache for %r tree ranks.", table)
-            query = query._replace(join_cache=query.join_cache.copy())
-            query.join_cache[(table, 'TreeRanks')] = (ancestors, treedef)
+            ancestor = orm.aliased(node)
+            query = query.outerjoin(ancestor, sql.and_(
+                getattr(ancestor, treedef_column) == getattr(node, treedef_column),
+                getattr(ancestor, treedefitem_column) == treedefitem_param,
+                ancestor.nodeNumber <= node.nodeNumber,
+                ancestor.highestChildNodeNumber >= node.nodeNumber,
+            ))
 
-        query = query._replace(param_count=self.param_count+1)
-        treedefitem_param = sql.bindparam('tdi_%s' % query.param_count, value=treedef.treedefitems.get(name=tree_rank).id)
+            logger.debug("adding to join cache for %r rank %s.", table, tree_rank)
+            query = query._replace(join_cache=query.join_cache.copy())
+            query.join_cache[(node, 'TreeRank', tree_rank)] = ancestor
 
         column_name = 'name' if tree_field is None else \
                       node._id if tree_field == 'ID' else \
                       table.get_field(tree_field.lower()).name
 
-        column = sql.case([
-            (getattr(ancestor, treedefitem_column) == treedefitem_param, getattr(ancestor, column_name))
-            for ancestor in ancestors
-        ])
-
-        return query, column
+        return query, getattr(ancestor, column_name)
 
     def tables_in_path(self, table, join_path):
         path = deque(join_path)
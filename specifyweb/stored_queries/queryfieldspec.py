@@ -234,7 +234,7 @@ class QueryFieldSpec(namedtuple("QueryFieldSpec", "root_table join_path table da
                 query, orm_field = query.objectformatter.objformat(query, orm_model, formatter, cycle_detector)
             else:
                 query, orm_model, table, field = self.build_join(query, self.join_path[:-1])
-                orm_field = query.objectformatter.aggregate(query, self.get_field(), orm_model, aggregator or formatter, cycle_detector)
+                query, orm_field = query.objectformatter.add_aggregate(query, self.get_field(), orm_model, aggregator or formatter, cycle_detector)
         else:
             query, orm_model, table, field = self.build_join(query, self.join_path)
             if self.tree_rank is not None:
@@ -0,0 +1,153 @@
+"""
+Per process cache of query results invalidated by table write generations
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Dict, Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import signals
+from sqlalchemy.sql.util import find_tables
+
+logger = logging.getLogger(__name__)
+
+CachedResult = namedtuple('CachedResult', 'data tables generations stored rows')
+
+_results: "OrderedDict[tuple, CachedResult]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stale': 0, 'rows': 0}
+
+def cache_size() -> int:
+    return getattr(settings, 'QUERY_RESULT_CACHE_SIZE', 128)
+
+def cache_max_rows() -> int:
+    return getattr(settings, 'QUERY_RESULT_CACHE_MAX_ROWS', 100000)
+
+def cache_seconds() -> float:
+    return getattr(settings, 'QUERY_RESULT_CACHE_SECONDS', 300)
+
+def generations_cache():
+    """The Django cache holding the table write generations. When it is
+    shared between processes, as the database, memcached and redis
+    backends are, writes made through any process invalidate the results
+    cached by all of them.
+    """
+    return caches[getattr(settings, 'QUERY_RESULT_CACHE_ALIAS', 'default')]
+
+def generation_key(table_name: str) -> str:
+    return 'query-result-generation:' + table_name.lower()
+
+def bump_generation(table_name: str) -> None:
+    "Mark the results read from the table 'table_name' as out of date."
+    cache = generations_cache()
+    key = generation_key(table_name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not set yet, or evicted. Any new value differs from the ones
+        # the cached results were stored with.
+        cache.set(key, time.time_ns(), None)
+
+def table_generations(tables: Iterable[str]) -> tuple:
+    keys = [generation_key(table) for table in sorted(tables)]
+    values = generations_cache().get_many(keys)
+    return tuple(values.get(key, None) for key in keys)
+
+def table_written(table_name: str) -> None:
+    """Bump the generation of 'table_name' now and again when the current
+    transaction commits, so results read concurrently with the write are
+    not kept either.
+    """
+    bump_generation(table_name)
+    transaction.on_commit(lambda: bump_generation(table_name))
+
+def invalidate_model(sender, **kwargs) -> None:
+    if kwargs.get('raw', False):
+        return
+    table_written(sender._meta.db_table)
+
+signals.post_save.connect(invalidate_model, dispatch_uid='query-result-cache-save')
+signals.post_delete.connect(invalidate_model, dispatch_uid='query-result-cache-delete')
+
+def query_tables(query) -> frozenset:
+    "Return the names of all the tables read by the sqlalchemy 'query', including in subqueries."
+    return frozenset(table.name.lower() for table in find_tables(query.statement))
+
+def cache_key(query, variant):
+    """Return a key identifying the results of the sqlalchemy 'query'
+    by its compiled SQL and parameters, or None if they are not hashable.
+    """
+    compiled = query.statement.compile(dialect=query.session.get_bind().dialect)
+    key = (str(compiled), tuple(sorted(compiled.params.items())), variant)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def _drop(key) -> None:
+    entry = _results.pop(key)
+    _stats['rows'] -= entry.rows
+
+def cached_results(query, variant, compute):
+    """Return the data computed by 'compute' for the sqlalchemy 'query',
+    reusing the data from an earlier call with the same query and
+    'variant' when none of the tables the query reads have been written
+    since and it is no older than QUERY_RESULT_CACHE_SECONDS.
+
+    Writes are seen through the model signals of every process sharing
+    the generations_cache(). Writes bypassing the signals, or made by
+    processes not sharing it, are only picked up once the cached data
+    expires. At most QUERY_RESULT_CACHE_SIZE results holding
+    QUERY_RESULT_CACHE_MAX_ROWS rows in total are kept.
+    """
+    if cache_size() <= 0:
+        return compute()
+
+    key = cache_key(query, variant)
+    if key is None:
+        return compute()
+
+    tables = query_tables(query)
+    generations = table_generations(tables)
+    now = time.monotonic()
+    with _lock:
+        entry = _results.get(key, None)
+        if entry is not None and entry.generations == generations and now - entry.stored < cache_seconds():
+            _results.move_to_end(key)
+            _stats['hits'] += 1
+            return dict(entry.data)
+        if entry is not None:
+            _drop(key)
+            _stats['stale'] += 1
+        _stats['misses'] += 1
+
+    data = compute()
+    rows = len(data.get('results', ()))
+    if rows > cache_max_rows():
+        return dict(data)
+
+    with _lock:
+        if key in _results:
+            _drop(key)
+        _results[key] = CachedResult(data, tables, generations, now, rows)
+        _stats['rows'] += rows
+        while len(_results) > cache_size() or _stats['rows'] > cache_max_rows():
+            _drop(next(iter(_results)))
+
+    return dict(data)
+
+def query_result_cache_stats():
+    "Return the hit, miss and stale counts of the result cache and its size."
+    with _lock:
+        return dict(_stats, size=len(_results), capacity=cache_size(), max_rows=cache_max_rows())
+
+def clear_query_result_cache():
+    with _lock:
+        _results.clear()
+        _stats['rows'] = 0
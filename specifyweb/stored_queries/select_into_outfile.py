@@ -3,14 +3,27 @@ from sqlalchemy.ext import compiler
 
 
 class SelectIntoOutfile(Executable, ClauseElement):
-    def __init__(self, select, path):
+    def __init__(self, select, path, delimiter=',', line_terminator='\n', escaped_by=None):
         self.select = select
         self.path = path
+        self.delimiter = delimiter
+        self.line_terminator = line_terminator
+        self.escaped_by = escaped_by
+
+def quote(value):
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'") \
+        .replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
 
 @compiler.compiles(SelectIntoOutfile)
 def compile(element, compiler, **kwargs):
     return (
-        "%s INTO OUTFILE '%s' "
-        "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
-        "LINES TERMINATED BY '\\n'"
-    ) % (compiler.process(element.select), element.path)
+        "%s INTO OUTFILE %s "
+        "FIELDS TERMINATED BY %s OPTIONALLY ENCLOSED BY '\"' %s"
+        "LINES TERMINATED BY %s"
+    ) % (
+        compiler.process(element.select),
+        quote(element.path),
+        quote(element.delimiter),
+        "" if element.escaped_by is None else "ESCAPED BY %s " % quote(element.escaped_by),
+        quote(element.line_terminator),
+    )
@@ -1,21 +1,28 @@
 from sqlalchemy import orm, inspect
 from unittest import skip, expectedFailure
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 import specifyweb.specify.models as spmodels
 from specifyweb.specify.api_tests import ApiTests
-from .format import ObjectFormatter
+from specifyweb.specify.pagination import estimate_from_plan
+from .format import ObjectFormatter, FormatterRegistry, get_formatter_registry
 from .query_construct import QueryConstruct
 from .queryfieldspec import QueryFieldSpec
 from MySQLdb.cursors import SSCursor
 from django.conf import settings
 import sqlalchemy
 from sqlalchemy.dialects import mysql
-from django.db import connection
+from django.db import connection, connections, DEFAULT_DB_ALIAS
 from sqlalchemy import event, select, func
-from . import models
+from . import execution, models, result_cache
+from .select_into_outfile import SelectIntoOutfile
 from xml.etree import ElementTree
 from datetime import datetime
+from contextlib import contextmanager
+import threading
+import os
+import tempfile
+import zipfile
 # Used for pretty-formatting sql code for testing
 import sqlparse
 
@@ -48,11 +55,33 @@ with session.context() as session:
 """
 
 
+class QueryExportTests(TestCase):
+    def test_sanitize_rows(self):
+        rows = [(1, 'a\r\nb', None), (2, 'c', 3.5)]
+        self.assertEqual(list(execution.sanitize_rows(rows, skip=1)), [('a  b', 'None'), ('c', '3.5')])
+
+    def test_select_into_outfile(self):
+        statement = SelectIntoOutfile(select([sqlalchemy.literal_column('1')]), "/tmp/it's.csv",
+                                      delimiter='\t', line_terminator='\r\n', escaped_by='"')
+        self.assertEqual(
+            str(statement.compile(dialect=mysql.dialect())),
+            "SELECT 1 INTO OUTFILE '/tmp/it\\'s.csv' FIELDS TERMINATED BY '\\t' "
+            "OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\"' LINES TERMINATED BY '\\r\\n'")
+
+    def test_kmz_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.kmz')
+            with execution.open_kml_file(path, compress=True) as f:
+                f.write('<kml/>\n')
+            with zipfile.ZipFile(path) as kmz:
+                self.assertEqual(kmz.read('doc.kml'), b'<kml/>\n')
+
 class SQLAlchemySetup(ApiTests):
 
     test_sa_url = None
     engine = None
     test_session_context = None
+    django_query_lock = threading.Lock()
 
     @classmethod
     def setUpClass(cls):
@@ -70,12 +99,14 @@ class SQLAlchemySetup(ApiTests):
         # Listen to low-level cursor execution events. Just before query is executed by SQLAlchemy, run it instead
         # by Django, and then return a wrapped sql statement which will return the same result set.
         def run_django_query(conn, cursor, statement, parameters, context, executemany):
-            django_cursor = connection.cursor()
-            # Get MySQL Compatible compiled query.
-            django_cursor.execute(statement, parameters)
-            result_set = django_cursor.fetchall()
-            columns = django_cursor.description
-            django_cursor.close()
+            # Sessions in other threads may share the test connection. See shared_session_context.
+            with cls.django_query_lock:
+                django_cursor = connection.cursor()
+                # Get MySQL Compatible compiled query.
+                django_cursor.execute(statement, parameters)
+                result_set = django_cursor.fetchall()
+                columns = django_cursor.description
+                django_cursor.close()
             # SqlAlchemy needs to find columns back in the rows, hence adding label to columns
             selects = [sqlalchemy.select([sqlalchemy.literal(column).label(columns[idx][0]) for idx, column in enumerate(row)]) for row
                        in result_set]
@@ -88,6 +119,26 @@ class SQLAlchemySetup(ApiTests):
 
 
 
+    @classmethod
+    def shared_session_context(cls):
+        """Return a session context for use in other threads. Their
+        queries are run on this thread's connection, which is the only
+        one that sees the uncommitted test data.
+        """
+        test_connection = connections[DEFAULT_DB_ALIAS]
+
+        @contextmanager
+        def session_context():
+            connections[DEFAULT_DB_ALIAS] = test_connection
+            test_connection.inc_thread_sharing()
+            try:
+                with cls.test_session_context() as session:
+                    yield session
+            finally:
+                test_connection.dec_thread_sharing()
+                del connections[DEFAULT_DB_ALIAS]
+        return session_context
+
     def setUp(self):
         print("""
             #BUG: If a test which compares the final sql query is added, then it could randomly fail
@@ -118,6 +169,197 @@ class SQLAlchemySetupTest(SQLAlchemySetup):
             self.assertEqual(max_co_id, max(ids))
 
 
+class FormatterRegistryTests(ApiTests):
+    def test_registry_is_cached(self):
+        registry = get_formatter_registry(self.collection, self.specifyuser)
+        self.assertIs(get_formatter_registry(self.collection, self.specifyuser), registry)
+
+    def test_lookup_finds_first(self):
+        registry = FormatterRegistry(ElementTree.fromstring("""
+        <formatters>
+          <format name="A" class="edu.ku.brc.specify.datamodel.Agent"><switch/></format>
+          <format name="B" class="edu.ku.brc.specify.datamodel.Agent"><switch/></format>
+          <aggregators>
+            <aggregator name="Agents" class="edu.ku.brc.specify.datamodel.Agent"/>
+          </aggregators>
+        </formatters>"""), {})
+        self.assertEqual(registry.formatter('class', 'edu.ku.brc.specify.datamodel.Agent').attrib['name'], 'A')
+        self.assertEqual(registry.formatter('name', 'B').attrib['name'], 'B')
+        self.assertIsNone(registry.formatter('name', 'C'))
+        self.assertEqual(registry.aggregator('class', 'edu.ku.brc.specify.datamodel.Agent').attrib['name'], 'Agents')
+
+def display_field_specs(stringids, sorttype=0):
+    "Return the field specs of a query displaying the fields 'stringids' unfiltered."
+    return execution.field_specs_from_json([{
+        'stringid': stringid, 'isrelfld': False,
+        'operstart': 8, 'startvalue': '', 'isnot': False, 'isdisplay': True,
+        'sorttype': sorttype, 'formatname': None, 'position': position,
+    } for position, stringid in enumerate(stringids)])
+
+class QueryPlanCacheTests(SQLAlchemySetup):
+    def test_plan_is_reused_for_paging(self):
+        execution.clear_query_plan_cache()
+        field_specs = display_field_specs(['1.collectionobject.catalogNumber'], sorttype=1)
+
+        with self.test_session_context() as session:
+            first = execution.execute(session, self.collection, self.specifyuser, 1, False, False, field_specs, 0, 0)
+            stats = execution.query_plan_stats()
+            second = execution.execute(session, self.collection, self.specifyuser, 1, False, False, field_specs, 0, 1)
+            count = execution.execute(session, self.collection, self.specifyuser, 1, False, True, field_specs, 0, 0)
+
+        self.assertEqual(execution.query_plan_stats()['hits'], stats['hits'] + 2)
+        self.assertEqual(second['results'], first['results'][1:])
+        self.assertEqual(count['count'], len(first['results']))
+
+    def test_results_with_count(self):
+        field_specs = display_field_specs(['1.collectionobject.catalogNumber'], sorttype=1)
+
+        with self.test_session_context() as session:
+            data = execution.execute(session, self.collection, self.specifyuser, 1, False, False,
+                                     field_specs, 2, 0, with_count='exact')
+
+        self.assertEqual(len(data['results']), 2)
+        self.assertEqual(data['count'], len(self.collectionobjects))
+
+    def test_results_with_concurrent_count(self):
+        field_specs = display_field_specs(['1.collectionobject.catalogNumber'], sorttype=1)
+        count_session_context = self.shared_session_context()
+        count_threads = []
+
+        @contextmanager
+        def recording_session_context():
+            count_threads.append(threading.current_thread().name)
+            with count_session_context() as session:
+                yield session
+
+        with self.test_session_context() as session:
+            for mode in execution.COUNT_MODES:
+                data = execution.execute(session, self.collection, self.specifyuser, 1, False, False,
+                                         field_specs, 2, 0, with_count=mode,
+                                         count_session_context=recording_session_context)
+                self.assertEqual(len(data['results']), 2)
+                if mode == 'exact':
+                    self.assertEqual(data['count'], len(self.collectionobjects))
+                else:
+                    self.assertIsInstance(data['count'], int)
+
+        self.assertEqual(len(count_threads), len(execution.COUNT_MODES))
+        self.assertTrue(all(name.startswith('query-count') for name in count_threads))
+
+    def test_estimate_from_plan(self):
+        self.assertEqual(estimate_from_plan(['id', 'rows', 'filtered'], (1, 200, 50.0)), 100)
+        self.assertEqual(estimate_from_plan(['id', 'rows', 'filtered'], (1, 200, None)), 200)
+        self.assertIsNone(estimate_from_plan(['id', 'rows'], None))
+        self.assertIsNone(estimate_from_plan(['id'], (1,)))
+
+    def test_results_cache_invalidated_by_write(self):
+        result_cache.clear_query_result_cache()
+        field_specs = display_field_specs(['1.collectionobject.catalogNumber'], sorttype=1)
+        run = lambda session: execution.execute(session, self.collection, self.specifyuser, 1, False, False,
+                                                field_specs, 0, 0, cache_results=True)
+
+        with self.test_session_context() as session:
+            first = run(session)
+            stats = result_cache.query_result_cache_stats()
+            second = run(session)
+            self.assertEqual(result_cache.query_result_cache_stats()['hits'], stats['hits'] + 1)
+            self.assertEqual(second['results'], first['results'])
+
+            self.collectionobjects[0].catalognumber = 'num-changed'
+            self.collectionobjects[0].save()
+            third = run(session)
+
+        self.assertEqual(result_cache.query_result_cache_stats()['stale'], stats['stale'] + 1)
+        self.assertIn('num-changed', [row[1] for row in third['results']])
+
+    @override_settings(QUERY_RESULT_CACHE_MAX_ROWS=1)
+    def test_results_cache_bounded_by_rows(self):
+        result_cache.clear_query_result_cache()
+        field_specs = display_field_specs(['1.collectionobject.catalogNumber'], sorttype=1)
+        with self.test_session_context() as session:
+            execution.execute(session, self.collection, self.specifyuser, 1, False, False,
+                              field_specs, 0, 0, cache_results=True)
+
+        stats = result_cache.query_result_cache_stats()
+        self.assertEqual(stats['size'], 0, "results with more rows than the bound are not kept")
+        self.assertEqual(stats['rows'], 0)
+
+class ReturnLoanPrepsTests(SQLAlchemySetup):
+    def setUp(self):
+        super().setUp()
+        preptype = spmodels.Preptype.objects.create(collection=self.collection)
+        preps = [
+            self.collectionobjects[0].preparations.create(
+                collectionmemberid=self.collection.id, preptype=preptype, countamt=5)
+            for _ in range(2)
+        ]
+        self.loan = spmodels.Loan.objects.create(loannumber='L1', discipline=self.discipline, isclosed=False)
+        self.partly_returned = self.loan.loanpreparations.create(
+            preparation=preps[0], discipline=self.discipline,
+            quantity=3, quantityresolved=1, quantityreturned=1, isresolved=False)
+        self.partly_returned.loanreturnpreparations.create(
+            discipline=self.discipline, quantityresolved=1, quantityreturned=1)
+        self.unreturned = self.loan.loanpreparations.create(
+            preparation=preps[1], discipline=self.discipline,
+            quantity=2, quantityresolved=0, quantityreturned=0, isresolved=False)
+
+    def audit_entries(self, action, model, record_ids):
+        return {
+            log.recordid: sorted(log.fields.values_list('fieldname', 'oldvalue', 'newvalue'))
+            for log in spmodels.Spauditlog.objects.filter(
+                action=action, tablenum=model.specify_model.tableId, recordid__in=record_ids)
+        }
+
+    def test_return_matches_per_row_results(self):
+        lps = [self.partly_returned, self.unreturned]
+        existing_lrps = set(spmodels.Loanreturnpreparation.objects.values_list('id', flat=True))
+        to_return = execution.return_loan_preps(self.collection, self.specifyuser, self.agent, {
+            'query': {'contexttableid': spmodels.Loanpreparation.specify_model.tableId, 'fields': [{
+                'stringid': '54.loanpreparation.quantity', 'isrelfld': False,
+                'operstart': 8, 'startvalue': '', 'isnot': False, 'isdisplay': True,
+                'sorttype': 0, 'formatname': None, 'position': 0,
+            }]},
+            'commit': True,
+        }, session_context=self.test_session_context)
+
+        self.assertEqual(sorted(to_return), [
+            (self.partly_returned.id, 2, self.loan.id, 'L1'),
+            (self.unreturned.id, 2, self.loan.id, 'L1'),
+        ])
+
+        for lp, expected in zip(lps, [(3, 3), (2, 2)]):
+            lp.refresh_from_db()
+            self.assertEqual((lp.quantityresolved, lp.quantityreturned, lp.isresolved), (*expected, True))
+
+        new_lrps = spmodels.Loanreturnpreparation.objects.exclude(id__in=existing_lrps)
+        self.assertEqual(
+            sorted(new_lrps.values_list('loanpreparation_id', 'quantityresolved', 'quantityreturned', 'discipline_id', 'createdbyagent_id')),
+            sorted((lp.id, 2, 2, self.discipline.id, self.agent.id) for lp in lps))
+
+        self.loan.refresh_from_db()
+        self.assertTrue(self.loan.isclosed)
+
+        # The entries the per row version logged with auditlog.update and
+        # auditlog.insert for each preparation.
+        self.assertEqual(self.audit_entries(1, spmodels.Loanpreparation, [lp.id for lp in lps]), {
+            self.partly_returned.id: [
+                ('isresolved', 'False', 'True'),
+                ('quantityresolved', '1', '3'),
+                ('quantityreturned', '1', '3'),
+            ],
+            self.unreturned.id: [
+                ('isresolved', 'False', 'True'),
+                ('quantityresolved', '0', '2'),
+                ('quantityreturned', '0', '2'),
+            ],
+        })
+        self.assertEqual(
+            self.audit_entries(0, spmodels.Loanreturnpreparation, list(new_lrps.values_list('id', flat=True))),
+            {lrp.id: [] for lrp in new_lrps})
+        self.assertEqual(self.audit_entries(1, spmodels.Loan, [self.loan.id]), {
+            self.loan.id: [('isclosed', 'False', 'True')],
+        })
+
 class FormatterAggregatorTests(SQLAlchemySetup):
 
     def setUp(self):
@@ -344,6 +586,39 @@ class FormatterAggregatorTests(SQLAlchemySetup):
             query = query.query.add_columns(models.Accession.accessionNumber, expr)
             self.assertCountEqual(list(query), [('a', 'role2; role1'), ('b', 'role3; role4')])
 
+            object_formatter.aggregate_with_joins = True
+            query = QueryConstruct(
+                collection=self.collection,
+                objectformatter=object_formatter,
+                query=session.query(models.Accession.accessionNumber)
+            )
+            query, expr = object_formatter.objformat(query, models.Accession, None)
+            query = query.query.add_columns(expr)
+            self.assertCountEqual(list(query), [('a', 'role2; role1'), ('b', 'role3; role4')])
+
+    def test_aggregation_strategies_agree(self):
+        for co in self.collectionobjects:
+            for i in range(3):
+                co.determinations.create(iscurrent=i == 0, remarks=f'{co.catalognumber}-{i}')
+
+        field = spmodels.datamodel.get_table('CollectionObject').get_relationship('determinations')
+        results = {}
+        with FormatterAggregatorTests.test_session_context() as session:
+            for aggregate_with_joins in (False, True):
+                object_formatter = ObjectFormatter(self.collection, self.specifyuser, False, aggregate_with_joins)
+                query = QueryConstruct(
+                    collection=self.collection,
+                    objectformatter=object_formatter,
+                    query=session.query(models.CollectionObject.collectionObjectId)
+                )
+                query, expr = object_formatter.add_aggregate(query, field, models.CollectionObject, None)
+                query = query.query.add_columns(expr).order_by(models.CollectionObject.collectionObjectId)
+
+                results[aggregate_with_joins] = list(query)
+
+        self.assertEqual(len(results[True]), len(self.collectionobjects))
+        self.assertEqual(results[False], results[True])
+
     def test_detect_cycles(self):
         formatter_def = """
         <formatters>
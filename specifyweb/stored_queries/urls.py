@@ -5,6 +5,7 @@ from . import views
 urlpatterns = [
     url(r'^query/(?P<id>\d+)/$', views.query),
     url(r'^ephemeral/$', views.ephemeral),
+    url(r'^cachestats/$', views.cache_stats),
     url(r'^exportcsv/$', views.export_csv),
     url(r'^exportkml/$', views.export_kml),
     url(r'^make_recordset/$', views.make_recordset),
@@ -1,6 +1,7 @@
 import json
 import logging
 from collections import defaultdict
+from contextlib import ExitStack
 from datetime import datetime
 from threading import Thread
 
@@ -12,11 +13,12 @@ from django.views.decorators.http import require_POST
 from specifyweb.middleware.general import require_GET
 from . import models
 from .execution import execute, run_ephemeral_query, do_export, recordset, \
-    return_loan_preps as rlp
+    return_loan_preps as rlp, query_plan_stats
 from .queryfield import QueryField
+from .result_cache import query_result_cache_stats
 from ..permissions.permissions import PermissionTarget, PermissionTargetAction, \
     check_permission_targets, check_table_permissions
-from ..specify.api import toJson, uri_for_model
+from ..specify.api import toJson, uri_for_model, json_stream_response
 from ..specify.models import Collection, Recordset, Loanreturnpreparation, \
     Loanpreparation, Loan
 from ..specify.views import login_maybe_required
@@ -71,12 +73,15 @@ def format_export_file_name(spquery, file_extension = ''):
 def query(request, id):
     """Executes and returns the results of query with id <id>.
     'limit' and 'offset' may be provided as GET parameters.
+    If 'stream' is 'true' the results are streamed as they are fetched.
     """
     check_permission_targets(request.specify_collection.id, request.specify_user.id, [QueryBuilderPt.execute])
     limit = int(request.GET.get('limit', 20))
     offset = int(request.GET.get('offset', 0))
+    stream = request.GET.get('stream', 'false') == 'true'
 
-    with models.session_context() as session:
+    with ExitStack() as stack:
+        session = stack.enter_context(models.session_context())
         sp_query = session.query(models.SpQuery).get(int(id))
         distinct = sp_query.selectDistinct
         tableid = sp_query.contextTableId
@@ -86,7 +91,12 @@ def query(request, id):
                        for field in sorted(sp_query.fields, key=lambda field: field.position)]
 
         data = execute(session, request.specify_collection, request.specify_user,
-                       tableid, distinct, count_only, field_specs, limit, offset)
+                       tableid, distinct, count_only, field_specs, limit, offset,
+                       stream=stream and not count_only)
+
+        if stream and not count_only:
+            # The response takes over closing the session.
+            return json_stream_response(data, close=stack.pop_all().close)
 
     return HttpResponse(toJson(data), content_type='application/json')
 
@@ -113,6 +123,17 @@ def ephemeral(request):
     return HttpResponse(toJson(data), content_type='application/json')
 
 
+@require_GET
+@login_maybe_required
+@never_cache
+def cache_stats(request):
+    """Returns the statistics of the query result and query plan caches of this process."""
+    return JsonResponse({
+        'results': query_result_cache_stats(),
+        'plans': query_plan_stats(),
+    })
+
+
 @require_POST
 @login_maybe_required
 @never_cache
@@ -133,7 +154,7 @@ def export_csv(request):
     else:
         collection = request.specify_collection
     
-    file_name = format_export_file_name(spquery, "csv")
+    file_name = format_export_file_name(spquery, "csv.gz" if spquery.get("compress", False) else "csv")
 
     thread = Thread(target=do_export, args=(spquery, collection, request.specify_user, file_name, 'csv', None))
     thread.daemon = True
@@ -163,7 +184,7 @@ def export_kml(request):
     else:
         collection = request.specify_collection
 
-    file_name = format_export_file_name(spquery, "kml")
+    file_name = format_export_file_name(spquery, "kmz" if spquery.get("compress", False) else "kml")
 
     thread = Thread(target=do_export, args=(spquery, collection, request.specify_user, file_name, 'kml', the_host))
     thread.daemon = True
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+# Maximum number of match results kept while uploading a dataset.
+MATCH_CACHE_SIZE = 100000
+
+_MISSING = object()
+
+class MatchCache(object):
+    """Match results shared by the rows of an upload, keyed by the
+    filters that produced them.
+
+    The entries added while a row is being uploaded are journaled
+    between begin_row() and end_row() so that they can be undone with
+    rollback_row() if the row fails, instead of copying the whole cache
+    before every row. The least recently used entries are dropped once
+    there are more than 'max_size' of them.
+    """
+
+    def __init__(self, max_size: int=MATCH_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._journal: Optional[List[Tuple[Hashable, Any]]] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rollbacks = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        value = self._entries.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any=None) -> Any:
+        "Like get() but without counting the lookup or refreshing the entry."
+        return self._entries.get(key, default)
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        if self._journal is not None:
+            self._journal.append((key, self._entries.get(key, _MISSING)))
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def begin_row(self) -> None:
+        self._journal = []
+
+    def end_row(self) -> None:
+        self._journal = None
+
+    def rollback_row(self) -> None:
+        "Undo the entries added or replaced since begin_row()."
+        journal, self._journal = self._journal, None
+        for key, previous in reversed(journal or []):
+            if previous is _MISSING:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = previous
+        self.rollbacks += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'rollbacks': self.rollbacks,
+        }
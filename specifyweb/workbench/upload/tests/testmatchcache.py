@@ -0,0 +1,31 @@
+from django.test import TestCase
+
+from ..match_cache import MatchCache
+
+class MatchCacheTests(TestCase):
+    def test_rollback_row(self) -> None:
+        cache = MatchCache()
+        cache.begin_row()
+        cache['a'] = [1]
+        cache.end_row()
+
+        cache.begin_row()
+        cache['a'] = [2]
+        cache['b'] = [3]
+        cache.rollback_row()
+
+        self.assertEqual(cache.get('a'), [1])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats()['rollbacks'], 1)
+
+    def test_lru_bound(self) -> None:
+        cache = MatchCache(max_size=2)
+        cache['a'] = [1]
+        cache['b'] = [2]
+        cache.get('a')
+        cache['c'] = [3]
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.stats(), {'size': 2, 'hits': 1, 'misses': 0, 'evictions': 1, 'rollbacks': 0})
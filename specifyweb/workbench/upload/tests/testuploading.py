@@ -17,7 +17,8 @@ from ..parsing import filter_and_upload
 from ..tomany import ToManyRecord
 from ..treerecord import TreeRecord, BoundTreeRecord, \
     TreeDefItemWithParseResults
-from ..upload import do_upload, do_upload_csv
+from ..match_cache import MatchCache
+from ..upload import do_upload, do_upload_csv, prematch
 from ..upload_plan_schema import schema, parse_plan, parse_column_options
 from ..upload_result import Uploaded, UploadResult, Matched, MatchedMultiple, \
     NoMatch, FailedBusinessRule, ReportInfo, TreeInfo
@@ -121,6 +122,35 @@ class TreeMatchingTests(UploadTreeSetup):
         self.assertEqual(self.springmo.id, results[0].record_result.get_id())
         self.assertEqual(self.springill.id, results[1].record_result.get_id())
 
+    def test_prematch_tree_paths(self) -> None:
+        plan_json = dict(
+            baseTableName = 'Geography',
+            uploadable = { 'treeRecord': dict(
+                ranks = {
+                    'State': 'State',
+                    'City': 'City',
+                }
+            )}
+        )
+        validate(plan_json, schema)
+        scoped_plan = parse_plan(self.collection, plan_json).apply_scoping(self.collection)
+        data = [
+            {'State': 'Missouri', 'City': 'Springfield'},
+            {'State': 'Illinois', 'City': 'Springfield'},
+            {'State': 'Kansas', 'City': 'Olathe'},
+        ]
+
+        cache = MatchCache()
+        prematch(self.collection, data, scoped_plan, self.agent.id, None, cache)
+        self.assertEqual(len(cache), 5, "every rank matching an existing node is cached")
+
+        misses = cache.misses
+        results = do_upload(self.collection, data, scoped_plan, self.agent.id, cache=cache)
+        self.assertEqual(self.springmo.id, results[0].record_result.get_id())
+        self.assertEqual(self.springill.id, results[1].record_result.get_id())
+        self.assertIsInstance(results[2].record_result, Uploaded)
+        self.assertEqual(cache.misses - misses, 1, "only the unmatched city is looked up per row")
+
     def test_match_multiple(self) -> None:
         plan_json = dict(
             baseTableName = 'Geography',
@@ -507,6 +537,84 @@ class OneToOneAttributeTests(UploadTestsBase):
 
 class UploadTests(UploadTestsBase):
 
+    def test_prematch_existing_agents(self) -> None:
+        plan_json = {
+            "baseTableName": "collectionobject",
+            "uploadable": {
+                "uploadTable": {
+                    "wbcols": {"catalognumber": "Catno"},
+                    "static": {},
+                    "toOne": {
+                        "cataloger": {
+                            "uploadTable": {
+                                "wbcols": {"lastname": "Cataloger"},
+                                "static": {},
+                                "toOne": {},
+                                "toMany": {},
+                            }
+                        }
+                    },
+                    "toMany": {},
+                }
+            }
+        }
+        validate(plan_json, schema)
+        scoped_plan = parse_plan(self.collection, plan_json).apply_scoping(self.collection)
+        smith = get_table('Agent').objects.create(agenttype=1, lastname='Smith', division=self.division)
+        data = [
+            {'Catno': '1', 'Cataloger': 'Smith'},
+            {'Catno': '2', 'Cataloger': 'Jones'},
+            {'Catno': '3', 'Cataloger': 'Smith'},
+            {'Catno': '4', 'Cataloger': 'Jones'},
+        ]
+
+        cache = MatchCache()
+        prematch(self.collection, data, scoped_plan, self.agent.id, None, cache)
+        self.assertEqual(len(cache), 1, "only lookups matching existing records are cached")
+
+        results = do_upload(self.collection, data, scoped_plan, self.agent.id, cache=cache)
+        catalogers = [r.toOne['cataloger'].record_result for r in results]
+        self.assertEqual([type(c) for c in catalogers], [Matched, Uploaded, Matched, Matched])
+        self.assertEqual(catalogers[0].get_id(), smith.id)
+        self.assertEqual(catalogers[3].get_id(), catalogers[1].get_id())
+
+    def test_prematch_dependent_tables(self) -> None:
+        get_table('Collectingevent').objects.all().delete()
+        locality = get_table('Locality').objects.create(localityname='Here', srclatlongunit=0, discipline=self.discipline)
+        ce = get_table('Collectingevent').objects.create(stationfieldnumber='1', locality=locality, discipline=self.discipline)
+
+        plan = UploadTable(
+            name='Collectingevent',
+            wbcols={'stationfieldnumber': parse_column_options('sfn')},
+            overrideScope=None,
+            static={},
+            toMany={},
+            toOne={'locality': UploadTable(
+                name='Locality',
+                wbcols={'localityname': parse_column_options('locality')},
+                overrideScope=None,
+                static={},
+                toOne={},
+                toMany={}
+            )}
+        ).apply_scoping(self.collection)
+        data = [
+            {'sfn': '1', 'locality': 'Here'},
+            {'sfn': '2', 'locality': 'Here'},
+            {'sfn': '1', 'locality': 'There'},
+        ]
+
+        cache = MatchCache()
+        prematch(self.collection, data, plan, self.agent.id, None, cache)
+        self.assertEqual(len(cache), 2, "the collecting event is prematched once its locality is")
+
+        misses = cache.misses
+        results = do_upload(self.collection, data, plan, self.agent.id, cache=cache)
+        self.assertEqual([type(r.record_result) for r in results], [Matched, Uploaded, Uploaded])
+        self.assertEqual(results[0].get_id(), ce.id)
+        self.assertEqual(results[1].toOne['locality'].get_id(), locality.id)
+        self.assertEqual(cache.misses - misses, 3, "only the lookups involving the new locality are made per row")
+
     def test_determination_default_iscurrent(self) -> None:
         plan_json = {
             "baseTableName": "collectionobject",
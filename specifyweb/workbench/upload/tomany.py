@@ -4,6 +4,7 @@ from typing import Dict, Any, NamedTuple, List, Union, Set, Optional
 
 from .uploadable import Row, FilterPack, Exclude, Uploadable, ScopedUploadable, BoundUploadable, Disambiguation, Auditor
 from .upload_result import ParseFailures
+from .match_cache import MatchCache
 from .parsing import parse_many, ParseResult
 from .column_options import ColumnOptions, ExtendedColumnOptions
 
@@ -56,7 +57,7 @@ class ScopedToManyRecord(NamedTuple):
     def get_treedefs(self) -> Set:
         return set(td for toOne in self.toOne.values() for td in toOne.get_treedefs())
 
-    def bind(self, collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[Dict], row_index: Optional[int] = None) -> Union["BoundToManyRecord", ParseFailures]:
+    def bind(self, collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[MatchCache], row_index: Optional[int] = None) -> Union["BoundToManyRecord", ParseFailures]:
         parsedFields, parseFails = parse_many(collection, self.name, self.wbcols, row)
 
         toOne: Dict[str, BoundUploadable] = {}
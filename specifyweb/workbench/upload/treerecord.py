@@ -3,14 +3,17 @@ For uploading tree records.
 """
 
 import logging
-from typing import List, Dict, Any, Tuple, NamedTuple, Optional, Union, Set
+from collections import defaultdict
+from typing import List, Dict, Any, Iterator, Tuple, NamedTuple, Optional, Union, Set, Callable
 
 from django.db import transaction, IntegrityError
+from django.db.models import IntegerField, Value
 from typing_extensions import TypedDict
 
 from specifyweb.businessrules.exceptions import BusinessRuleException
 from specifyweb.specify import models
 from .column_options import ColumnOptions, ExtendedColumnOptions
+from .match_cache import MatchCache
 from .parsing import ParseResult, ParseFailure, parse_many, filter_and_upload
 from .upload_result import UploadResult, NullRecord, NoMatch, Matched, \
     MatchedMultiple, Uploaded, ParseFailures, FailedBusinessRule, ReportInfo, \
@@ -19,6 +22,10 @@ from .uploadable import Row, FilterPack, Disambiguation as DA, Auditor
 
 logger = logging.getLogger(__name__)
 
+# Number of distinct rank lookups combined into one statement when
+# prematching tree paths, and the most nodes loaded for any one lookup.
+TREE_PREMATCH_BATCH_SIZE = 100
+TREE_PREMATCH_NODE_LIMIT = 1000
 
 class TreeRecord(NamedTuple):
     name: str
@@ -57,7 +64,7 @@ class ScopedTreeRecord(NamedTuple):
     def get_treedefs(self) -> Set:
         return set([self.treedef])
 
-    def bind(self, collection, row: Row, uploadingAgentId: Optional[int], auditor: Auditor, cache: Optional[Dict]=None, row_index: Optional[int] = None) -> Union["BoundTreeRecord", ParseFailures]:
+    def bind(self, collection, row: Row, uploadingAgentId: Optional[int], auditor: Auditor, cache: Optional[MatchCache]=None, row_index: Optional[int] = None) -> Union["BoundTreeRecord", ParseFailures]:
         parsedFields: Dict[str, List[ParseResult]] = {}
         parseFails: List[ParseFailure] = []
         for rank, cols in self.ranks.items():
@@ -94,7 +101,7 @@ class MustMatchTreeRecord(TreeRecord):
         return ScopedMustMatchTreeRecord(*s)
 
 class ScopedMustMatchTreeRecord(ScopedTreeRecord):
-    def bind(self, collection, row: Row, uploadingAgentId: Optional[int], auditor: Auditor, cache: Optional[Dict]=None, row_index: Optional[int] = None) -> Union["BoundMustMatchTreeRecord", ParseFailures]:
+    def bind(self, collection, row: Row, uploadingAgentId: Optional[int], auditor: Auditor, cache: Optional[MatchCache]=None, row_index: Optional[int] = None) -> Union["BoundMustMatchTreeRecord", ParseFailures]:
         b = super().bind(collection, row, uploadingAgentId, auditor, cache, row_index)
         return b if isinstance(b, ParseFailures) else BoundMustMatchTreeRecord(*b)
 
@@ -105,10 +112,24 @@ class TreeDefItemWithParseResults(NamedTuple):
     def match_key(self) -> str:
         return repr((self.treedefitem.id, sorted(pr.match_key() for pr in self.results)))
 
+    def filters(self) -> Dict[str, Any]:
+        return {field: value for r in self.results for field, value in r.filter_on.items()}
+
+    def filters_key(self) -> Tuple:
+        return tuple(sorted(self.filters().items()))
+
+    def lookup_key(self) -> Tuple:
+        "Identifies the nodes of this rank having these filter values, wherever they are in the tree."
+        return (self.treedefitem.id, self.filters_key())
+
 MatchResult = Union[NoMatch, Matched, MatchedMultiple]
 
 MatchInfo = TypedDict('MatchInfo', {'id': int, 'name': str, 'definitionitem__name': str, 'definitionitem__rankid': int})
 
+# The existing nodes found for each rank lookup key paired with their
+# parent ids, or None for the lookups that found too many nodes.
+TreeNodeIndex = Dict[Tuple, Optional[List[Tuple[MatchInfo, Optional[int]]]]]
+
 class BoundTreeRecord(NamedTuple):
     name: str
     treedef: Any
@@ -117,7 +138,7 @@ class BoundTreeRecord(NamedTuple):
     parsedFields: Dict[str, List[ParseResult]]
     uploadingAgentId: Optional[int]
     auditor: Auditor
-    cache: Optional[Dict]
+    cache: Optional[MatchCache]
     disambiguation: Dict[str, int]
 
     def is_one_to_one(self) -> bool:
@@ -129,6 +150,33 @@ class BoundTreeRecord(NamedTuple):
     def filter_on(self, path: str) -> FilterPack:
         return FilterPack([], [])
 
+    def prematch_candidates(self) -> Iterator[Tuple[Any, Callable[[], Any]]]:
+        return iter(())
+
+    def prematched_id(self) -> Tuple[bool, Optional[int]]:
+        """Return (True, id) if the rank path of this record is matched
+        completely by the lookups already in the cache, or None if there is
+        no path to match. Returns (False, None) otherwise.
+        """
+        tdiwprs = self._to_match()
+        if not tdiwprs:
+            return True, None
+        if self.disambiguation or self.cache is None:
+            return False, None
+
+        parent: Optional[MatchInfo] = None
+        for to_match in tdiwprs:
+            steps = self._descent_steps(parent, to_match)
+            matches = self.cache.peek(self._descent_cache_key(steps, parent, to_match), None)
+            if matches is None or len(matches) != 1:
+                return False, None
+            parent = matches[0]
+        assert parent is not None
+        return True, parent['id']
+
+    def tree_records(self) -> Iterator["BoundTreeRecord"]:
+        yield self
+
     def match_row(self) -> UploadResult:
         return self._handle_row(must_match=True)
 
@@ -218,15 +266,22 @@ class BoundTreeRecord(NamedTuple):
                 info = ReportInfo(tableName=self.name, columns=matched_cols + [r.column for r in to_match.results], treeInfo=None)
                 return tdiwprs, NoMatch(info) # no levels matched at all
 
-    def _find_matching_descendent(self, parent: Optional[MatchInfo], to_match: TreeDefItemWithParseResults) -> List[MatchInfo]:
+    def _descent_steps(self, parent: Optional[MatchInfo], to_match: TreeDefItemWithParseResults) -> int:
+        "The number of levels below 'parent' at which 'to_match' may be found."
         steps = sum(1 for tdi in self.treedefitems if parent['definitionitem__rankid'] < tdi.rankid <= to_match.treedefitem.rankid) \
             if parent is not None else 1
 
         assert steps > 0, (parent, to_match)
+        return steps
 
-        filters = {field: value for r in to_match.results for field, value in r.filter_on.items()}
+    def _descent_cache_key(self, steps: int, parent: Optional[MatchInfo], to_match: TreeDefItemWithParseResults) -> Tuple:
+        return (self.name, steps, parent and parent['id'], to_match.treedefitem.id, to_match.filters_key())
 
-        cache_key = (self.name, steps, parent and parent['id'], to_match.treedefitem.id, tuple(sorted(filters.items())))
+    def _find_matching_descendent(self, parent: Optional[MatchInfo], to_match: TreeDefItemWithParseResults) -> List[MatchInfo]:
+        steps = self._descent_steps(parent, to_match)
+        filters = to_match.filters()
+
+        cache_key = self._descent_cache_key(steps, parent, to_match)
         cached: Optional[List[MatchInfo]] = self.cache.get(cache_key, None) if self.cache is not None else None
         if cached is not None:
             return cached
@@ -246,6 +301,37 @@ class BoundTreeRecord(NamedTuple):
 
         return matches
 
+    def _prematch_path(self, tdiwprs: List[TreeDefItemWithParseResults], nodes: "TreeNodeIndex", parents: Dict[int, Optional[int]]) -> None:
+        """Walk the rank path 'tdiwprs' down the in memory index of existing
+        'nodes' and their 'parents' the same way _match does, adding the
+        matches found at each rank to the cache. Stops at the first rank
+        that does not match exactly one node, or that was not loaded.
+        """
+        assert self.cache is not None
+        parent: Optional[MatchInfo] = None
+        for to_match in tdiwprs:
+            candidates = nodes.get(to_match.lookup_key(), None)
+            if candidates is None:
+                return
+
+            steps = self._descent_steps(parent, to_match)
+            matches: List[MatchInfo] = []
+            for d in range(steps):
+                matches = [
+                    node for node, parent_id in candidates
+                    if parent is None or _ancestor(parents, parent_id, d) == parent['id']
+                ][:10]
+                if matches:
+                    break
+
+            if not matches:
+                return
+
+            self.cache[self._descent_cache_key(steps, parent, to_match)] = matches
+            if len(matches) != 1:
+                return
+            parent = matches[0]
+
     def _upload(self, to_upload: List[TreeDefItemWithParseResults], matched: Union[Matched, NoMatch]) -> UploadResult:
         assert to_upload, f"Invalid Error: {to_upload}, can not upload matched resluts: {matched}"
         model = getattr(models, self.name)
@@ -360,3 +446,85 @@ class BoundMustMatchTreeRecord(BoundTreeRecord):
 
     def process_row(self) -> UploadResult:
         return self._handle_row(must_match=True)
+
+def prematch_tree_paths(records: List[BoundTreeRecord], cache: MatchCache) -> None:
+    """Resolve the rank paths of the bound tree 'records' against the
+    existing tree nodes and add the matches found along them to 'cache',
+    so that _find_matching_descendent finds them instead of querying
+    rank by rank for every row.
+
+    The nodes having the names (and other filter values) used at each
+    rank are loaded in bulk together with all their ancestors, and the
+    paths are then walked over that in memory name/parent index. Only
+    the ranks that match are cached; the rest, along with the lookups
+    finding more than TREE_PREMATCH_NODE_LIMIT nodes and the records
+    carrying disambiguations, are left to the per row queries.
+    """
+    by_tree: Dict[str, List[Tuple[BoundTreeRecord, List[TreeDefItemWithParseResults]]]] = defaultdict(list)
+    for record in records:
+        if record.disambiguation:
+            continue
+        tdiwprs = record._to_match()
+        if tdiwprs:
+            by_tree[record.name].append((record, tdiwprs))
+
+    for name, paths in by_tree.items():
+        model = getattr(models, name)
+        lookups = {tdiwpr.lookup_key() for _, tdiwprs in paths for tdiwpr in tdiwprs}
+        nodes = _load_tree_nodes(model, lookups)
+        parents = _load_ancestors(model, nodes)
+        for record, tdiwprs in paths:
+            record._prematch_path(tdiwprs, nodes, parents)
+
+def _load_tree_nodes(model, lookups: Set[Tuple]) -> TreeNodeIndex:
+    keys = list(lookups)
+    nodes: TreeNodeIndex = {}
+    for start in range(0, len(keys), TREE_PREMATCH_BATCH_SIZE):
+        batch = keys[start:start + TREE_PREMATCH_BATCH_SIZE]
+        querysets = [
+            model.objects.filter(definitionitem_id=treedefitem_id, **dict(filters))
+            .annotate(prematch_index=Value(index, output_field=IntegerField()))
+            .values_list('prematch_index', 'id', 'name', 'definitionitem__name', 'definitionitem__rankid', 'parent_id')
+            [:TREE_PREMATCH_NODE_LIMIT + 1]
+            for index, (treedefitem_id, filters) in enumerate(batch)
+        ]
+        combined = querysets[0].union(*querysets[1:], all=True) if len(querysets) > 1 else querysets[0]
+
+        found: Dict[int, List[Tuple[MatchInfo, Optional[int]]]] = defaultdict(list)
+        for index, id, name, rank_name, rankid, parent_id in combined:
+            node: MatchInfo = {'id': id, 'name': name, 'definitionitem__name': rank_name, 'definitionitem__rankid': rankid}
+            found[index].append((node, parent_id))
+
+        for index, key in enumerate(batch):
+            candidates = found[index]
+            nodes[key] = candidates if len(candidates) <= TREE_PREMATCH_NODE_LIMIT else None
+
+    return nodes
+
+def _load_ancestors(model, nodes: TreeNodeIndex) -> Dict[int, Optional[int]]:
+    "Return the parent ids of all the ancestors of the indexed 'nodes'."
+    parents: Dict[int, Optional[int]] = {}
+    pending = {
+        parent_id
+        for candidates in nodes.values() if candidates is not None
+        for _, parent_id in candidates if parent_id is not None
+    }
+    while pending:
+        ids = list(pending)
+        pending = set()
+        for start in range(0, len(ids), TREE_PREMATCH_NODE_LIMIT):
+            for id, parent_id in model.objects.filter(id__in=ids[start:start + TREE_PREMATCH_NODE_LIMIT]).values_list('id', 'parent_id'):
+                parents[id] = parent_id
+                if parent_id is not None and parent_id not in parents:
+                    pending.add(parent_id)
+        pending -= parents.keys()
+
+    return parents
+
+def _ancestor(parents: Dict[int, Optional[int]], parent_id: Optional[int], d: int) -> Optional[int]:
+    "The ancestor 'd' levels above the node with parent 'parent_id'."
+    for _ in range(d):
+        if parent_id is None:
+            return None
+        parent_id = parents.get(parent_id, None)
+    return parent_id
@@ -2,11 +2,13 @@ import csv
 import json
 import logging
 import time
+from collections import defaultdict
 from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import List, Dict, Union, Callable, Optional, Sized, Tuple, Any
+from typing import List, Dict, Union, Callable, Optional, Tuple, Any, Set
 
 from django.db import transaction
+from django.db.models import IntegerField, Value
 from django.db.utils import OperationalError, IntegrityError
 from jsonschema import validate  # type: ignore
 
@@ -14,14 +16,16 @@ from specifyweb.specify import models
 from specifyweb.specify.datamodel import datamodel
 from specifyweb.specify.auditlog import auditlog
 from specifyweb.specify.datamodel import Table
-from specifyweb.specify.tree_extras import renumber_tree, set_fullnames
-from specifyweb.workbench.upload.upload_table import DeferredScopeUploadTable, ScopedUploadTable
+from specifyweb.specify.tree_extras import renumber_and_set_fullnames
+from specifyweb.workbench.upload.upload_table import DeferredScopeUploadTable, ScopedUploadTable, MATCH_LIMIT
 
 from . import disambiguation
+from .match_cache import MatchCache
+from .treerecord import prematch_tree_paths
 from .upload_plan_schema import schema, parse_plan_with_basetable
 from .upload_result import Uploaded, UploadResult, ParseFailures, \
     json_to_UploadResult
-from .uploadable import ScopedUploadable, Row, Disambiguation, Auditor
+from .uploadable import ScopedUploadable, BoundUploadable, Row, Disambiguation, Auditor
 from ..models import Spdataset
 
 Rows = Union[List[Row], csv.DictReader]
@@ -29,6 +33,9 @@ Progress = Callable[[int, Optional[int]], None]
 
 logger = logging.getLogger(__name__)
 
+# Number of distinct match lookups combined into one statement by prematch.
+PREMATCH_BATCH_SIZE = 100
+
 class RollbackFailure(Exception):
     pass
 
@@ -125,7 +132,8 @@ def do_upload_dataset(
     disambiguation = [get_disambiguation_from_row(ncols, row) for row in ds.data]
     base_table, upload_plan = get_ds_upload_plan(collection, ds)
 
-    results = do_upload(collection, rows, upload_plan, uploading_agent_id, disambiguation, no_commit, allow_partial, progress)
+    cache = MatchCache()
+    results = do_upload(collection, rows, upload_plan, uploading_agent_id, disambiguation, no_commit, allow_partial, progress, cache)
     success = not any(r.contains_failure() for r in results)
     if not no_commit:
         ds.uploadresult = {
@@ -133,6 +141,7 @@ def do_upload_dataset(
             'timestamp': datetime.now(timezone.utc).isoformat(),
             'recordsetid': None,
             'uploadingAgentId': uploading_agent_id,
+            'matchCache': cache.stats(),
         }
     ds.rowresults = json.dumps([r.to_json() for r in results])
     ds.save(update_fields=['rowresults', 'uploadresult'])
@@ -231,34 +240,42 @@ def do_upload(
         disambiguations: Optional[List[Disambiguation]]=None,
         no_commit: bool=False,
         allow_partial: bool=True,
-        progress: Optional[Progress]=None
+        progress: Optional[Progress]=None,
+        cache: Optional[MatchCache]=None,
 ) -> List[UploadResult]:
-    cache: Dict = {}
+    if cache is None:
+        cache = MatchCache()
     _auditor = Auditor(collection=collection, audit_log=None if no_commit else auditlog,
                        # Done to allow checking skipping write permission check
                        # during validation
                        skip_create_permission_check=no_commit)
-    total = len(rows) if isinstance(rows, Sized) else None
+    if not isinstance(rows, list):
+        # apply_deferred_scopes and prematch both go through the rows.
+        rows = list(rows)
+    total = len(rows)
     deffered_upload_plan = apply_deferred_scopes(upload_plan, rows)
     with savepoint("main upload"):
         tic = time.perf_counter()
+        bound = prematch(collection, rows, deffered_upload_plan, uploading_agent_id, disambiguations, cache, _auditor)
+        logger.info(f"prematched {len(cache)} lookups in {time.perf_counter()-tic}s")
         results: List[UploadResult] = []
-        for i, row in enumerate(rows):
-            _cache = cache.copy() if cache is not None and allow_partial else cache
-            da = disambiguations[i] if disambiguations else None
+        for bind_result in bound:
+            cache.begin_row()
             with savepoint("row upload") if allow_partial else no_savepoint():
-                bind_result = deffered_upload_plan.disambiguate(da).bind(collection, row, uploading_agent_id, _auditor, cache, i)
                 result = UploadResult(bind_result, {}, {}) if isinstance(bind_result, ParseFailures) else bind_result.process_row()
                 results.append(result)
                 if progress is not None:
                     progress(len(results), total)
-                logger.info(f"finished row {len(results)}, cache size: {cache and len(cache)}")
+                logger.info(f"finished row {len(results)}, cache size: {len(cache)}")
                 if result.contains_failure():
-                    cache = _cache
+                    # The matches cached for the row may refer to records
+                    # the savepoint is about to roll back.
+                    cache.rollback_row()
                     raise Rollback("failed row")
+            cache.end_row()
 
         toc = time.perf_counter()
-        logger.info(f"finished upload of {len(results)} rows in {toc-tic}s")
+        logger.info(f"finished upload of {len(results)} rows in {toc-tic}s, match cache: {cache.stats()}")
 
         if no_commit:
             raise Rollback("no_commit option")
@@ -269,6 +286,76 @@ def do_upload(
 
 do_upload_csv = do_upload
 
+def prematch(
+        collection,
+        rows: List[Row],
+        upload_plan: ScopedUploadable,
+        uploading_agent_id: int,
+        disambiguations: Optional[List[Disambiguation]],
+        cache: MatchCache,
+        auditor: Optional[Auditor]=None,
+) -> List[Union[BoundUploadable, ParseFailures]]:
+    """Bind all the rows and look up the matches of their tables ahead of
+    processing them, adding the ones that match existing records to
+    'cache' so that process_row finds them there instead of querying per
+    row. Returns the bind results for process_row to be called on.
+
+    The tree records are resolved first by prematch_tree_paths. The
+    tables are then resolved level by level: the ones with no to-ones
+    first, then the ones whose to-ones were all matched from the cache
+    by the previous level (e.g. Locality once its Geography is known,
+    then CollectingEvent once its Locality is). The distinct lookups of
+    each level are combined PREMATCH_BATCH_SIZE at a time into single
+    UNION ALL statements.
+    """
+    if auditor is None:
+        auditor = Auditor(collection, None)
+
+    bound: List[Union[BoundUploadable, ParseFailures]] = []
+    tree_records: List[Any] = []
+    for i, row in enumerate(rows):
+        da = disambiguations[i] if disambiguations else None
+        bind_result = upload_plan.disambiguate(da).bind(collection, row, uploading_agent_id, auditor, cache, i)
+        bound.append(bind_result)
+        if not isinstance(bind_result, ParseFailures):
+            tree_records.extend(bind_result.tree_records())
+
+    prematch_tree_paths(tree_records, cache)
+
+    tried: Set[Tuple] = set()
+    while True:
+        pending: Dict[Tuple, Any] = {}
+        for bind_result in bound:
+            if isinstance(bind_result, ParseFailures):
+                continue
+            for key, queryset in bind_result.prematch_candidates():
+                if key not in pending and key not in tried and key not in cache:
+                    pending[key] = queryset
+        if not pending:
+            break
+        tried.update(pending)
+        _prematch_lookups(pending, cache)
+
+    return bound
+
+def _prematch_lookups(pending: Dict[Tuple, Callable[[], Any]], cache: MatchCache) -> None:
+    keys = list(pending)
+    for start in range(0, len(keys), PREMATCH_BATCH_SIZE):
+        batch = keys[start:start + PREMATCH_BATCH_SIZE]
+        querysets = [
+            pending[key]().annotate(prematch_index=Value(index, output_field=IntegerField()))
+            .values_list('prematch_index', 'id')[:MATCH_LIMIT]
+            for index, key in enumerate(batch)
+        ]
+        combined = querysets[0].union(*querysets[1:], all=True) if len(querysets) > 1 else querysets[0]
+
+        matches: Dict[int, List[int]] = defaultdict(list)
+        for index, id in combined:
+            matches[index].append(id)
+
+        for index, ids in matches.items():
+            cache[batch[index]] = ids
+
 def validate_row(collection, upload_plan: ScopedUploadable, uploading_agent_id: int, row: Row, da: Disambiguation) -> UploadResult:
     retries = 3
     while True:
@@ -298,16 +385,12 @@ def fixup_trees(upload_plan: ScopedUploadable, results: List[UploadResult]) -> N
 
     for tree in to_fix:
         tic = time.perf_counter()
-        renumber_tree(tree)
+        renumber_and_set_fullnames(tree, [
+            treedef for treedef in treedefs
+            if treedef.specify_model.name.lower().startswith(tree)
+        ])
         toc = time.perf_counter()
-        logger.info(f"finished renumber of {tree} tree in {toc-tic}s")
-
-        for treedef in treedefs:
-            if treedef.specify_model.name.lower().startswith(tree):
-                tic = time.perf_counter()
-                set_fullnames(treedef, null_only=True)
-                toc = time.perf_counter()
-                logger.info(f"finished reset fullnames of {tree} tree in {toc-tic}s")
+        logger.info(f"finished renumber and reset fullnames of {tree} tree in {toc-tic}s")
 
 def changed_tree(tree: str, result: UploadResult) -> bool:
     return (isinstance(result.record_result, Uploaded) and result.record_result.info.tableName.lower() == tree) \
@@ -1,13 +1,14 @@
 
 import logging
 from functools import reduce
-from typing import List, Dict, Any, NamedTuple, Union, Optional, Set, Callable, Literal, cast
+from typing import List, Dict, Any, Iterator, NamedTuple, Union, Optional, Set, Tuple, Callable, Literal, cast
 
 from django.db import transaction, IntegrityError
 
 from specifyweb.businessrules.exceptions import BusinessRuleException
 from specifyweb.specify import models
 from .column_options import ColumnOptions, ExtendedColumnOptions
+from .match_cache import MatchCache
 from .parsing import parse_many, ParseResult, ParseFailure
 from .tomany import ToManyRecord, ScopedToManyRecord, BoundToManyRecord
 from .upload_result import UploadResult, Uploaded, NoMatch, Matched, \
@@ -18,6 +19,9 @@ from .uploadable import FilterPack, Exclude, Row, Uploadable, ScopedUploadable,
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of matching records looked up for a row.
+MATCH_LIMIT = 10
+
 
 class UploadTable(NamedTuple):
     name: str
@@ -145,7 +149,7 @@ class DeferredScopeUploadTable(NamedTuple):
             set(td for toMany in self.toMany.values() for tmr in toMany for td in tmr.get_treedefs()) # type: ignore
         )
 
-    def bind(self, default_collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[Dict]=None, row_index: Optional[int] = None
+    def bind(self, default_collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[MatchCache]=None, row_index: Optional[int] = None
              ) -> Union["BoundUploadTable", ParseFailures]:
         
         scoped = None
@@ -238,7 +242,7 @@ class ScopedUploadTable(NamedTuple):
         )
 
 
-    def bind(self, collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[Dict]=None, row_index: Optional[int] = None
+    def bind(self, collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[MatchCache]=None, row_index: Optional[int] = None
              ) -> Union["BoundUploadTable", ParseFailures]:
         parsedFields, parseFails = parse_many(collection, self.name, self.wbcols, row)
 
@@ -286,7 +290,7 @@ class OneToOneTable(UploadTable):
         return { 'oneToOneTable': self._to_json() }
 
 class ScopedOneToOneTable(ScopedUploadTable):
-    def bind(self, collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[Dict]=None, row_index: Optional[int] = None
+    def bind(self, collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[MatchCache]=None, row_index: Optional[int] = None
              ) -> Union["BoundOneToOneTable", ParseFailures]:
         b = super().bind(collection, row, uploadingAgentId, auditor, cache, row_index)
         return BoundOneToOneTable(*b) if isinstance(b, BoundUploadTable) else b
@@ -300,7 +304,7 @@ class MustMatchTable(UploadTable):
         return { 'mustMatchTable': self._to_json() }
 
 class ScopedMustMatchTable(ScopedUploadTable):
-    def bind(self, collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[Dict]=None, row_index: Optional[int] = None
+    def bind(self, collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[MatchCache]=None, row_index: Optional[int] = None
              ) -> Union["BoundMustMatchTable", ParseFailures]:
         b = super().bind(collection, row, uploadingAgentId, auditor, cache, row_index)
         return BoundMustMatchTable(*b) if isinstance(b, BoundUploadTable) else b
@@ -316,7 +320,7 @@ class BoundUploadTable(NamedTuple):
     disambiguation: Optional[int]
     uploadingAgentId: Optional[int]
     auditor: Auditor
-    cache: Optional[Dict]
+    cache: Optional[MatchCache]
 
     def is_one_to_one(self) -> bool:
         return False
@@ -421,14 +425,79 @@ class BoundUploadTable(NamedTuple):
             sorted(self.toOne.items(), key=lambda kv: kv[0]) # make the upload order deterministic
         }
 
-    def _match(self, model, toOneResults: Dict[str, UploadResult], toManyFilters: FilterPack, info: ReportInfo) -> Union[Matched, MatchedMultiple, None]:
+    def prematch_candidates(self) -> Iterator[Tuple[Tuple, Callable[[], Any]]]:
+        """Yield the match cache key and a function returning the matching
+        queryset of this table and of the tables bound within it whose
+        match lookups can be known before the row is processed. Those are
+        the tables whose to-one records all have a prematched_id(), so a
+        table becomes a candidate once its to-ones are found in the cache.
+        """
+        for toOne in self.toOne.values():
+            yield from toOne.prematch_candidates()
+
+        for records in self.toMany.values():
+            for record in records:
+                for toOne in record.toOne.values():
+                    yield from toOne.prematch_candidates()
+
+        lookup = self._prematch_lookup()
+        if lookup is not None:
+            model, cache_key, filters, toManyFilters = lookup
+            if any(v is not None for v in filters.values()) or toManyFilters.filters:
+                yield cache_key, lambda: self._match_queryset(model, filters, toManyFilters)
+
+    def prematched_id(self) -> Tuple[bool, Optional[int]]:
+        """Return (True, id) if the cache already determines the id this
+        table will be matched to when the row is processed, or None if it
+        will be a null record. Returns (False, None) otherwise.
+        """
+        lookup = self._prematch_lookup()
+        if lookup is None:
+            return False, None
+        model, cache_key, filters, toManyFilters = lookup
+
+        attrs = [value for parsedField in self.parsedFields for value in parsedField.upload.values()]
+        toOneIds = [filters[model._meta.get_field(fieldname).attname] for fieldname in self.toOne]
+        if all(v is None for v in attrs + toOneIds) and not toManyFilters.filters:
+            return True, None
+
+        ids = self.cache.peek(cache_key, None) if self.cache is not None else None
+        return (True, ids[0]) if ids is not None and len(ids) == 1 else (False, None)
+
+    def _prematch_lookup(self) -> Optional[Tuple[Any, Tuple, Dict[str, Any], FilterPack]]:
+        if self.disambiguation is not None:
+            return None
+
+        toOneIds: Dict[str, Optional[int]] = {}
+        for fieldname, toOne in self.toOne.items():
+            known, id = toOne.prematched_id()
+            if not known:
+                return None
+            toOneIds[fieldname] = id
+
+        model = getattr(models, self.name.capitalize())
+        toManyFilters = _to_many_filters_and_excludes(self.toMany)
+        cache_key, filters = self._match_filters(model, toOneIds, toManyFilters)
+        return model, cache_key, filters, toManyFilters
+
+    def tree_records(self) -> Iterator[Any]:
+        "Yield the tree records bound within this table."
+        for toOne in self.toOne.values():
+            yield from toOne.tree_records()
+
+        for records in self.toMany.values():
+            for record in records:
+                for toOne in record.toOne.values():
+                    yield from toOne.tree_records()
+
+    def _match_filters(self, model, toOneIds: Dict[str, Any], toManyFilters: FilterPack) -> Tuple[Tuple, Dict[str, Any]]:
         filters = {
             fieldname_: value
             for parsedField in self.parsedFields
             for fieldname_, value in parsedField.filter_on.items()
         }
 
-        filters.update({ model._meta.get_field(fieldname).attname: r.get_id() for fieldname, r in toOneResults.items() })
+        filters.update({ model._meta.get_field(fieldname).attname: id for fieldname, id in toOneIds.items() })
 
         cache_key = (
             self.name,
@@ -437,22 +506,29 @@ class BoundUploadTable(NamedTuple):
             tuple(sorted(self.scopingAttrs.items())),
             tuple(sorted(self.static.items())),
         )
+        return cache_key, filters
+
+    def _match_queryset(self, model, filters: Dict[str, Any], toManyFilters: FilterPack):
+        to_many_filters, to_many_excludes = toManyFilters
+
+        return reduce(lambda q, e: q.exclude(**{e.lookup: getattr(models, e.table).objects.filter(**e.filter)}),
+                      to_many_excludes,
+                      reduce(lambda q, f: q.filter(**f),
+                             to_many_filters,
+                             model.objects.filter(**filters, **self.scopingAttrs, **self.static)))
+
+    def _match(self, model, toOneResults: Dict[str, UploadResult], toManyFilters: FilterPack, info: ReportInfo) -> Union[Matched, MatchedMultiple, None]:
+        cache_key, filters = self._match_filters(model, {fieldname: r.get_id() for fieldname, r in toOneResults.items()}, toManyFilters)
 
         cache_hit: Optional[List[int]] = self.cache.get(cache_key, None) if self.cache is not None else None
         if cache_hit is not None:
             ids = cache_hit
         else:
-            to_many_filters, to_many_excludes = toManyFilters
-
-            qs = reduce(lambda q, e: q.exclude(**{e.lookup: getattr(models, e.table).objects.filter(**e.filter)}),
-                        to_many_excludes,
-                        reduce(lambda q, f: q.filter(**f),
-                               to_many_filters,
-                               model.objects.filter(**filters, **self.scopingAttrs, **self.static)))
+            qs = self._match_queryset(model, filters, toManyFilters)
 
-            ids = list(qs.values_list('id', flat=True)[:10])
+            ids = list(qs.values_list('id', flat=True)[:MATCH_LIMIT])
 
-            if self.cache and ids:
+            if self.cache is not None and ids:
                 self.cache[cache_key] = ids
 
         n_matched = len(ids)
@@ -531,6 +607,9 @@ class BoundUploadTable(NamedTuple):
         for parsedField in self.parsedFields:
             if parsedField.add_to_picklist is not None:
                 a = parsedField.add_to_picklist
+                if a.picklist.picklistitems.filter(title=a.value).exists():
+                    # Added by an earlier row since this one was bound.
+                    continue
                 pli = a.picklist.picklistitems.create(value=a.value, title=a.value, createdbyagent_id=self.uploadingAgentId)
                 self.auditor.insert(pli, self.uploadingAgentId, None)
                 added_picklist_items.append(PicklistAddition(name=a.picklist.name, caption=a.column, value=a.value, id=pli.id))
@@ -570,7 +649,7 @@ def _to_many_filters_and_excludes(to_manys: Dict[str, List[BoundToManyRecord]])
     return FilterPack(filters, excludes)
 
 
-def _upload_to_manys(parent_model, parent_id, parent_field, uploadingAgentId: Optional[int], auditor: Auditor, cache: Optional[Dict], records) -> List[UploadResult]:
+def _upload_to_manys(parent_model, parent_id, parent_field, uploadingAgentId: Optional[int], auditor: Auditor, cache: Optional[MatchCache], records) -> List[UploadResult]:
     fk_field = parent_model._meta.get_field(parent_field).remote_field.attname
 
     return [
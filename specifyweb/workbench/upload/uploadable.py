@@ -1,8 +1,9 @@
-from typing import List, Dict, Tuple, Any, NamedTuple, Optional, Union, Set
+from typing import List, Dict, Tuple, Any, Iterator, NamedTuple, Optional, Union, Set, Callable
 from typing_extensions import Protocol, Literal
 
 from .upload_result import UploadResult, ParseFailures
 from .auditor import Auditor
+from .match_cache import MatchCache
 
 class Uploadable(Protocol):
     def apply_scoping(self, collection) -> "ScopedUploadable":
@@ -39,7 +40,7 @@ class ScopedUploadable(Protocol):
     def disambiguate(self, disambiguation: Disambiguation) -> "ScopedUploadable":
         ...
 
-    def bind(self, collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[Dict]=None, row_index: Optional[int] = None) -> Union["BoundUploadable", ParseFailures]:
+    def bind(self, collection, row: Row, uploadingAgentId: int, auditor: Auditor, cache: Optional[MatchCache]=None, row_index: Optional[int] = None) -> Union["BoundUploadable", ParseFailures]:
         ...
 
     def get_treedefs(self) -> Set:
@@ -85,3 +86,12 @@ class BoundUploadable(Protocol):
     def force_upload_row(self) -> UploadResult:
         ...
 
+    def prematch_candidates(self) -> Iterator[Tuple[Any, Callable[[], Any]]]:
+        ...
+
+    def prematched_id(self) -> Tuple[bool, Optional[int]]:
+        ...
+
+    def tree_records(self) -> Iterator[Any]:
+        ...
+